@@ -1,26 +1,30 @@
+import json
 import logging
-import threading
-from logging.handlers import RotatingFileHandler
+import time
 
-from flask import Flask, request, make_response, jsonify
+from flask import Flask, Response, request, make_response, jsonify
 from flask_cors import CORS
 
+from common.custom_logging import CustomLogger
+from common.metrics import MetricsRegistry, instrument_app, instrument_engine, instrument_helper
 from runlogic.TriggerRuns import TriggerRun
 from tableaccess.AccessFactory import AccessFactory
+from tableaccess.TableHelperSQLAlchemy import TIMED_METHODS
+from tableaccess.properties import Properties, RunStates
 
 app = Flask(__name__)
 
 CORS(app)
 
-rlock = threading.RLock()
-
 table_helper = AccessFactory.get_db_conn_service()
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler = RotatingFileHandler(filename='logs/flask.log', maxBytes=1000000, backupCount=5)
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.DEBUG)
-app.logger.addHandler(file_handler)
+metrics = MetricsRegistry()
+instrument_app(app, metrics)
+instrument_engine(table_helper.engine, metrics)
+instrument_helper(table_helper, metrics, TIMED_METHODS)
+
+for handler in CustomLogger.handlers(filename='logs/flask.log', console=False):
+    app.logger.addHandler(handler)
 app.logger.setLevel(logging.DEBUG)
 
 
@@ -38,43 +42,118 @@ def validate_request(request: request):
 @app.route("/run", methods=["POST"])
 def add_run():
     app.logger.info(f'Add run: {request}')
-    with rlock:
-        try:
-            payload = validate_request(request)
-            run_id = table_helper.add_run_to_queue(payload['run_name'])
-            return make_response(jsonify({"run_id": run_id}))
-        except Exception as e:
-            return make_response(jsonify({"exception": e.__str__()}), 400)
+    try:
+        payload = validate_request(request)
+        run_id = table_helper.add_run_to_queue(payload['run_name'])
+        TriggerRun.notify()
+        return make_response(jsonify({"run_id": run_id}))
+    except Exception as e:
+        return make_response(jsonify({"exception": e.__str__()}), 400)
+
+
+def run_page(run_state=None):
+    """
+    Run listing of one state, paginated by query string
+    after_run_id -> keyset cursor, the last run_id of the previous page
+    limit        -> page size, every remaining run when omitted
+    fields       -> comma separated subset of run_id, run_name, run_state
+    A full page carries the cursor of the next one in the X-Next-After-Run-Id header
+    :param run_state: RunStates value, None for every run
+    :return:
+    """
+    try:
+        after_run_id = int(request.args['after_run_id']) if 'after_run_id' in request.args else None
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be positive')
+        fields = request.args.get('fields')
+        fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+        runs = table_helper.list_runs(run_state, after_run_id=after_run_id, limit=limit, fields=fields)
+    except ValueError as e:
+        return make_response(jsonify({"exception": e.__str__()}), 400)
+    response = make_response(jsonify(runs))
+    if limit is not None and len(runs) == limit and 'run_id' in runs[-1]:
+        response.headers['X-Next-After-Run-Id'] = runs[-1]['run_id']
+    return response
 
 
 @app.route("/runs/running", methods=["GET"])
 def running_runs():
-    return make_response(jsonify(table_helper.running_runs()))
+    return run_page(RunStates.RUNNING.value)
 
 
 @app.route("/runs/pending", methods=["GET"])
 def pending_runs():
-    return make_response(jsonify(table_helper.pending_runs()))
+    return run_page(RunStates.PENDING.value)
 
 
 @app.route("/runs/failed", methods=["GET"])
 def failed_runs():
-    return make_response(jsonify(table_helper.failed_runs()))
+    return run_page(RunStates.FAILED.value)
 
 
 @app.route("/runs/successful", methods=["GET"])
 def successful_runs():
-    return make_response(jsonify(table_helper.successful_runs()))
+    return run_page(RunStates.SUCCESS.value)
 
 
 @app.route("/runs/initiated", methods=["GET"])
 def initiated_runs():
-    return make_response(jsonify(table_helper.initiated_runs()))
+    return run_page(RunStates.INITIATED.value)
 
 
 @app.route("/runs", methods=["GET"])
 def all_runs():
-    return make_response(jsonify(table_helper.all_runs()))
+    return run_page()
+
+
+def run_event_stream(after_event_id):
+    """
+    text/event-stream of RUN_EVENTS after after_event_id, one `run` event per change, until the client disconnects
+    Waits between reads on writes of this process and checks at least every Properties.run_events_poll_seconds for
+    those of other processes, with a keep-alive comment when nothing was sent for run_events_keepalive_seconds
+    When the events after the cursor were already pruned a `reset` event is sent first: the client should reload the
+    /runs listings, the stream then continues from the latest event
+    :param after_event_id: last event_id the client has seen, None for changes from now on
+    :return:
+    """
+    oldest, latest = table_helper.run_event_range()
+    yield f'retry: {Properties.run_events_retry_milliseconds}\n\n'
+    if after_event_id is None:
+        after_event_id = latest or 0
+    elif oldest is not None and after_event_id < oldest - 1:
+        yield f'id: {latest}\nevent: reset\ndata: {json.dumps({"event_id": latest})}\n\n'
+        after_event_id = latest
+    last_sent = time.monotonic()
+    while True:
+        seen = table_helper.run_event_writes
+        events = table_helper.run_events(after_event_id=after_event_id)
+        for run_event in events:
+            yield f'id: {run_event["event_id"]}\nevent: run\ndata: {json.dumps(run_event)}\n\n'
+        if events:
+            after_event_id = events[-1]['event_id']
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= Properties.run_events_keepalive_seconds:
+            yield ': keep-alive\n\n'
+            last_sent = time.monotonic()
+        table_helper.wait_for_run_events(seen, Properties.run_events_poll_seconds)
+
+
+@app.route("/runs/events", methods=["GET"])
+def run_events():
+    """
+    Server-sent events of run changes made by POST /run, DELETE /run/<run_id> and the schedulers of any process
+    Each event carries the run_id, run_name and new run_state (null once deleted) of one run, its id is the
+    event_id to resume from, sent back by EventSource in the Last-Event-ID header or as ?after_event_id=
+    :return:
+    """
+    try:
+        after_event_id = request.headers.get('Last-Event-ID') or request.args.get('after_event_id')
+        after_event_id = int(after_event_id) if after_event_id else None
+    except ValueError as e:
+        return make_response(jsonify({"exception": e.__str__()}), 400)
+    return Response(run_event_stream(after_event_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route("/queue", methods=["GET"])
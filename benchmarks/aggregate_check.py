@@ -0,0 +1,117 @@
+"""
+Validates every history/total read of CbyTSQLAlchemyTableHelper against plain SQL over the raw samples
+The reference queries group COST_BY_TIME directly, the way the helper did before the hourly rollup:
+    service/tag history -> avg(cost) per (hour, service, tag)
+    service history     -> sum(cost) per (minute, service), then avg per (hour, service); tag alike
+    totals              -> sum of those hourly averages per value
+Results are compared as multisets with costs rounded to --places decimals, so float summation order and the
+order of set based totals don't matter
+
+    python -m benchmarks.aggregate_check --rows 50000 --hours 5 24 200
+Exits non zero on any difference
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+import sqlalchemy
+
+from benchmarks.harness import scratch_dir, scratch_db
+from benchmarks.synthetic import generate_samples, load_samples
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.properties import CloudType
+
+# Service and tag names are read through their dimension tables
+NAMED_SAMPLES = """
+COST_BY_TIME LEFT JOIN SERVICE_DIMENSION AS service ON service.id = service_id
+LEFT JOIN TAG_DIMENSION AS tag ON tag.id = tag_id
+"""
+
+PER_SERVICE_AND_TAG = f"""
+SELECT strftime('%Y-%m-%d %H', timestamp), service.name, tag.name, avg(cost_per_hour) FROM {NAMED_SAMPLES}
+WHERE cloud_type = :cloud AND timestamp >= :since GROUP BY 1, 2, 3
+"""
+
+PER_DIMENSION = f"""
+SELECT strftime('%Y-%m-%d %H', minute), value, avg(cost) FROM (
+    SELECT strftime('%Y-%m-%d %H:%M', timestamp) AS minute, {{dimension}}.name AS value, sum(cost_per_hour) AS cost
+    FROM {NAMED_SAMPLES}
+    WHERE cloud_type = :cloud AND timestamp >= :since AND (:value IS NULL OR {{dimension}}.name = :value)
+    GROUP BY 1, 2)
+GROUP BY 1, 2
+"""
+
+
+def reference(conn, cloud_type, since, service=None, tag=None):
+    """
+    :return: {helper method name: list of result dicts} computed with SQL alone
+    """
+    parameters = {'cloud': cloud_type.name, 'since': since}
+    per_service_and_tag = [{'timestamp': hour, 'service': service_name, 'tag': tag_name, 'cost_per_hour': cost}
+                           for hour, service_name, tag_name, cost in
+                           conn.execute(sqlalchemy.text(PER_SERVICE_AND_TAG), parameters)]
+    per_service = [{'timestamp': hour, 'service': value, 'cost_per_hour': cost} for hour, value, cost in
+                   conn.execute(sqlalchemy.text(PER_DIMENSION.format(dimension='service')),
+                                dict(parameters, value=service))]
+    per_tag = [{'timestamp': hour, 'tag': value, 'cost_per_hour': cost} for hour, value, cost in
+               conn.execute(sqlalchemy.text(PER_DIMENSION.format(dimension='tag')), dict(parameters, value=tag))]
+
+    def totals(rows, *keys):
+        summed = defaultdict(lambda: 0)
+        for row in rows:
+            summed[tuple(row[key] for key in keys)] += row['cost_per_hour']
+        return [dict(zip(keys, values), total_cost=total) for values, total in summed.items()]
+
+    return {
+        'aggregate_by_service_and_tag': per_service_and_tag,
+        'aggregate_by_service': per_service,
+        'aggregate_by_tag': per_tag,
+        'total_cost_by_service_and_tag': totals(per_service_and_tag, 'service', 'tag'),
+        'total_cost_by_service': totals(per_service, 'service'),
+        'total_cost_by_tag': totals(per_tag, 'tag'),
+    }
+
+
+def canonical(rows, places):
+    return sorted(json.dumps({key: round(value, places) if isinstance(value, float) else value
+                              for key, value in row.items()}, sort_keys=True) for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--hours', type=int, nargs='+', default=[5, 24, 200])
+    parser.add_argument('--places', type=int, default=6)
+    args = parser.parse_args()
+
+    failures = 0
+    with scratch_dir() as directory:
+        helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory))
+        # Polls on odd seconds and more than one sample per minute exercise the minute folding
+        load_samples(helper, generate_samples(args.rows, interval_seconds=47))
+        for cloud_type in CloudType:
+            for hours in args.hours:
+                for service, tag in ((None, None), ('EC2', 'DMX')):
+                    since = helper._effective_time_window(hours)
+                    with helper.engine.connect() as conn:
+                        expected = reference(conn, cloud_type, since, service, tag)
+                    actual = {
+                        'aggregate_by_service_and_tag': helper.aggregate_by_service_and_tag(cloud_type, hours),
+                        'aggregate_by_service': helper.aggregate_by_service(cloud_type, hours, service),
+                        'aggregate_by_tag': helper.aggregate_by_tag(cloud_type, hours, tag),
+                        'total_cost_by_service_and_tag': helper.total_cost_by_service_and_tag(cloud_type, hours),
+                        'total_cost_by_service': helper.total_cost_by_service(cloud_type, hours, service),
+                        'total_cost_by_tag': helper.total_cost_by_tag(cloud_type, hours, tag),
+                    }
+                    for name, rows in actual.items():
+                        same = canonical(rows, args.places) == canonical(expected[name], args.places)
+                        failures += not same
+                        print(f'{"ok  " if same else "FAIL"} {cloud_type.name} hours={hours} service={service} '
+                              f'tag={tag} {name} ({len(rows)} rows)')
+    print('OK' if not failures else f'{failures} mismatches')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Several scheduler processes draining one scratch RunQueue.db through SQLAlchemyTableHelper.claim_runs
+Phase 1-> --workers processes claim batches of --batch runs as fast as they can until the queue is empty;
+          every run must be claimed exactly once
+Phase 2-> a scheduler claims --abandoned runs under a short lease and dies without finishing them; the live
+          workers must reclaim each of them exactly once after the lease expires
+
+    python -m benchmarks.claim_stress --runs 2000 --workers 4 --batch 8
+Exits non zero on a double claim or a run left unclaimed
+"""
+import argparse
+import collections
+import multiprocessing
+import sys
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, print_table
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.properties import RunStates
+
+
+def worker(db_path, owner, batch, lease_seconds, idle_seconds, results):
+    """
+    Claim until nothing is claimable for idle_seconds, finishing each claimed run straight away
+    """
+    helper = AccessFactory.get_db_conn_service(db_path=db_path)
+    claimed, claims = [], 0
+    idle_since = time.perf_counter()
+    while time.perf_counter() - idle_since < idle_seconds:
+        run_ids = helper.claim_runs(owner, batch, lease_seconds)
+        if not run_ids:
+            time.sleep(0.01)
+            continue
+        claims += 1
+        idle_since = time.perf_counter()
+        claimed.extend(run_ids)
+        for run_id in run_ids:
+            helper.update_run_state(run_id, RunStates.SUCCESS.value)
+    results.put((owner, claims, claimed))
+
+
+def drain(db_path, workers, batch, lease_seconds, idle_seconds):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(db_path, f'worker-{i}', batch, lease_seconds, idle_seconds,
+                                                      results)) for i in range(workers)]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return collected, time.perf_counter() - start - idle_seconds
+
+
+def check(phase, expected, collected):
+    """
+    :return: list of problems, empty when every expected run was claimed exactly once
+    """
+    counts = collections.Counter(run_id for _, _, claimed in collected for run_id in claimed)
+    problems = [f'{phase}: run {run_id} claimed {count} times' for run_id, count in counts.items() if count > 1]
+    problems += [f'{phase}: run {run_id} never claimed' for run_id in sorted(set(expected) - set(counts))]
+    problems += [f'{phase}: run {run_id} was not expected' for run_id in sorted(set(counts) - set(expected))]
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=8)
+    parser.add_argument('--abandoned', type=int, default=50)
+    parser.add_argument('--lease-seconds', type=float, default=1)
+    args = parser.parse_args()
+
+    problems, rows = [], []
+    with scratch_dir() as directory:
+        db_path = scratch_db(directory, 'RunQueue.db')
+        helper = AccessFactory.get_db_conn_service(db_path=db_path)
+
+        queued = [helper.add_run_to_queue(f'stress-{i}') for i in range(args.runs)]
+        helper.engine.dispose()
+        collected, elapsed = drain(db_path, args.workers, args.batch, args.lease_seconds, idle_seconds=0.5)
+        problems += check('drain', queued, collected)
+        rows += [(owner, claims, len(claimed)) for owner, claims, claimed in collected]
+        rows.append(('drain total', sum(item[1] for item in collected), f'{args.runs / elapsed:,.0f} runs/sec'))
+
+        abandoned = [helper.add_run_to_queue(f'abandoned-{i}') for i in range(args.abandoned)]
+        held = helper.claim_runs('dead-scheduler', args.abandoned, args.lease_seconds)
+        if held != abandoned:
+            problems.append(f'dead-scheduler claimed {held}, expected {abandoned}')
+        helper.engine.dispose()
+        collected, _ = drain(db_path, args.workers, args.batch, args.lease_seconds,
+                             idle_seconds=args.lease_seconds * 2)
+        problems += check('reclaim', abandoned, collected)
+        rows.append(('reclaimed', sum(item[1] for item in collected), sum(len(item[2]) for item in collected)))
+
+        left = helper.pending_runs() + helper.initiated_runs() + helper.running_runs()
+        problems += [f'run {run["run_id"]} left in {run["run_state"]}' for run in left]
+
+    print_table(rows, ['owner', 'claims', 'runs'])
+    for problem in problems:
+        print(problem)
+    print('OK' if not problems else f'{len(problems)} problems')
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
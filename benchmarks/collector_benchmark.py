@@ -0,0 +1,168 @@
+"""
+Collection cycle time of runlogic.collectors.Collector with sources that each take --latency seconds to answer,
+the way a billing API call does, run one at a time (--workers 1, what the single poller loop amounted to) and
+concurrently. Every cycle's samples are written with one add_rows call
+A FileSource over an NDJSON file is collected alongside, and a source that always fails must back off rather
+than be retried every cycle
+Then a FileSource over a file with a malformed line is collected through a helper whose first write fails: the
+next cycle must write every good line once and only then move the committed offset to the end of the file
+
+    python -m benchmarks.collector_benchmark --sources 12 --latency 0.2
+Exits non zero if a cycle did not write every sample, the failing source was not backed off or samples of the
+failed write were lost or written twice
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, timed, print_table
+from benchmarks.synthetic import generate_samples
+from runlogic.collectors import Collector, ConsumptionSource, FileSource, RandomSource
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.properties import CloudType
+
+
+class SlowSource(RandomSource):
+    def __init__(self, cloud_type, latency, samples_per_cycle):
+        super().__init__(cloud_type, samples_per_cycle=samples_per_cycle)
+        self.latency = latency
+
+    def collect(self):
+        # An idle wait like a network call, so sources overlap on the pool
+        time.sleep(self.latency)
+        return super().collect()
+
+
+class FailingSource(ConsumptionSource):
+    def __init__(self):
+        super().__init__('failing')
+        self.calls = 0
+
+    def collect(self):
+        self.calls += 1
+        raise ConnectionError('billing API unavailable')
+
+
+class FlakyHelper:
+    """
+    Table helper whose first add_rows fails, like a locked or unreachable database
+    """
+
+    def __init__(self, helper):
+        self.helper = helper
+        self.failed = False
+
+    def add_rows(self, samples, chunk_size=5000):
+        if not self.failed:
+            self.failed = True
+            raise ConnectionError('database unavailable')
+        return self.helper.add_rows(samples, chunk_size)
+
+
+def write_samples(path, samples, malformed_at=None):
+    with open(path, 'w') as samples_file:
+        for i, sample in enumerate(samples):
+            if i == malformed_at:
+                samples_file.write('{"cloud_type": "gcp", "cost": \n')
+            samples_file.write(json.dumps(dict(sample, cloud_type=sample['cloud_type'].value,
+                                               timestamp=sample['timestamp'].isoformat())) + '\n')
+
+
+def recover(directory, samples):
+    """
+    :return: list of problems of the failed write and malformed line phase
+    """
+    helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory, 'recover.db'))
+    file_path = os.path.join(directory, 'malformed.ndjson')
+    write_samples(file_path, generate_samples(samples, clouds=[CloudType.gcp]), malformed_at=samples // 2)
+    file_source = FileSource(file_path)
+    collector = Collector([file_source], FlakyHelper(helper), jitter=0, clock=ManualClock())
+    problems = []
+    try:
+        collector.run_once(timeout=60)
+        problems.append('the failed write did not raise')
+    except ConnectionError:
+        pass
+    if file_source.offset != 0 or len(collector.unwritten) != samples:
+        problems.append(f'after the failed write: offset {file_source.offset}, {len(collector.unwritten)} kept')
+    written = collector.run_once(timeout=60)
+    collector.workers.shutdown()
+    with helper.engine.connect() as conn:
+        stored = conn.exec_driver_sql('SELECT count(*) FROM COST_BY_TIME').scalar()
+    if written != samples or stored != samples:
+        problems.append(f'after the retry: {written} written, {stored} stored, {samples} expected')
+    if file_source.offset != os.path.getsize(file_path):
+        problems.append(f'committed offset {file_source.offset}, file is {os.path.getsize(file_path)} bytes')
+    return problems
+
+
+class ManualClock:
+    """
+    Every source is due on every cycle unless it is backing off
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', type=int, default=12)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds each source takes')
+    parser.add_argument('--samples', type=int, default=50, help='samples per source and cycle')
+    parser.add_argument('--cycles', type=int, default=3)
+    args = parser.parse_args()
+
+    # Per cycle log lines would swamp the table
+    logging.getLogger('runlogic.collectors').setLevel(logging.ERROR)
+    rows = []
+    failures = 0
+    with scratch_dir() as directory:
+        helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory))
+        file_path = os.path.join(directory, 'samples.ndjson')
+        write_samples(file_path, generate_samples(args.samples, clouds=[CloudType.gcp]))
+
+        for workers in (1, args.sources):
+            clock = ManualClock()
+            clouds = list(CloudType)
+            failing = FailingSource()
+            file_source = FileSource(file_path)
+            sources = [SlowSource(clouds[i % len(clouds)], args.latency, args.samples) for i in range(args.sources)]
+            collector = Collector(sources + [file_source, failing], helper, max_workers=workers, jitter=0,
+                                  clock=clock)
+
+            def cycle():
+                written = collector.run_once(timeout=60)
+                clock.now += sources[0].interval_seconds
+                return written
+
+            written, median, best = timed(cycle, repeat=args.cycles)
+            expected = args.sources * args.samples
+            # Only the first cycle reads the file, later ones find nothing new
+            failures += written != expected
+            failures += failing.calls >= args.cycles
+            rows.append((workers, f'{median * 1000:.0f}', f'{best * 1000:.0f}', written, failing.calls))
+            collector.workers.shutdown()
+
+        with helper.engine.connect() as conn:
+            stored = conn.exec_driver_sql('SELECT count(*) FROM COST_BY_TIME').scalar()
+        expected = 2 * (args.sources * args.samples * args.cycles + args.samples)
+        failures += stored != expected
+        problems = recover(directory, args.samples)
+        failures += len(problems)
+    print_table(rows, ['workers', 'median cycle ms', 'min cycle ms', 'last cycle samples', 'failing source calls'])
+    print(f'{stored} samples stored, {expected} expected')
+    for problem in problems:
+        print(f'FAIL: {problem}')
+    print('OK' if not failures else f'{failures} failures')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Concurrent read/write throughput of the cost tracker database under different engine profiles
+One writer process ingests samples row by row (like the poller, without the sleep) while reader processes
+hammer the history/latest queries (like the Flask workers)
+
+    python -m benchmarks.concurrency_benchmark --seconds 10 --readers 4
+"""
+import argparse
+import datetime
+import multiprocessing
+import statistics
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from benchmarks.harness import scratch_dir, scratch_db, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.properties import EngineProfile, CloudType
+
+PROFILES = {
+    'legacy': EngineProfile(journal_mode='DELETE', synchronous='FULL', cache_size=None, mmap_size=None,
+                            busy_timeout=None, pool_class='NullPool'),
+    'wal': EngineProfile(),
+}
+
+
+def writer(db_path, profile, seconds, results):
+    helper = AccessFactory.get_cost_by_time_db_conn(db_path=db_path, profile=profile)
+    writes, errors = 0, 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            helper.add_row(cloud_type=CloudType.aws, cost=1500, service='EC2', tag='DMX',
+                           timestamp=datetime.datetime.now())
+            writes += 1
+        except OperationalError:
+            errors += 1
+    results.put(('writer', writes, errors, []))
+
+
+def reader(db_path, profile, seconds, results):
+    helper = AccessFactory.get_cost_by_time_db_conn(db_path=db_path, profile=profile)
+    queries = [lambda: helper.aggregate_by_service_and_tag(CloudType.aws, 24),
+               lambda: helper.latest_consumption_of_all_services(CloudType.aws)]
+    reads, errors, latencies = 0, 0, []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            queries[reads % len(queries)]()
+            latencies.append(time.perf_counter() - start)
+            reads += 1
+        except OperationalError:
+            errors += 1
+    results.put(('reader', reads, errors, latencies))
+
+
+def run_profile(db_path, profile, seconds, readers):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=writer, args=(db_path, profile, seconds, results))]
+    processes += [context.Process(target=reader, args=(db_path, profile, seconds, results)) for _ in range(readers)]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    writes = sum(item[1] for item in collected if item[0] == 'writer')
+    reads = sum(item[1] for item in collected if item[0] == 'reader')
+    errors = sum(item[2] for item in collected)
+    latencies = sorted(latency for item in collected for latency in item[3])
+    p99 = latencies[int(len(latencies) * 0.99)] if latencies else float('nan')
+    return writes / seconds, reads / seconds, statistics.median(latencies) if latencies else float('nan'), p99, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+
+    rows = []
+    with scratch_dir() as directory:
+        for name, profile in PROFILES.items():
+            db_path = scratch_db(directory, f'{name}.db')
+            helper = AccessFactory.get_cost_by_time_db_conn(db_path=db_path, profile=profile)
+            load_samples(helper, generate_samples(args.rows))
+            helper.engine.dispose()
+            writes, reads, p50, p99, errors = run_profile(db_path, profile, args.seconds, args.readers)
+            rows.append((name, f'{writes:,.0f}', f'{reads:,.0f}', f'{p50 * 1000:.2f}', f'{p99 * 1000:.2f}', errors))
+    print_table(rows, ['profile', 'writes/sec', 'reads/sec', 'read p50 ms', 'read p99 ms', 'locked errors'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Full history download versus since= deltas for a client polling after one new poll cycle
+For every window the full service history is fetched, one cycle of samples is added, and both the full history
+and the delta since the previous cursor are fetched again. The delta applied to the first history (its hours
+replaced) must equal the second full history
+
+    python -m benchmarks.delta_benchmark --rows 200000 --hours 24 200 720
+Exits non zero on any difference
+"""
+import argparse
+import datetime
+import json
+import sys
+
+from benchmarks.harness import scratch_dir, scratch_db, timed, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.properties import CloudType
+
+
+def apply_delta(history, delta):
+    """
+    History rows of the hours the delta leaves alone, plus the delta's rows, latest hour first
+    """
+    kept = [row for row in history
+            if row['timestamp'] not in delta['hours'] and row['timestamp'] >= delta['window_start']]
+    return sorted(kept + delta['result'], key=lambda row: row['timestamp'], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--hours', type=int, nargs='+', default=[24, 200, 720])
+    args = parser.parse_args()
+
+    rows = []
+    failures = 0
+    with scratch_dir() as directory:
+        helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory))
+        # Spread over a month so the wider windows hold more hours
+        load_samples(helper, generate_samples(args.rows, interval_seconds=60 * 60 * 24 * 30 * 48 // args.rows))
+        for hours in args.hours:
+            before = helper.aggregate_by_service(CloudType.aws, hours)
+            cursor = helper.history_since(CloudType.aws, 'service', 0, hours)['cursor']
+            load_samples(helper, generate_samples(48, end=datetime.datetime.now(), seed=hours))
+
+            full, full_median, _ = timed(lambda: helper.aggregate_by_service(CloudType.aws, hours))
+            delta, delta_median, _ = timed(lambda: helper.history_since(CloudType.aws, 'service', cursor, hours))
+            same = apply_delta(before, delta) == full
+            failures += not same
+            rows.append((hours, len(full), len(json.dumps(full)), f'{full_median * 1000:.2f}', len(delta['result']),
+                         len(json.dumps(delta)), f'{delta_median * 1000:.2f}', 'ok' if same else 'FAIL'))
+    print_table(rows, ['hours', 'full rows', 'full bytes', 'full ms', 'delta rows', 'delta bytes', 'delta ms',
+                       'applied delta'])
+    print('OK' if not failures else f'{failures} mismatches')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
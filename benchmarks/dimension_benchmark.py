@@ -0,0 +1,171 @@
+"""
+Database size and grouping latency of COST_BY_TIME/COST_BY_HOUR with service and tag stored as names, the schema
+before SERVICE_DIMENSION/TAG_DIMENSION, and as dimension ids after migrations.encode_dimensions
+A database of the old schema is written with plain sqlite3, then opened through the helper, which migrates it at
+startup. Row counts and cost sums per (service, tag) are compared across the migration
+
+    python -m benchmarks.dimension_benchmark --rows 500000
+Exits non zero when the migrated data differs
+"""
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, timed, print_table
+from benchmarks.synthetic import generate_samples
+from benchmarks.workloads import helper_workload
+from tableaccess.AccessFactory import AccessFactory
+from tableobjects.cost_by_hour import cost_by_hour
+from tableobjects.cost_by_time import cost_by_time
+
+# Billing exports name services and cost allocation tags in full
+LONG_SERVICES = ['Amazon Elastic Compute Cloud', 'AWS CloudFormation', 'Amazon Elastic Block Store',
+                 'Amazon Elastic Kubernetes Service']
+LONG_TAGS = ['team:data-management-experience', 'team:data-flow-experience', 'team:data-warehouse-experience',
+             'team:machine-learning-experience']
+
+LEGACY_SCHEMA = """
+CREATE TABLE "COST_BY_TIME" (
+    "SN" INTEGER NOT NULL, timestamp DATETIME, cloud_type VARCHAR(5), tag VARCHAR, service VARCHAR,
+    cost_per_hour INTEGER, hour_bucket INTEGER, minute_bucket INTEGER, PRIMARY KEY ("SN"));
+CREATE INDEX ix_cost_by_time_cloud_ts ON "COST_BY_TIME" (cloud_type, timestamp, service, tag, cost_per_hour);
+CREATE INDEX ix_cost_by_time_cloud_service_ts ON "COST_BY_TIME" (cloud_type, service, timestamp, tag, cost_per_hour);
+CREATE INDEX ix_cost_by_time_cloud_tag_ts ON "COST_BY_TIME" (cloud_type, tag, timestamp, service, cost_per_hour);
+CREATE INDEX ix_cost_by_time_cloud_hour_bucket ON "COST_BY_TIME" (
+    cloud_type, hour_bucket, service, tag, minute_bucket, cost_per_hour);
+CREATE TABLE "COST_BY_HOUR" (
+    cloud_type VARCHAR(5) NOT NULL, hour DATETIME NOT NULL, service VARCHAR NOT NULL, tag VARCHAR NOT NULL,
+    total_cost INTEGER NOT NULL, sample_count INTEGER NOT NULL, minute_mask INTEGER NOT NULL,
+    PRIMARY KEY (cloud_type, hour, service, tag));
+"""
+
+# Grouping of the latest_* and history reads, on names before and on ids after
+GROUPINGS = {
+    'raw group by service, tag': 'SELECT {service}, {tag}, sum(cost_per_hour) FROM COST_BY_TIME '
+                                 'WHERE cloud_type = ? AND timestamp >= ? GROUP BY {service}, {tag}',
+    'raw max(timestamp) by service': 'SELECT {service}, max(timestamp) FROM COST_BY_TIME WHERE cloud_type = ? '
+                                     'AND timestamp >= ? GROUP BY {service}',
+    'rollup group by tag': 'SELECT {tag}, sum(total_cost) FROM COST_BY_HOUR WHERE cloud_type = ? AND hour >= ? '
+                           'GROUP BY {tag}',
+}
+
+CHECKSUM = 'SELECT {service}, {tag}, count(*), sum(cost_per_hour) FROM COST_BY_TIME {join} GROUP BY 1, 2'
+NAMED_JOIN = 'LEFT JOIN SERVICE_DIMENSION AS s ON s.id = service_id LEFT JOIN TAG_DIMENSION AS t ON t.id = tag_id'
+
+
+def db_time(timestamp):
+    return timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def write_legacy(db_path, samples):
+    """
+    Old schema database holding the samples and their rollup
+    """
+    rollup = {}
+    rows = []
+    for sn, sample in enumerate(samples, start=1):
+        timestamp = sample['timestamp']
+        hour_bucket, minute_bucket = cost_by_time.buckets(timestamp)
+        rows.append((sn, db_time(timestamp), sample['cloud_type'].name, sample['tag'], sample['service'],
+                     sample['cost'], hour_bucket, minute_bucket))
+        hour, minute_bit = cost_by_hour.bucket(timestamp)
+        key = (sample['cloud_type'].name, db_time(hour), sample['service'], sample['tag'])
+        total, count, minute_mask = rollup.get(key, (0, 0, 0))
+        rollup[key] = (total + sample['cost'], count + 1, minute_mask | minute_bit)
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(LEGACY_SCHEMA)
+        conn.executemany('INSERT INTO COST_BY_TIME VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        conn.executemany('INSERT INTO COST_BY_HOUR VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         [key + value for key, value in rollup.items()])
+    vacuum(db_path)
+
+
+def vacuum(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def table_bytes(db_path):
+    """
+    {table or index: bytes}, from the dbstat virtual table when SQLite was built with it
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute('SELECT name, sum(pgsize) FROM dbstat GROUP BY name').fetchall())
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
+
+def time_groupings(db_path, columns, since, repeat):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {name: timed(lambda: conn.execute(sql.format(**columns), ('aws', db_time(since))).fetchall(),
+                            repeat)[1] for name, sql in GROUPINGS.items()}
+    finally:
+        conn.close()
+
+
+def checksum(db_path, columns, join=''):
+    conn = sqlite3.connect(db_path)
+    try:
+        return sorted(conn.execute(CHECKSUM.format(join=join, **columns)).fetchall(), key=repr)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--services', nargs='+', default=LONG_SERVICES)
+    parser.add_argument('--tags', nargs='+', default=LONG_TAGS)
+    args = parser.parse_args()
+
+    names = {'service': 'service', 'tag': 'tag'}
+    ids = {'service': 'service_id', 'tag': 'tag_id'}
+    since = datetime.datetime.now() - datetime.timedelta(hours=args.hours)
+    with scratch_dir() as directory:
+        db_path = scratch_db(directory)
+        write_legacy(db_path, generate_samples(args.rows, services=args.services, tags=args.tags))
+        before_bytes, before_tables = os.path.getsize(db_path), table_bytes(db_path)
+        before = time_groupings(db_path, names, since, args.repeat)
+        expected = checksum(db_path, names)
+
+        start = time.perf_counter()
+        helper = AccessFactory.get_cost_by_time_db_conn(db_path=db_path)
+        migration_seconds = time.perf_counter() - start
+        helper.engine.dispose()
+        after_bytes, after_tables = os.path.getsize(db_path), table_bytes(db_path)
+        after = time_groupings(db_path, ids, since, args.repeat)
+        migrated = checksum(db_path, {'service': 's.name', 'tag': 't.name'}, NAMED_JOIN)
+        helper_ms = [(name, f'{timed(fn, args.repeat)[1] * 1000:.2f}')
+                     for name, fn in helper_workload(helper, hours=args.hours, service=args.services[0],
+                                                     tag=args.tags[0])]
+
+    print(f'Migrated {args.rows} rows in {migration_seconds:.2f}s\n')
+    print_table([('database', before_bytes, after_bytes, f'{before_bytes / after_bytes:.2f}x')] +
+                [(name, before_tables.get(name, ''), after_tables.get(name, ''),
+                  f'{before_tables[name] / after_tables[name]:.2f}x' if name in before_tables and
+                  name in after_tables else '')
+                 for name in sorted(before_tables.keys() | after_tables.keys())],
+                ['bytes', 'names', 'ids', 'smaller'])
+    print()
+    print_table([(name, f'{before[name] * 1000:.2f}', f'{after[name] * 1000:.2f}',
+                  f'{before[name] / after[name]:.1f}x') for name in GROUPINGS],
+                ['query', 'names ms', 'ids ms', 'speedup'])
+    print()
+    print_table(helper_ms, ['helper (after)', 'median ms'])
+    same = expected == migrated
+    print('\nOK' if same else '\nFAIL: per (service, tag) counts and sums differ after the migration')
+    sys.exit(0 if same else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Peak Python memory and throughput of GET /api/v1/<cloud_type>/samples/export
+The response is consumed chunk by chunk through the Flask test client, like a slow client reading the stream.
+Peak memory should stay flat as --rows grows
+
+    python -m benchmarks.export_benchmark --rows 20000 200000
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.harness import scratch_dir, scratch_db, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.properties import CloudType, Properties
+
+
+def stream_export(client, export_format):
+    """
+    :return: (rows received, bytes received, seconds, peak traced bytes)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(f'/api/v1/aws/samples/export?format={export_format}', buffered=False)
+    received, lines = 0, 0
+    for chunk in response.response:
+        received += len(chunk)
+        lines += chunk.count(b'\n')
+    response.close()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return lines, received, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[20000, 200000])
+    args = parser.parse_args()
+
+    rows = []
+    with scratch_dir() as directory:
+        # Imported here: the app opens Properties.cost_tracker_sqlite_db at import, then gets each scratch helper
+        Properties.cost_tracker_sqlite_db = scratch_db(directory)
+        import cost_by_time_app
+
+        for n_rows in args.rows:
+            helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory, f'{n_rows}.db'))
+            load_samples(helper, generate_samples(n_rows, clouds=[CloudType.aws]))
+            cost_by_time_app.table_helper = helper
+            client = cost_by_time_app.cost_app.test_client()
+            for export_format in ('ndjson', 'csv'):
+                lines, received, elapsed, peak = stream_export(client, export_format)
+                rows.append((f'{n_rows:,}', export_format, f'{lines:,}', f'{received / 2 ** 20:,.1f}',
+                             f'{lines / elapsed:,.0f}', f'{peak / 2 ** 20:,.2f}'))
+            helper.engine.dispose()
+    print_table(rows, ['rows', 'format', 'lines', 'MiB sent', 'rows/sec', 'peak MiB'])
+
+
+if __name__ == '__main__':
+    main()
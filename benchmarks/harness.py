@@ -0,0 +1,74 @@
+import contextlib
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import event
+
+
+@contextlib.contextmanager
+def scratch_dir():
+    """
+    Temporary directory for benchmark databases, so the checked in databases are never touched
+    """
+    path = tempfile.mkdtemp(prefix='cost_tracker_bench_')
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def scratch_db(directory, name='CostTracker.db'):
+    return os.path.join(directory, name)
+
+
+def timed(fn, repeat=5):
+    """
+    Call fn `repeat` times
+    :return: (last result, median seconds, min seconds)
+    """
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return result, statistics.median(durations), min(durations)
+
+
+@contextlib.contextmanager
+def capture_statements(engine):
+    """
+    Record every (statement, parameters) the engine sends to the DBAPI while the block runs
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def query_plan(engine, statement, parameters=()):
+    """
+    EXPLAIN QUERY PLAN of a captured statement, one line per plan node
+    """
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def print_table(rows, headers):
+    widths = [max(len(str(item)) for item in column) for column in zip(headers, *rows)]
+    line = '  '.join(f'{{:<{width}}}' for width in widths)
+    print(line.format(*headers))
+    print(line.format(*('-' * width for width in widths)))
+    for row in rows:
+        print(line.format(*row))
@@ -0,0 +1,62 @@
+"""
+Query plans and latencies of the cost_by_time read path before and after the COST_BY_TIME index migration
+
+    python -m benchmarks.index_benchmark --rows 200000
+"""
+import argparse
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, timed, capture_statements, query_plan, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from benchmarks.workloads import helper_workload
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.migrations import create_missing_indexes
+from tableobjects.cost_by_time import cost_by_time
+
+
+def run_workload(helper, hours, repeat):
+    """
+    :return: {name: (median seconds, [plan lines of every statement the call issued])}
+    """
+    results = {}
+    for name, fn in helper_workload(helper, hours=hours):
+        with capture_statements(helper.engine) as statements:
+            fn()
+        plans = [line for statement, parameters in statements
+                 for line in query_plan(helper.engine, statement, parameters)]
+        _, median, _ = timed(fn, repeat)
+        results[name] = (median, plans)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with scratch_dir() as directory:
+        helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory))
+        for index in cost_by_time.__table__.indexes:
+            index.drop(bind=helper.engine)
+        load_samples(helper, generate_samples(args.rows))
+
+        before = run_workload(helper, args.hours, args.repeat)
+        start = time.perf_counter()
+        created = create_missing_indexes(helper.engine, cost_by_time.__table__)
+        migration_seconds = time.perf_counter() - start
+        after = run_workload(helper, args.hours, args.repeat)
+
+    print(f'Migration created {", ".join(created)} over {args.rows} rows in {migration_seconds:.2f}s\n')
+    rows = [(name, f'{before[name][0] * 1000:.2f}', f'{after[name][0] * 1000:.2f}',
+             f'{before[name][0] / after[name][0]:.1f}x') for name in before]
+    print_table(rows, ['method', 'before ms', 'after ms', 'speedup'])
+    for name in before:
+        print(f'\n{name}')
+        print('  before: ' + '\n          '.join(before[name][1]))
+        print('  after:  ' + '\n          '.join(after[name][1]))
+
+
+if __name__ == '__main__':
+    main()
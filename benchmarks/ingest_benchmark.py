@@ -0,0 +1,47 @@
+"""
+Ingest throughput of CbyTSQLAlchemyTableHelper: per-row add_row against batched add_rows
+
+    python -m benchmarks.ingest_benchmark --rows 5000
+"""
+import argparse
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, print_table
+from benchmarks.synthetic import generate_samples
+from tableaccess.AccessFactory import AccessFactory
+
+
+def per_row(helper, samples):
+    for sample in samples:
+        helper.add_row(**sample)
+    return len(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    samples = list(generate_samples(args.rows))
+    runs = [('add_row', lambda helper: per_row(helper, samples))]
+    runs += [(f'add_rows chunk={chunk_size}', lambda helper, size=chunk_size: helper.add_rows(samples, size))
+             for chunk_size in args.chunk_sizes]
+
+    results = []
+    with scratch_dir() as directory:
+        for i, (name, fn) in enumerate(runs):
+            helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory, f'ingest_{i}.db'))
+            start = time.perf_counter()
+            written = fn(helper)
+            seconds = time.perf_counter() - start
+            results.append((name, written, seconds, written / seconds))
+            helper.engine.dispose()
+    baseline = results[0][3]
+    print_table([(name, written, f'{seconds:.2f}', f'{rate:,.0f}', f'{rate / baseline:.1f}x')
+                 for name, written, seconds, rate in results],
+                ['path', 'rows', 'seconds', 'rows/sec', 'speedup'])
+
+
+if __name__ == '__main__':
+    main()
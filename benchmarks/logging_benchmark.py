@@ -0,0 +1,87 @@
+"""
+Request latency of cost_by_time_app with request logging off, synchronous (stdout + RotatingFileHandler inline) and
+asynchronous (per process queue and listener thread, JSON lines)
+--threads clients hit a cached history endpoint, so the time left is mostly routing, caching and logging.
+Console output of the logging modes goes to /dev/null, log files to a scratch directory
+
+    python -m benchmarks.logging_benchmark --requests 2000 --threads 4
+"""
+import argparse
+import contextlib
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from common.custom_logging import CustomLogger
+from tableaccess.properties import CloudType, Properties
+
+
+def client_latencies(app, requests, results):
+    client = app.test_client()
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get('/api/v1/aws/service/history?hours=24')
+        latencies.append(time.perf_counter() - start)
+    results.extend(latencies)
+
+
+def run_mode(cost_by_time_app, mode, args):
+    logger = cost_by_time_app.cost_app.logger
+    logger.handlers = []
+    logger.disabled = mode == 'off'
+    if mode != 'off':
+        Properties.async_logging = mode == 'async'
+        for handler in CustomLogger.handlers(filename='logs/flask.log', console=True):
+            logger.addHandler(handler)
+
+    results = []
+    threads = [threading.Thread(target=client_latencies, args=(cost_by_time_app.cost_app, args.requests, results))
+               for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    CustomLogger.stop_listener()
+    results.sort()
+    return (mode, f'{len(results) / elapsed:,.0f}', f'{statistics.median(results) * 1000:.3f}',
+            f'{results[int(len(results) * 0.99)] * 1000:.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per thread')
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    rows = []
+    with scratch_dir() as directory:
+        Properties.cost_tracker_sqlite_db = scratch_db(directory)
+        # Imported here: the app opens Properties.cost_tracker_sqlite_db at import
+        import cost_by_time_app
+        load_samples(cost_by_time_app.table_helper, generate_samples(20000, clouds=[CloudType.aws]))
+
+        cwd = os.getcwd()
+        os.makedirs(os.path.join(directory, 'logs'))
+        os.chdir(directory)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                # Console handlers bind sys.stdout when created, i.e. inside the redirect
+                for mode in ('off', 'sync', 'async'):
+                    rows.append(run_mode(cost_by_time_app, mode, args))
+        finally:
+            os.chdir(cwd)
+            logging.shutdown()
+    print_table(rows, ['logging', 'requests/sec', 'p50 ms', 'p99 ms'])
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Asserts on EXPLAIN QUERY PLAN of the hourly/minute grouping paths
+History and total methods must be a primary key range scan of COST_BY_HOUR, and the rollup backfill must group
+each cloud's COST_BY_TIME samples in hour_bucket index order; none of them may sort through a temp B-tree
+
+    python -m benchmarks.query_plan_check
+Exits non zero when a plan regresses
+"""
+import argparse
+import sys
+
+from benchmarks.harness import scratch_dir, scratch_db, capture_statements, query_plan
+from benchmarks.synthetic import generate_samples, load_samples
+from benchmarks.workloads import helper_workload
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.migrations import backfill_hourly_rollup
+
+GROUPING_METHODS = ('aggregate_', 'total_cost_')
+
+
+def plan_violations(plans, access, table, index):
+    """
+    :param plans: EXPLAIN QUERY PLAN lines of every statement of a call
+    :param access: SEARCH for a range scan, SCAN for a full pass in index order
+    :param table: table that must be read
+    :param index: index the read must go through
+    :return: list of problems, empty when the plan is as expected
+    """
+    problems = [line for line in plans if 'TEMP B-TREE' in line]
+    if not any(line.startswith(f'{access} {table} USING') and index in line for line in plans):
+        problems.append(f'no {access} {table} using {index}')
+    return problems
+
+
+def check(engine, name, fn, access, table, index):
+    with capture_statements(engine) as statements:
+        fn()
+    plans = [line for statement, parameters in statements if statement.lstrip().upper().startswith('SELECT')
+             for line in query_plan(engine, statement, parameters)]
+    problems = plan_violations(plans, access, table, index)
+    print(f'{"FAIL" if problems else "ok  "} {name}')
+    for line in plans:
+        print(f'       {line}')
+    for problem in problems:
+        print(f'       !! {problem}')
+    return not problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    args = parser.parse_args()
+
+    with scratch_dir() as directory:
+        helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory))
+        load_samples(helper, generate_samples(args.rows))
+        results = [check(helper.engine, name, fn, 'SEARCH', 'COST_BY_HOUR', 'sqlite_autoindex_COST_BY_HOUR')
+                   for name, fn in helper_workload(helper) if name.startswith(GROUPING_METHODS)]
+        results.append(check(helper.engine, 'backfill_hourly_rollup', lambda: backfill_hourly_rollup(helper.engine),
+                             'SEARCH', 'COST_BY_TIME', 'ix_cost_by_time_cloud_hour_bucket'))
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Cost of the CbyTSQLAlchemyTableHelper read path per call and of the cost_by_time_app read routes per request:
+SQL statements, pool checkouts (connections taken), peak memory allocated on the way and latency
+The response cache is off, so every request reaches the helper
+
+    python -m benchmarks.read_path_benchmark --rows 100000 --output current.json
+    python -m benchmarks.read_path_benchmark --rows 100000 --baseline before.json
+With --baseline the numbers are printed next to those of an earlier run, e.g. of the parent commit
+"""
+import argparse
+import json
+import tracemalloc
+
+from sqlalchemy import event
+
+from benchmarks.harness import scratch_dir, scratch_db, timed, capture_statements, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from benchmarks.workloads import helper_workload, route_workload
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.properties import Properties
+
+
+def measure(engine, fn, repeat):
+    """
+    :return: {'statements', 'checkouts', 'peak_kib', 'median_ms'} of fn
+    """
+    checkouts = []
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checkouts.append(1)
+
+    fn()
+    event.listen(engine, 'checkout', on_checkout)
+    try:
+        with capture_statements(engine) as statements:
+            fn()
+    finally:
+        event.remove(engine, 'checkout', on_checkout)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    _, median, _ = timed(fn, repeat)
+    return {'statements': len(statements), 'checkouts': len(checkouts), 'peak_kib': round(peak / 1024, 1),
+            'median_ms': round(median * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    with scratch_dir() as directory:
+        Properties.cost_tracker_sqlite_db = scratch_db(directory)
+        load_samples(AccessFactory.get_cost_by_time_db_conn(), generate_samples(args.rows))
+
+        import cost_by_time_app
+        cost_by_time_app.cost_app.logger.disabled = True
+        cost_by_time_app.response_cache.ttl_seconds = 0
+        helper = cost_by_time_app.table_helper
+        client = cost_by_time_app.cost_app.test_client()
+        read_endpoints = set(cost_by_time_app.DELTA_DIMENSIONS) | {
+            'get_latest_for_all_services', 'get_latest_for_all_tags', 'get_latest_by_service', 'get_latest_by_tag'}
+
+        results = {}
+        for name, fn in helper_workload(helper, hours=args.hours):
+            results[f'helper {name}'] = measure(helper.engine, fn, args.repeat)
+        for endpoint, method, url, _ in route_workload(hours=args.hours):
+            if endpoint in read_endpoints:
+                results[f'GET {url}'] = measure(helper.engine, lambda: client.get(url).get_data(), args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    columns = ['statements', 'checkouts', 'peak_kib', 'median_ms']
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        rows = [(name, *(f'{baseline[name][column]} -> {result[column]}' for column in columns))
+                for name, result in results.items() if name in baseline]
+    else:
+        rows = [(name, *(result[column] for column in columns)) for name, result in results.items()]
+    print_table(rows, ['call'] + columns)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Payload size and serialization time of the history/total responses over large hours= windows
+Per endpoint and window:
+    bytes     -> body size as rows (the default) and as format=columnar
+    jsonify   -> flask.jsonify of the result, what every request paid before bodies were cached
+    encode    -> common.response_body.encode, rows and columnar, with orjson when installed and the json module
+    hit       -> a whole request answered from the cached body
+Samples are spaced --interval seconds apart so long windows stay quick to load
+
+    python -m benchmarks.response_format_benchmark --hours 24 720 2160
+"""
+import argparse
+import datetime
+
+from benchmarks.harness import scratch_dir, scratch_db, timed, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from common import response_body
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.properties import CloudType, Properties
+
+ENDPOINTS = [('service/history', 'aggregate_by_service'), ('service/tag/history', 'aggregate_by_service_and_tag'),
+             ('service/tag/total', 'total_cost_by_service_and_tag')]
+
+
+def encode_without_orjson(data, requested_format):
+    orjson, response_body.orjson = response_body.orjson, None
+    try:
+        return response_body.encode(data, requested_format)
+    finally:
+        response_body.orjson = orjson
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hours', type=int, nargs='+', default=[24, 720, 2160])
+    parser.add_argument('--interval', type=int, default=1800, help='seconds between poll cycles')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    with scratch_dir() as directory:
+        Properties.cost_tracker_sqlite_db = scratch_db(directory)
+        cycles = max(args.hours) * 3600 // args.interval + 1
+        load_samples(AccessFactory.get_cost_by_time_db_conn(),
+                     generate_samples(cycles * 16, clouds=[CloudType.aws], interval_seconds=args.interval))
+
+        import cost_by_time_app
+        from flask import jsonify
+        cost_by_time_app.cost_app.logger.disabled = True
+        helper = cost_by_time_app.table_helper
+        client = cost_by_time_app.cost_app.test_client()
+        rows = []
+        for hours in args.hours:
+            for path, method in ENDPOINTS:
+                data = getattr(helper, method)(CloudType.aws, hours)
+                url = f'/api/v1/aws/{path}?hours={hours}'
+                row_body, columnar_body = client.get(url).get_data(), client.get(url + '&format=columnar').get_data()
+                with cost_by_time_app.cost_app.app_context():
+                    _, jsonify_seconds, _ = timed(lambda: jsonify(data).get_data(), args.repeat)
+                encodings = [timed(lambda: encode(data, requested_format), args.repeat)[1]
+                             for encode in (response_body.encode, encode_without_orjson)
+                             for requested_format in response_body.RESPONSE_FORMATS]
+                _, hit_seconds, _ = timed(lambda: client.get(url).get_data(), args.repeat)
+                rows.append((hours, path, len(data), len(row_body), len(columnar_body),
+                             f'{len(row_body) / len(columnar_body):.2f}x', f'{jsonify_seconds * 1000:.2f}',
+                             *(f'{seconds * 1000:.2f}' for seconds in encodings), f'{hit_seconds * 1000:.2f}'))
+    fast = 'orjson' if response_body.orjson is not None else 'json'
+    print(f'{datetime.datetime.now():%Y-%m-%d %H:%M}, interval {args.interval}s, timings are medians in ms\n')
+    print_table(rows, ['hours', 'endpoint', 'rows', 'rows bytes', 'columnar bytes', 'smaller', 'jsonify',
+                       f'{fast} rows', f'{fast} columnar', 'json rows', 'json columnar', 'cached hit'])
+
+
+if __name__ == '__main__':
+    main()
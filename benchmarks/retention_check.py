@@ -0,0 +1,87 @@
+"""
+Checks raw sample retention against the full history
+Loads --days of samples, records every read of the workload over the whole period, compacts raw samples older
+than --retention-days in small batches, then requires
+    - every history/total read to answer exactly as before, also after a full rollup rebuild
+    - the latest_* reads to be unchanged
+    - no raw sample left before the retention watermark
+
+    python -m benchmarks.retention_check --days 10 --retention-days 3
+Exits non zero on any difference
+"""
+import argparse
+import json
+import sys
+
+import sqlalchemy
+
+from benchmarks.harness import scratch_dir, scratch_db, timed, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from benchmarks.workloads import helper_workload
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.migrations import backfill_hourly_rollup
+from tableaccess.properties import CloudType
+from tableobjects.cost_by_time import cost_by_time
+
+
+def canonical(result):
+    """
+    Results compared independently of the order of set based totals
+    """
+    if isinstance(result, list):
+        return sorted(json.dumps(item, sort_keys=True) for item in result)
+    return json.dumps(result, sort_keys=True)
+
+
+def raw_count(helper):
+    with helper.engine.connect() as conn:
+        return conn.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(cost_by_time.__table__)).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=10)
+    parser.add_argument('--retention-days', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    services, tags, interval_seconds = ['EC2', 'EBS'], ['DMX', 'DFX'], 120
+    n_rows = args.days * 24 * 3600 // interval_seconds * len(services) * len(tags)
+    problems = []
+    with scratch_dir() as directory:
+        helper = AccessFactory.get_cost_by_time_db_conn(db_path=scratch_db(directory))
+        load_samples(helper, generate_samples(n_rows, clouds=[CloudType.aws], services=services, tags=tags,
+                                              interval_seconds=interval_seconds))
+        workload = helper_workload(helper, hours=args.days * 24 + 1, service='EC2', tag='DMX')
+        before = {name: canonical(fn()) for name, fn in workload}
+        rows_before = raw_count(helper)
+
+        deleted, compaction_seconds, _ = timed(lambda: helper.apply_retention(args.retention_days, args.batch_size),
+                                               repeat=1)
+        after = {name: canonical(fn()) for name, fn in workload}
+        backfill_hourly_rollup(helper.engine)
+        rebuilt = {name: canonical(fn()) for name, fn in workload}
+
+        for name, _ in workload:
+            if after[name] != before[name]:
+                problems.append(f'{name} changed after compaction')
+            if rebuilt[name] != before[name]:
+                problems.append(f'{name} changed after rebuilding the rollup')
+        with helper.engine.connect() as conn:
+            watermark = conn.execute(sqlalchemy.text('SELECT compacted_before FROM RETENTION_WATERMARK '
+                                                     'WHERE cloud_type = :cloud'), {'cloud': 'aws'}).scalar()
+            oldest = conn.execute(sqlalchemy.text('SELECT min(timestamp) FROM COST_BY_TIME')).scalar()
+        if oldest < watermark:
+            problems.append(f'raw sample at {oldest} left before the watermark {watermark}')
+
+    print_table([('raw rows before', f'{rows_before:,}'), ('raw rows deleted', f'{deleted[CloudType.aws]:,}'),
+                 ('compaction seconds', f'{compaction_seconds:.2f}'), ('watermark', watermark),
+                 ('oldest raw sample', oldest)], ['', 'value'])
+    for problem in problems:
+        print(problem)
+    print('OK' if not problems else f'{len(problems)} problems')
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
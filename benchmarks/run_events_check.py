@@ -0,0 +1,176 @@
+"""
+GET /runs/events end to end: app.py served by the werkzeug server on a scratch RunQueue.db, a Scheduler in a
+separate process working the queue, and --subscribers streams reading every event
+Checks  -> every subscriber receives every change once, in event_id order: PENDING for each POST /run, the DELETE,
+           then INITIATED, RUNNING, SUCCESS for each run the scheduler process finishes
+        -> a stream resumed with Last-Event-ID replays exactly the events after it
+        -> a stream resumed from an event already pruned starts with a reset event
+Reports -> delivery latency (event written to event received) of changes made by the app and by the scheduler
+           process, and the statements an idle stream runs against what polling the listings costs
+
+    python -m benchmarks.run_events_check --runs 50 --subscribers 4
+Exits non zero when an event is missing, duplicated, out of order or wrongly replayed
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+
+from benchmarks.harness import scratch_dir, scratch_db, capture_statements, print_table
+from tableaccess.properties import Properties, RunStates
+
+FINISHED = [RunStates.INITIATED.value, RunStates.RUNNING.value, RunStates.SUCCESS.value]
+
+
+def read_events(url, count, headers=None, timeout=30):
+    """
+    First `count` events of a stream, comments and retry lines skipped
+    :return: list of (event type, data dict, datetime received)
+    """
+    events, fields = [], {}
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}), timeout=timeout) as stream:
+        while len(events) < count:
+            line = stream.readline().decode().rstrip('\n')
+            if line:
+                name, _, value = line.partition(': ')
+                fields[name] = value
+            elif 'data' in fields:
+                events.append((fields.get('event'), json.loads(fields['data']), datetime.datetime.now()))
+                fields = {}
+            else:
+                fields = {}
+    return events
+
+
+def scheduler_process(db_path, run_seconds):
+    from runlogic.TriggerRuns import Scheduler
+    from tableaccess.AccessFactory import AccessFactory
+
+    helper = AccessFactory.get_db_conn_service(db_path=db_path)
+
+    def execute(run_id):
+        helper.update_run_state(run_id, RunStates.RUNNING.value)
+        time.sleep(run_seconds)
+        helper.update_run_state(run_id, RunStates.SUCCESS.value)
+
+    Scheduler(helper=helper, execute=execute, concurrency=4, idle_poll_seconds=0.05).run_forever()
+
+
+def check_order(received, deleted_run_id):
+    """
+    :return: list of problems with one subscriber's events
+    """
+    problems = []
+    event_ids = [data['event_id'] for _, data, _ in received]
+    if event_ids != sorted(set(event_ids)):
+        problems.append('event_ids not strictly increasing')
+    states = {}
+    for _, data, _ in received:
+        states.setdefault(data['run_id'], []).append(data['run_state'])
+    for run_id, run_states in states.items():
+        expected = [RunStates.PENDING.value] + ([None] if run_id == deleted_run_id else FINISHED)
+        if run_states != expected:
+            problems.append(f'run {run_id}: {run_states}, expected {expected}')
+    return problems
+
+
+def latencies(received, origin_states):
+    return sorted((at - datetime.datetime.fromisoformat(data['created_at'])).total_seconds() * 1000
+                  for _, data, at in received if data['run_state'] in origin_states)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--subscribers', type=int, default=4)
+    parser.add_argument('--run-seconds', type=float, default=0.01)
+    parser.add_argument('--poll-seconds', type=float, default=0.2)
+    parser.add_argument('--keepalive-seconds', type=float, default=0.5)
+    parser.add_argument('--idle-seconds', type=float, default=2)
+    args = parser.parse_args()
+
+    problems, rows = [], []
+    with scratch_dir() as directory:
+        Properties.sqlite_db_path = scratch_db(directory, 'RunQueue.db')
+        Properties.run_events_poll_seconds = args.poll_seconds
+        Properties.run_events_keepalive_seconds = args.keepalive_seconds
+        from werkzeug.serving import make_server
+        import app
+
+        app.app.logger.disabled = True
+        server = make_server('127.0.0.1', 0, app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.port}'
+        client = app.app.test_client()
+
+        expected = args.runs + 1 + 3 * (args.runs - 1)
+        received = [None] * args.subscribers
+        subscribers = [threading.Thread(target=lambda i=i: received.__setitem__(
+            i, read_events(f'{base}/runs/events?after_event_id=0', expected)), daemon=True)
+            for i in range(args.subscribers)]
+        for subscriber in subscribers:
+            subscriber.start()
+        run_ids = [client.post('/run', json={'run_name': f'check-{i}'}).get_json()['run_id']
+                   for i in range(args.runs)]
+        client.delete(f'/run/{run_ids[0]}')
+        scheduler = multiprocessing.get_context('fork').Process(
+            target=scheduler_process, args=(Properties.sqlite_db_path, args.run_seconds), daemon=True)
+        scheduler.start()
+        for subscriber in subscribers:
+            subscriber.join(60)
+        scheduler.terminate()
+        scheduler.join()
+
+        if any(events is None for events in received):
+            problems.append('a subscriber timed out before receiving every event')
+        else:
+            for i, events in enumerate(received):
+                problems += [f'subscriber {i}: {problem}' for problem in check_order(events, run_ids[0])]
+                if [data for _, data, _ in events] != [data for _, data, _ in received[0]]:
+                    problems.append(f'subscriber {i} received other events than subscriber 0')
+            events = [event for subscriber_events in received for event in subscriber_events]
+            for origin, states in (('app', [RunStates.PENDING.value, None]), ('scheduler process', FINISHED)):
+                ms = latencies(events, states)
+                rows.append((origin, len(ms), f'{statistics.median(ms):.1f}', f'{ms[-1]:.1f}'))
+
+            all_events = [data for _, data, _ in received[0]]
+            middle = all_events[len(all_events) // 2]['event_id']
+            resumed = read_events(f'{base}/runs/events', len(all_events) - len(all_events) // 2 - 1,
+                                  headers={'Last-Event-ID': str(middle)})
+            if [data for _, data, _ in resumed] != all_events[len(all_events) // 2 + 1:]:
+                problems.append(f'resuming after event {middle} did not replay the events after it')
+
+        Properties.run_events_kept = 10
+        client.post('/run', json={'run_name': 'pruning'})
+        event_type, data, _ = read_events(f'{base}/runs/events', 1, headers={'Last-Event-ID': '1'})[0]
+        if event_type != 'reset':
+            problems.append(f'resuming from a pruned event started with {event_type} {data}, expected reset')
+
+        # Streams of disconnected clients end on their next write, at the latest the second keep-alive
+        time.sleep(3 * args.keepalive_seconds + args.poll_seconds)
+        with capture_statements(app.table_helper.engine) as statements:
+            with urllib.request.urlopen(f'{base}/runs/events') as stream:
+                stream.readline()
+                time.sleep(args.idle_seconds)
+        stream_statements = len(statements)
+        with capture_statements(app.table_helper.engine) as statements:
+            poll_bytes = sum(len(client.get(url).get_data()) for url in ('/runs/running', '/runs/pending', '/queue'))
+        server.shutdown()
+
+    print_table(rows, ['changes made by', 'events received', 'latency p50 ms', 'latency max ms'])
+    print(f'\nIdle stream, checked every {args.poll_seconds}s: {stream_statements} statements in {args.idle_seconds}s, '
+          f'keep-alive comments only until a change')
+    print(f'One poll of /runs/running, /runs/pending and /queue: {len(statements)} statements, {poll_bytes} bytes')
+    for problem in problems:
+        print(f'FAIL: {problem}')
+    print('\nOK' if not problems else '')
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Throughput (runs/minute) and enqueue-to-start latency of the TriggerRuns scheduler
+Runs are enqueued at a steady rate into a scratch RunQueue.db; each run just sleeps for --run-seconds.
+'event' wakes the scheduler on every enqueue like POST /run does, 'poll' relies on the idle poll alone
+
+    python -m benchmarks.scheduler_benchmark --runs 200 --concurrency 4
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, print_table
+from tableaccess.properties import Properties, RunStates
+
+
+def run_mode(helper, notify, args):
+    # Imported here: TriggerRuns opens Properties.sqlite_db_path at import, which main() points at a scratch file
+    from runlogic.TriggerRuns import Scheduler
+
+    enqueued_at, started_at, finished = {}, {}, threading.Semaphore(0)
+
+    def execute(run_id):
+        started_at[run_id] = time.perf_counter()
+        helper.update_run_state(run_id, RunStates.RUNNING.value)
+        time.sleep(args.run_seconds)
+        helper.update_run_state(run_id, RunStates.SUCCESS.value)
+        finished.release()
+
+    scheduler = Scheduler(helper=helper, execute=execute, concurrency=args.concurrency,
+                          idle_poll_seconds=args.idle_poll_seconds)
+    thread = threading.Thread(target=scheduler.run_forever, daemon=True)
+    thread.start()
+
+    start = time.perf_counter()
+    for i in range(args.runs):
+        run_id = helper.add_run_to_queue(f'bench-{i}')
+        enqueued_at[run_id] = time.perf_counter()
+        if notify:
+            scheduler.wakeup.set()
+        time.sleep(args.enqueue_interval)
+    for _ in range(args.runs):
+        finished.acquire()
+    elapsed = time.perf_counter() - start
+    scheduler.stop()
+    thread.join()
+
+    latencies = sorted(started_at[run_id] - enqueued_at[run_id] for run_id in enqueued_at)
+    return (args.runs / elapsed * 60, statistics.median(latencies) * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--run-seconds', type=float, default=0.05)
+    parser.add_argument('--enqueue-interval', type=float, default=0.01)
+    parser.add_argument('--idle-poll-seconds', type=float, default=1)
+    args = parser.parse_args()
+
+    rows = []
+    with scratch_dir() as directory:
+        Properties.sqlite_db_path = scratch_db(directory, 'RunQueue.db')
+        from tableaccess.AccessFactory import AccessFactory
+        for mode, notify in (('event', True), ('poll', False)):
+            helper = AccessFactory.get_db_conn_service(db_path=scratch_db(directory, f'{mode}.db'))
+            runs_per_minute, p50, p99 = run_mode(helper, notify, args)
+            rows.append((mode, args.concurrency, f'{runs_per_minute:,.0f}', f'{p50:.1f}', f'{p99:.1f}'))
+    print_table(rows, ['wakeup', 'workers', 'runs/minute', 'start latency p50 ms', 'start latency p99 ms'])
+
+
+if __name__ == '__main__':
+    main()
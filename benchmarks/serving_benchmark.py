@@ -0,0 +1,130 @@
+"""
+Local load test of the cost by time API served through WSGI (cost_by_time_app, thread per request) and ASGI
+(cost_by_time_asgi, one event loop, reads on a bounded pool with coalescing)
+--clients concurrent clients each send --requests GET requests drawn from a dashboard-like mix of history and total
+endpoints, straight into the application callables, no sockets involved: WSGI clients are threads as in a threaded
+server, ASGI clients are tasks on one loop as in an ASGI server worker
+The response cache is off unless --cache, so every request that isn't coalesced queries the database. The bodies
+both modes return for every URL must be identical
+
+    python -m benchmarks.serving_benchmark --clients 32 --requests 50
+Exits non zero if the modes disagree on any response
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import statistics
+import sys
+import threading
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from tableaccess.properties import Properties
+
+URLS = [f'/api/v1/{cloud}/{path}?hours={hours}'
+        for cloud, path, hours in itertools.product(('aws', 'azure', 'gcp'),
+                                                    ('service/history', 'tag/total', 'service/tag/history'),
+                                                    (24, 200))]
+
+
+def latency_row(mode, latencies, elapsed, coalesced=''):
+    latencies = sorted(latencies)
+    return (mode, f'{len(latencies) / elapsed:,.0f}', f'{statistics.median(latencies) * 1000:.2f}',
+            f'{latencies[int(len(latencies) * 0.99)] * 1000:.2f}', coalesced)
+
+
+def run_wsgi(cost_app, args):
+    latencies = []
+
+    def client(seed):
+        rng = random.Random(seed)
+        test_client = cost_app.test_client()
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            test_client.get(rng.choice(URLS))
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latency_row('wsgi', latencies, time.perf_counter() - start)
+
+
+async def asgi_get(app, url):
+    """
+    :return: (status, body) of one GET request sent to an ASGI app
+    """
+    path, _, query = url.partition('?')
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path,
+             'root_path': '', 'query_string': query.encode(), 'headers': [(b'host', b'localhost')],
+             'server': ('localhost', 80), 'client': ('127.0.0.1', 50000)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def run_asgi(asgi_app, metrics, args):
+    latencies = []
+
+    async def client(seed):
+        rng = random.Random(seed)
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            await asgi_get(asgi_app, rng.choice(URLS))
+            latencies.append(time.perf_counter() - start)
+
+    async def clients():
+        await asyncio.gather(*(client(seed) for seed in range(args.clients)))
+
+    start = time.perf_counter()
+    asyncio.run(clients())
+    elapsed = time.perf_counter() - start
+    return latency_row('asgi', latencies, elapsed, sum(metrics.coalesced.series.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=50, help='requests per client')
+    parser.add_argument('--rows', type=int, default=50000, help='samples loaded before the run')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache on')
+    args = parser.parse_args()
+
+    with scratch_dir() as directory:
+        Properties.cost_tracker_sqlite_db = scratch_db(directory)
+        # Imported here: the app opens Properties.cost_tracker_sqlite_db at import
+        import cost_by_time_app
+        import cost_by_time_asgi
+        cost_by_time_app.cost_app.logger.disabled = True
+        if not args.cache:
+            cost_by_time_app.response_cache.ttl_seconds = 0
+        load_samples(cost_by_time_app.table_helper, generate_samples(args.rows))
+
+        mismatches = 0
+        client = cost_by_time_app.cost_app.test_client()
+        for url in URLS:
+            response = client.get(url)
+            status, body = asyncio.run(asgi_get(cost_by_time_asgi.asgi_app, url))
+            mismatches += (response.status_code, response.data) != (status, body)
+
+        rows = [run_wsgi(cost_by_time_app.cost_app, args),
+                run_asgi(cost_by_time_asgi.asgi_app, cost_by_time_app.metrics, args)]
+    print_table(rows, ['mode', 'requests/sec', 'p50 ms', 'p99 ms', 'coalesced'])
+    print('OK' if not mismatches else f'{mismatches} of {len(URLS)} responses differ between the modes')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+A dashboard refresh: --threads viewers ask for the same aggregation at the same moment, --rounds times
+Compares the table helper as is with its reads routed through common.single_flight, counting the SQL statements
+each takes. Every viewer must get the result a lone call returns
+
+    python -m benchmarks.single_flight_benchmark --threads 32 --rounds 5
+Exits non zero if any viewer got a different result
+"""
+import argparse
+import sys
+import threading
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, capture_statements, print_table
+from benchmarks.synthetic import generate_samples, load_samples
+from common.single_flight import SingleFlight, single_flight_methods
+from tableaccess.AccessFactory import AccessFactory
+from tableaccess.CostByTimeSQLAlchemyHelper import READ_METHODS
+from tableaccess.properties import CloudType
+
+
+def refresh(helper, threads, rounds):
+    """
+    :return: (results of every call, seconds)
+    """
+    barrier = threading.Barrier(threads)
+    results = []
+
+    def viewer():
+        for _ in range(rounds):
+            barrier.wait()
+            results.append(helper.aggregate_by_service_and_tag(cloud_type=CloudType.aws, n_hour_prior=200))
+
+    workers = [threading.Thread(target=viewer) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    rows = []
+    mismatches = 0
+    with scratch_dir() as directory:
+        db_path = scratch_db(directory)
+        load_samples(AccessFactory.get_cost_by_time_db_conn(db_path=db_path), generate_samples(args.rows))
+        for mode in ('direct', 'single flight'):
+            helper = AccessFactory.get_cost_by_time_db_conn(db_path=db_path)
+            expected = helper.aggregate_by_service_and_tag(cloud_type=CloudType.aws, n_hour_prior=200)
+            coalesced = []
+            if mode == 'single flight':
+                # Keyed on the generation like cost_by_time_app, whose reads it runs before every call
+                single_flight_methods(helper, READ_METHODS, SingleFlight(coalesced.append),
+                                      lambda args, kwargs: helper.generation(kwargs['cloud_type']))
+            with capture_statements(helper.engine) as statements:
+                results, seconds = refresh(helper, args.threads, args.rounds)
+            mismatches += sum(result != expected for result in results)
+            rows.append((mode, len(results), len(statements), len(coalesced), f'{seconds * 1000:.0f}'))
+    print_table(rows, ['mode', 'calls', 'SQL statements', 'coalesced', 'wall ms'])
+    print('OK' if not mismatches else f'{mismatches} calls returned a different result')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Benchmark suite of the cost tracker: synthetic COST_BY_TIME datasets of every --sizes, and on each a timing of every
+public CbyTSQLAlchemyTableHelper method and of every cost_by_time_app route through the Flask test client
+Results are written as JSON with the commit they ran on, so runs of different commits can be compared
+
+    python -m benchmarks.suite run --sizes 10k 1m 10m --output before.json
+    python -m benchmarks.suite compare before.json after.json --threshold 1.25
+Datasets are built from scratch by every run, with the code of the commit under test, since schema and ingest are
+part of what is measured; the seed keeps the data itself identical. Each size runs in its own process so the app
+binds to that size's database. Writes (add_row, add_rows, POST samples) add a few thousand samples on the way
+run fails if a public helper method or an app route has no workload, compare exits non zero on any timing more
+than --threshold times its baseline (and --min-delta-ms slower)
+"""
+import argparse
+import datetime
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import scratch_dir, scratch_db, timed, print_table
+from benchmarks.synthetic import DEFAULT_SERVICES, DEFAULT_TAGS, generate_samples, load_samples
+from benchmarks.workloads import public_method_workload, route_workload
+from tableaccess.properties import CloudType, Properties
+
+SIZE_SUFFIXES = {'k': 1000, 'm': 1000000}
+
+
+def parse_size(size):
+    """
+    10k -> 10000, 1m -> 1000000, 500 -> 500
+    """
+    suffix = size[-1].lower()
+    return int(size[:-1]) * SIZE_SUFFIXES[suffix] if suffix in SIZE_SUFFIXES else int(size)
+
+
+def commit():
+    """
+    :return: HEAD commit, with a -dirty suffix when the tree has changes, None outside a git checkout
+    """
+    try:
+        head = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                                text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head.strip() + ('-dirty' if status.strip() else '')
+
+
+def result_size(result):
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return result if isinstance(result, int) else None
+
+
+def timing(fn, repeat, size=result_size):
+    result, median, best = timed(fn, repeat)
+    return {'median_ms': round(median * 1000, 3), 'min_ms': round(best * 1000, 3), 'size': size(result)}
+
+
+def run_size(rows, settings):
+    """
+    Build a dataset of `rows` samples and time every helper method and app route on it
+    Runs in a process of its own: the app opens Properties.cost_tracker_sqlite_db when imported
+    :return: results of this size
+    """
+    from tableaccess.AccessFactory import AccessFactory
+    from tableaccess.CostByTimeSQLAlchemyHelper import CbyTSQLAlchemyTableHelper
+
+    with scratch_dir() as directory:
+        db_path = scratch_db(directory)
+        Properties.cost_tracker_sqlite_db = db_path
+        helper = AccessFactory.get_cost_by_time_db_conn(db_path=db_path)
+        samples = generate_samples(rows, clouds=[CloudType(cloud) for cloud in settings['clouds']],
+                                   services=settings['services'], tags=settings['tags'],
+                                   interval_seconds=settings['interval_seconds'])
+        start = time.perf_counter()
+        load_samples(helper, samples)
+        load_seconds = time.perf_counter() - start
+        db_bytes = sum(os.path.getsize(path) for path in (db_path, db_path + '-wal') if os.path.exists(path))
+
+        cloud, hours = CloudType(settings['clouds'][0]), settings['hours']
+        service, tag = settings['services'][0], settings['tags'][0]
+        workload = public_method_workload(helper, cloud, hours, service, tag)
+        public = {name for name, _ in inspect.getmembers(CbyTSQLAlchemyTableHelper, inspect.isfunction)
+                  if not name.startswith('_')}
+        untimed = public - {name.split('[')[0] for name, _ in workload}
+        if untimed:
+            raise ValueError(f'No workload for helper methods {sorted(untimed)}')
+        methods = {name: timing(fn, settings['repeat']) for name, fn in workload}
+
+        import cost_by_time_app
+        cost_by_time_app.cost_app.logger.disabled = True
+        if not settings['cache']:
+            cost_by_time_app.response_cache.ttl_seconds = 0
+        requests = route_workload(cloud.value, hours, service, tag)
+        untimed = {rule.endpoint for rule in cost_by_time_app.cost_app.url_map.iter_rules()} - {
+            endpoint for endpoint, _, _, _ in requests}
+        if untimed:
+            raise ValueError(f'No workload for routes {sorted(untimed)}')
+        client = cost_by_time_app.cost_app.test_client()
+        routes = {}
+        for endpoint, method, url, body in requests:
+            def send():
+                # Streamed responses hold their request context until read
+                response = client.open(url, method=method, json=body)
+                response.get_data()
+                return response
+
+            routes[f'{method} {url.split("?")[0]}'] = dict(
+                timing(send, settings['repeat'], size=lambda response: len(response.data)),
+                status=send().status_code)
+    return {'rows': rows, 'load_seconds': round(load_seconds, 3), 'rows_per_second': round(rows / load_seconds),
+            'db_bytes': db_bytes, 'helper': methods, 'routes': routes}
+
+
+def run(args):
+    settings = {
+        'clouds': args.clouds,
+        'services': args.services,
+        'tags': args.tags,
+        'interval_seconds': args.interval,
+        'hours': args.hours,
+        'repeat': args.repeat,
+        'cache': args.cache
+    }
+    report = {
+        'commit': commit(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'settings': settings,
+        'sizes': {}
+    }
+    context = multiprocessing.get_context('spawn')
+    for size in args.sizes:
+        print(f'{size}: building {parse_size(size):,} samples and timing', file=sys.stderr)
+        with context.Pool(1) as pool:
+            report['sizes'][size] = pool.apply(run_size, (parse_size(size), settings))
+    output = args.output or f'suite-{(report["commit"] or "nocommit")[:12]}.json'
+    with open(output, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+
+    rows = [(size, group, name, entry['median_ms'], '' if entry['size'] is None else entry['size'])
+            for size, results in report['sizes'].items() for group in ('helper', 'routes')
+            for name, entry in results[group].items()]
+    print_table(rows, ['size', 'group', 'name', 'median ms', 'size'])
+    print(f'Results written to {output}')
+
+
+def flatten(report):
+    return {(size, group, name): entry['median_ms'] for size, results in report['sizes'].items()
+            for group in ('helper', 'routes') for name, entry in results[group].items()}
+
+
+def compare(args):
+    with open(args.baseline) as baseline_file, open(args.current) as current_file:
+        baseline, current = json.load(baseline_file), json.load(current_file)
+    before, after = flatten(baseline), flatten(current)
+    rows = []
+    regressions = 0
+    for key in sorted(before.keys() & after.keys()):
+        ratio = after[key] / before[key] if before[key] else float('inf')
+        regressed = ratio > args.threshold and after[key] - before[key] > args.min_delta_ms
+        regressions += regressed
+        rows.append((*key, before[key], after[key], f'{ratio:.2f}', 'SLOWER' if regressed else ''))
+    print(f'{baseline["commit"]} -> {current["commit"]}')
+    print_table(rows, ['size', 'group', 'name', 'baseline ms', 'current ms', 'ratio', ''])
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f'only in {"baseline" if key in before else "current"}: {" ".join(key)}')
+    print('OK' if not regressions else f'{regressions} regressions')
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='build the datasets and time everything')
+    run_parser.add_argument('--sizes', nargs='+', default=['10k', '1m', '10m'], help='rows, k and m suffixes')
+    run_parser.add_argument('--clouds', nargs='+', default=[cloud.value for cloud in CloudType])
+    run_parser.add_argument('--services', nargs='+', default=DEFAULT_SERVICES)
+    run_parser.add_argument('--tags', nargs='+', default=DEFAULT_TAGS)
+    run_parser.add_argument('--interval', type=int, default=120, help='seconds between poll cycles')
+    run_parser.add_argument('--hours', type=int, default=24, help='window of the history/total reads')
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--cache', action='store_true', help='keep the response cache of the routes on')
+    run_parser.add_argument('--output', help='defaults to suite-<commit>.json')
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=1.25)
+    compare_parser.add_argument('--min-delta-ms', type=float, default=0.5)
+    args = parser.parse_args()
+    run(args) if args.command == 'run' else compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import datetime
+import itertools
+import random
+
+from tableaccess.properties import CloudType
+
+DEFAULT_CLOUDS = [CloudType.azure, CloudType.aws, CloudType.gcp]
+DEFAULT_SERVICES = ["EC2", "CloudFormation", "EBS", "EKS"]
+DEFAULT_TAGS = ["DMX", "DFX", "DWX", "MLX"]
+
+
+def generate_samples(n_rows, clouds=None, services=None, tags=None, interval_seconds=120, end=None, seed=0):
+    """
+    Synthetic cost samples, newest poll cycle ending at `end`
+    Every poll cycle emits one sample per (cloud, service, tag) combination, the way a collector polling
+    each account would, and cycles are `interval_seconds` apart walking back in time
+    :param n_rows: number of samples to generate
+    :param clouds: CloudType members, defaults to all clouds
+    :param services:
+    :param tags:
+    :param interval_seconds: time between successive poll cycles
+    :param end: timestamp of the newest cycle, defaults to now
+    :param seed: makes the generated dataset reproducible
+    :return: generator of add_row keyword argument dicts
+    """
+    rng = random.Random(seed)
+    combinations = list(itertools.product(clouds or DEFAULT_CLOUDS, services or DEFAULT_SERVICES,
+                                          tags or DEFAULT_TAGS))
+    end = end or datetime.datetime.now()
+    emitted = 0
+    cycle = 0
+    while emitted < n_rows:
+        timestamp = end - datetime.timedelta(seconds=cycle * interval_seconds)
+        for cloud, service, tag in combinations:
+            if emitted == n_rows:
+                break
+            yield {
+                'cloud_type': cloud,
+                'cost': rng.randrange(1000, 2500),
+                'service': service,
+                'tag': tag,
+                'timestamp': timestamp
+            }
+            emitted += 1
+        cycle += 1
+
+
+def load_samples(helper, samples, chunk_size=10000):
+    """
+    Bulk load samples through add_rows, so the rollup and cache generations are maintained as in production
+    :param helper: CbyTSQLAlchemyTableHelper
+    :param samples: iterable of dicts as produced by generate_samples
+    :param chunk_size:
+    :return: number of rows written
+    """
+    return helper.add_rows(samples, chunk_size)
@@ -0,0 +1,96 @@
+import datetime
+import itertools
+
+import sqlalchemy
+
+from tableaccess.properties import CloudType
+from tableobjects.cost_by_time import cost_by_time
+
+
+def helper_workload(helper, cloud_type=CloudType.aws, hours=24, service='EC2', tag='DMX'):
+    """
+    The CbyTSQLAlchemyTableHelper calls behind every cost_by_time_app read endpoint
+    :return: list of (name, zero argument callable)
+    """
+    return [
+        ('latest_consumption_by_service', lambda: helper.latest_consumption_by_service(cloud_type, service)),
+        ('latest_consumption_by_tag', lambda: helper.latest_consumption_by_tag(cloud_type, tag)),
+        ('latest_consumption_of_all_services', lambda: helper.latest_consumption_of_all_services(cloud_type)),
+        ('latest_consumption_of_all_tags', lambda: helper.latest_consumption_of_all_tags(cloud_type)),
+        ('aggregate_by_service', lambda: helper.aggregate_by_service(cloud_type, hours)),
+        ('aggregate_by_service[service]', lambda: helper.aggregate_by_service(cloud_type, hours, service)),
+        ('aggregate_by_tag', lambda: helper.aggregate_by_tag(cloud_type, hours)),
+        ('aggregate_by_tag[tag]', lambda: helper.aggregate_by_tag(cloud_type, hours, tag)),
+        ('aggregate_by_service_and_tag', lambda: helper.aggregate_by_service_and_tag(cloud_type, hours)),
+        ('total_cost_by_service', lambda: helper.total_cost_by_service(cloud_type, hours)),
+        ('total_cost_by_tag', lambda: helper.total_cost_by_tag(cloud_type, hours)),
+        ('total_cost_by_service_and_tag', lambda: helper.total_cost_by_service_and_tag(cloud_type, hours)),
+    ]
+
+
+def public_method_workload(helper, cloud_type=CloudType.aws, hours=24, service='EC2', tag='DMX'):
+    """
+    A call of every public CbyTSQLAlchemyTableHelper method: the read endpoint calls of helper_workload, then the
+    remaining reads, then the writes
+    Writes add one sample, then a batch of 1000, stamped now. apply_retention is given a horizon before the oldest
+    sample, so it times finding nothing to compact and the dataset stays reusable
+    :return: list of (name, zero argument callable), name is the method name optionally followed by [variant]
+    """
+    with helper.engine.connect() as conn:
+        last_sn, oldest = conn.execute(sqlalchemy.select(sqlalchemy.func.max(cost_by_time.SN),
+                                                         sqlalchemy.func.min(cost_by_time.timestamp))).one()
+    retention_days = (datetime.datetime.now() - (oldest or datetime.datetime.now())).days + 1
+    specs = [{'cloud_type': cloud_type, 'dimension': dimension, 'kind': kind, 'hours': hours, 'filter': None}
+             for dimension, kind in itertools.product(('service', 'tag', 'service_tag'), ('history', 'total'))]
+    sample = {'cloud_type': cloud_type, 'cost': 1500, 'service': service, 'tag': tag}
+
+    def shared_reads():
+        # What a request does: a generation check and a read
+        with helper.shared_connection():
+            helper.generation(cloud_type)
+            return helper.aggregate_by_service(cloud_type, hours)
+
+    return helper_workload(helper, cloud_type, hours, service, tag) + [
+        ('generation', lambda: helper.generation(cloud_type)),
+        ('shared_connection[generation, aggregate_by_service]', shared_reads),
+        ('batch_aggregate', lambda: helper.batch_aggregate(specs)),
+        ('history_since[last 100 samples]',
+         lambda: helper.history_since(cloud_type, 'service', max((last_sn or 0) - 100, 0), hours)),
+        ('export_samples[last hours]', lambda: sum(1 for _ in helper.export_samples(
+            cloud_type, start=datetime.datetime.now() - datetime.timedelta(hours=hours)))),
+        ('add_row', lambda: helper.add_row(**sample)),
+        ('add_rows[1000]', lambda: helper.add_rows([sample] * 1000)),
+        ('apply_retention[nothing to compact]', lambda: helper.apply_retention(retention_days=retention_days)),
+    ]
+
+
+def route_workload(cloud_type='aws', hours=24, service='EC2', tag='DMX'):
+    """
+    A request to every cost_by_time_app route
+    :return: list of (endpoint, method, url, JSON body or None)
+    """
+    api = f'/api/v1/{cloud_type}'
+    specs = [{'cloud_type': cloud_type, 'dimension': dimension, 'kind': kind, 'hours': hours}
+             for dimension, kind in itertools.product(('service', 'tag', 'service_tag'), ('history', 'total'))]
+    return [
+        ('index', 'GET', '/index', None),
+        ('cache_stats', 'GET', '/api/v1/cache/stats', None),
+        ('metrics', 'GET', '/metrics', None),
+        ('static', 'GET', '/static/swagger.json', None),
+        ('swagger_ui.show', 'GET', '/swagger/', None),
+        ('swagger_ui.static', 'GET', '/swagger/dist/favicon-16x16.png', None),
+        ('get_latest_for_all_services', 'GET', f'{api}/service', None),
+        ('get_latest_for_all_tags', 'GET', f'{api}/tag', None),
+        ('get_latest_by_service', 'GET', f'{api}/service/{service}', None),
+        ('get_latest_by_tag', 'GET', f'{api}/tag/{tag}', None),
+        ('get_service_history', 'GET', f'{api}/service/history?hours={hours}', None),
+        ('get_tag_history', 'GET', f'{api}/tag/history?hours={hours}', None),
+        ('get_service_and_tag_history', 'GET', f'{api}/service/tag/history?hours={hours}', None),
+        ('get_total_consumption_by_service', 'GET', f'{api}/service/total?hours={hours}', None),
+        ('get_total_consumption_by_tag', 'GET', f'{api}/tag/total?hours={hours}', None),
+        ('get_total_consumption_by_service_and_tag', 'GET', f'{api}/service/tag/total?hours={hours}', None),
+        ('export_samples', 'GET', f'{api}/samples/export?format=ndjson&start='
+                                  f'{(datetime.datetime.now() - datetime.timedelta(hours=hours)).isoformat()}', None),
+        ('batch_query', 'POST', '/api/v1/query', specs),
+        ('add_samples', 'POST', f'{api}/samples', [{'cost': 1500, 'service': service, 'tag': tag}] * 100),
+    ]
@@ -1,24 +1,128 @@
+import json
 import logging
+import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from multiprocessing import util
+
+from tableaccess.properties import Properties
 
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, process, thread and message, plus the traceback if any
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class ProcessQueueHandler(QueueHandler):
+    """
+    QueueHandler feeding the log listener of whichever process emits the record
+    Loggers are created at import, before the poller/scheduler processes fork, so the queue is looked up per record
+    rather than bound once: a forked child starts its own listener instead of filling its parent's queue
+    """
+
+    def __init__(self):
+        super().__init__(None)
+
+    def enqueue(self, record):
+        CustomLogger.process_queue().put_nowait(record)
+
+    def prepare(self, record):
+        # The record never leaves the process, so message and traceback formatting is left to the listener thread
+        return record
+
+
 class CustomLogger:
+    """
+    With Properties.async_logging the calling thread only puts the record on an in-memory queue; a listener thread
+    per process formats it and writes the console and the process's own file, logs/runs.<pid>.log. Only that
+    process rotates that file, and it is JSON lines when Properties.json_logs is set
+    Without it every logger writes the console and logs/runs.log inline, as it always did
+    """
+    listener = None
+    listener_pid = None
+    listener_queue = None
+    lock = threading.Lock()
 
     @staticmethod
     def getLogger(name):
         logger = logging.getLogger(name)
         logger.handlers = []
         logger.setLevel(logging.INFO)
+        for handler in CustomLogger.handlers():
+            logger.addHandler(handler)
+        return logger
 
+    @staticmethod
+    def handlers(filename='logs/runs.log', console=True):
+        """
+        Handlers for a logger, e.g. a Flask app.logger
+        :param filename: file written by the synchronous mode, the asynchronous mode writes the per process file
+        :param console: also log to stdout in the synchronous mode
+        :return:
+        """
+        if Properties.async_logging:
+            return [ProcessQueueHandler()]
+        handlers = []
+        if console:
+            console_handler = logging.StreamHandler(stream=sys.stdout)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+        file_handler = RotatingFileHandler(filename=filename, maxBytes=1000000, backupCount=5)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+        return handlers
+
+    @staticmethod
+    def process_queue():
+        """
+        Queue of this process's listener, started on first use in every process
+        """
+        if CustomLogger.listener_pid != os.getpid():
+            with CustomLogger.lock:
+                if CustomLogger.listener_pid != os.getpid():
+                    CustomLogger.start_listener()
+        return CustomLogger.listener_queue
+
+    @staticmethod
+    def start_listener():
         console_handler = logging.StreamHandler(stream=sys.stdout)
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        file_handler = RotatingFileHandler(filename=f'logs/runs.{os.getpid()}.log', maxBytes=1000000, backupCount=5)
+        file_handler.setFormatter(JsonFormatter() if Properties.json_logs else formatter)
 
-        file_handler = RotatingFileHandler(filename="logs/runs.log", maxBytes=1000000, backupCount=5)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        CustomLogger.listener_queue = queue.SimpleQueue()
+        CustomLogger.listener = QueueListener(CustomLogger.listener_queue, console_handler, file_handler,
+                                              respect_handler_level=True)
+        CustomLogger.listener.start()
+        CustomLogger.listener_pid = os.getpid()
+        # Multiprocessing children leave through os._exit, which skips atexit but runs these finalizers
+        util.Finalize(None, CustomLogger.stop_listener, exitpriority=0)
 
-        return logger
+    @staticmethod
+    def stop_listener():
+        """
+        Drain the queue and stop this process's listener
+        """
+        with CustomLogger.lock:
+            if CustomLogger.listener and CustomLogger.listener_pid == os.getpid():
+                CustomLogger.listener.stop()
+                CustomLogger.listener = None
+                CustomLogger.listener_pid = None
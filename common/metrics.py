@@ -0,0 +1,195 @@
+import functools
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000, 10000)
+LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+
+class Histogram:
+    """
+    Prometheus style cumulative histogram per label set
+    Memory is bounded by the fixed buckets times the label sets, which callers keep to route templates, method names
+    and statement kinds
+    """
+
+    def __init__(self, name, documentation, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.lock:
+            counts, total = self.series.get(key, ([0] * (len(self.buckets) + 1), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.series[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self.series.items())
+        for key, counts, total in series:
+            pairs = list(zip(self.label_names, key))
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                lines.append(f'{self.name}_bucket{label_text(pairs + [("le", bound)])} {count}')
+            lines.append(f'{self.name}_sum{label_text(pairs)} {total}')
+            lines.append(f'{self.name}_count{label_text(pairs)} {counts[-1]}')
+        return lines
+
+
+class Counter:
+    """
+    Monotonic counter per label set
+    """
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            series = sorted(self.series.items())
+        for key, value in series:
+            lines.append(f'{self.name}{label_text(zip(self.label_names, key))} {value}')
+        return lines
+
+
+def label_text(pairs):
+    """
+    {name="value",...} with values escaped as the exposition format requires
+    """
+    escaped = (f'{name}="{str(value).translate(LABEL_ESCAPES)}"' for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class MetricsRegistry:
+    """
+    Request, SQL and table helper metrics of one process, rendered in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self.request_duration = Histogram('http_request_duration_seconds', 'Request latency by route',
+                                          ['route', 'method', 'status'])
+        self.request_statements = Histogram('http_request_sql_statements', 'SQL statements executed per request',
+                                            ['route'], buckets=COUNT_BUCKETS)
+        self.request_sql_duration = Histogram('http_request_sql_duration_seconds', 'Time spent in SQL per request',
+                                              ['route'])
+        self.statement_duration = Histogram('sql_statement_duration_seconds', 'SQL statement execution time',
+                                            ['statement'])
+        self.helper_duration = Histogram('table_helper_call_duration_seconds', 'Table helper method latency',
+                                         ['method'])
+        self.helper_rows = Counter('table_helper_rows_returned_total', 'Rows returned by table helper methods',
+                                   ['method'])
+        self.helper_errors = Counter('table_helper_errors_total', 'Table helper calls that raised', ['method'])
+        self.coalesced = Counter('coalesced_calls_total', 'Calls answered by an identical call already in flight',
+                                 ['layer', 'call'])
+
+    def metrics(self):
+        return [self.request_duration, self.request_statements, self.request_sql_duration, self.statement_duration,
+                self.helper_duration, self.helper_rows, self.helper_errors, self.coalesced]
+
+    def render(self):
+        return '\n'.join(line for metric in self.metrics() for line in metric.render()) + '\n'
+
+
+def instrument_app(app, registry: MetricsRegistry):
+    """
+    Time every request of a Flask app and serve the registry on GET /metrics
+    Routes are labelled by their URL rule (e.g. /api/v1/<cloud_type>/service) so label sets stay bounded
+    """
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+    @app.after_request
+    def observe_request(response):
+        if 'metrics_start' in g:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            registry.request_duration.observe(time.perf_counter() - g.metrics_start, route=route,
+                                              method=request.method, status=response.status_code)
+            registry.request_statements.observe(g.sql_statements, route=route)
+            registry.request_sql_duration.observe(g.sql_seconds, route=route)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def instrument_engine(engine, registry: MetricsRegistry):
+    """
+    Time every statement executed on an engine through cursor execute events
+    Statements run while serving a request also count towards that request's SQL totals
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def observe_statement(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_start'].pop()
+        registry.statement_duration.observe(elapsed, statement=statement.split(None, 1)[0].upper())
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_statements += 1
+            g.sql_seconds += elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def drop_statement_timer(context):
+        # A failed statement never reaches after_cursor_execute, its start would pair with the next statement
+        if context.connection is not None and context.connection.info.get('metrics_start'):
+            context.connection.info['metrics_start'].pop()
+
+
+def instrument_helper(helper, registry: MetricsRegistry, methods):
+    """
+    Time data methods of a table helper instance and count the rows they return
+    A list result counts its length, any other non empty result one row
+    Only the listed methods are wrapped: context managers, generators (streamed exports) and blocking waits return
+    before or long after their queries run, their timings would not be query latencies
+    :param helper:
+    :param registry:
+    :param methods: method names, e.g. the TIMED_METHODS of the helper's module
+    """
+    for name in methods:
+        setattr(helper, name, timed_method(getattr(helper, name), name, registry))
+
+
+def timed_method(method, name, registry: MetricsRegistry):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            registry.helper_errors.inc(method=name)
+            raise
+        finally:
+            registry.helper_duration.observe(time.perf_counter() - start, method=name)
+        registry.helper_rows.inc(len(result) if isinstance(result, list) else int(bool(result)), method=name)
+        return result
+
+    return wrapper
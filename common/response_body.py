@@ -0,0 +1,58 @@
+"""
+JSON bodies of the API responses
+rows (the default) sends results as they are, lists of objects. columnar sends every list of objects as one object
+of arrays, one per field, so field names are written once rather than on every row:
+    [{"service": "EC2", "total_cost": 10}, {"service": "EBS", "total_cost": 4}]
+    {"service": ["EC2", "EBS"], "total_cost": [10, 4]}
+Bodies are encoded like flask.jsonify with the default settings (compact, sorted keys, trailing newline), by orjson
+from requirements.txt, several times faster than json.dumps. orjson bodies hold non ASCII text as UTF-8 rather than
+\\u escapes, which decodes to the same JSON. json.dumps is the fallback where orjson cannot be installed
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RESPONSE_FORMATS = ('rows', 'columnar')
+
+
+def response_format(requested):
+    """
+    :param requested: format= request parameter, None for the default
+    :return: one of RESPONSE_FORMATS
+    """
+    requested = requested or 'rows'
+    if requested not in RESPONSE_FORMATS:
+        raise ValueError(f'Invalid Input:format must be one of {list(RESPONSE_FORMATS)}')
+    return requested
+
+
+def columnar(data):
+    """
+    data with every list of objects turned into an object of arrays, at any depth
+    Rows of a result share their fields and the shape of their values, those of the first row name the arrays and
+    tell which hold nested lists or objects. An empty list stays [], there are no fields to name
+    """
+    if isinstance(data, dict):
+        return {key: columnar(value) for key, value in data.items()}
+    if not isinstance(data, list):
+        return data
+    if data and all(isinstance(row, dict) for row in data):
+        return {field: [columnar(row.get(field)) for row in data] if isinstance(first, (dict, list)) else
+                [row.get(field) for row in data] for field, first in data[0].items()}
+    return [columnar(item) for item in data]
+
+
+def encode(data, requested_format='rows'):
+    """
+    :param data: JSON serializable result
+    :param requested_format: one of RESPONSE_FORMATS
+    :return: body bytes
+    """
+    if requested_format == 'columnar':
+        data = columnar(data)
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(data, sort_keys=True, separators=(',', ':')) + '\n').encode()
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Thread-safe in-process TTL + LRU cache
+    Every entry remembers the generation it was computed at, and is only served while the caller still sees that
+    generation, so bumping the generation invalidates entries without having to find them
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=120):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, generation, compute, ttl_seconds=None):
+        """
+        :param key: hashable
+        :param generation: current generation of the data the result depends on.
+                Read it before computing, so a write landing mid-computation makes the stored entry stale right away
+        :param compute: zero argument callable producing the result on a miss
+        :param ttl_seconds: overrides the default ttl for this entry
+        :return:
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == generation and entry[1] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        result = compute()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self.lock:
+            self.entries[key] = (generation, now + ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds
+            }
@@ -0,0 +1,80 @@
+import functools
+import threading
+
+
+class InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Thread-safe duplicate call suppression: while a call for a key runs, callers asking for the same key wait for it
+    and share its result, or its exception, instead of running their own. Nothing is kept once the call returns,
+    the next caller runs it again
+    Waiters get the very object the first caller got, so results must not be mutated
+    A waiter can miss a write committed after the call it joined started, like any read racing that write
+    """
+
+    def __init__(self, on_coalesced=None):
+        """
+        :param on_coalesced: optional callable(key) called for every caller that joined an in flight call
+        """
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.on_coalesced = on_coalesced
+
+    def do(self, key, fn):
+        """
+        :param key: hashable
+        :param fn: zero argument callable
+        :return: result of fn, run by this caller or by the one already in flight for key
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = InFlightCall()
+        if not leader:
+            if self.on_coalesced:
+                self.on_coalesced(key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+def single_flight_methods(obj, names, group: SingleFlight, version=None):
+    """
+    Route the named methods of an instance through a SingleFlight group, keyed by method name and arguments
+    Calls with unhashable arguments run as they are
+    :param version: optional callable(args, kwargs) read before every call and added to its key, e.g. the generation
+                    of the data it reads: a caller that saw a newer version never joins a call started on an older one
+    """
+    for name in names:
+        setattr(obj, name, single_flight_method(getattr(obj, name), name, group, version))
+
+
+def single_flight_method(method, name, group: SingleFlight, version=None):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        key = (name, args, tuple(sorted(kwargs.items())), version(args, kwargs) if version else None)
+        try:
+            hash(key)
+        except TypeError:
+            return method(*args, **kwargs)
+        return group.do(key, lambda: method(*args, **kwargs))
+
+    return wrapper
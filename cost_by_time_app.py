@@ -1,13 +1,25 @@
+import contextlib
+import csv
+import datetime
+import io
+import itertools
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import tempfile
 
-from flask import Flask, make_response, jsonify, request
+from flask import Flask, Response, g, make_response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_swagger_ui import get_swaggerui_blueprint
 
+from common.custom_logging import CustomLogger
+from common import response_body
+from common.metrics import MetricsRegistry, instrument_app, instrument_engine, instrument_helper
+from common.result_cache import ResultCache
+from common.single_flight import SingleFlight, single_flight_methods
 from runlogic.CostTracker import ProcessTracker
 from tableaccess.AccessFactory import AccessFactory
-from tableaccess.properties import CloudType
+from tableaccess.CostByTimeSQLAlchemyHelper import READ_METHODS, TIMED_METHODS
+from tableaccess.properties import CloudType, Properties
 
 cost_app = Flask(__name__)
 
@@ -29,11 +41,59 @@ cost_app.register_blueprint(SWAGGERUI_BLUEPRINT, url_prefix=SWAGGER_URL)
 
 table_helper = AccessFactory.get_cost_by_time_db_conn()
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler = RotatingFileHandler(filename='logs/flask.log', maxBytes=1000000, backupCount=5)
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.DEBUG)
-cost_app.logger.addHandler(file_handler)
+metrics = MetricsRegistry()
+instrument_app(cost_app, metrics)
+instrument_engine(table_helper.engine, metrics)
+instrument_helper(table_helper, metrics, TIMED_METHODS)
+
+
+def read_generation(args, kwargs):
+    """
+    Generation of the cloud a READ_METHODS call reads, part of its single flight key: a reader that saw an ingest
+    commit must not share the result of a call started before it, response_cache would keep that under the new one
+    """
+    return table_helper.generation(kwargs['cloud_type'] if 'cloud_type' in kwargs else args[0])
+
+
+if Properties.single_flight_reads:
+    # Wraps the timed methods, so helper metrics count the queries actually run
+    single_flight_methods(table_helper, READ_METHODS,
+                          SingleFlight(lambda key: metrics.coalesced.inc(layer='helper', call=key[0])),
+                          read_generation)
+
+
+@cost_app.before_request
+def share_read_connection():
+    # Every table helper read of a request runs on one connection, see CbyTSQLAlchemyTableHelper.shared_connection
+    g.read_connection = contextlib.ExitStack()
+    g.read_connection.enter_context(table_helper.shared_connection())
+
+
+@cost_app.teardown_request
+def release_read_connection(exception):
+    if 'read_connection' in g:
+        g.pop('read_connection').close()
+
+
+response_cache = ResultCache(max_entries=Properties.response_cache_max_entries,
+                             ttl_seconds=Properties.response_cache_ttl_seconds)
+
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_FIELDS = ['SN', 'timestamp', 'tag', 'service', 'cost_per_hour']
+QUERY_DIMENSIONS = ('service', 'tag', 'service_tag')
+QUERY_KINDS = ('history', 'total')
+# History and total endpoints -> dimension of the history_since delta they return when given since=
+DELTA_DIMENSIONS = {
+    'get_service_history': 'service',
+    'get_tag_history': 'tag',
+    'get_service_and_tag_history': 'service_tag',
+    'get_total_consumption_by_service': 'service',
+    'get_total_consumption_by_tag': 'tag',
+    'get_total_consumption_by_service_and_tag': 'service_tag',
+}
+
+for handler in CustomLogger.handlers(filename='logs/flask.log', console=False):
+    cost_app.logger.addHandler(handler)
 cost_app.logger.setLevel(logging.DEBUG)
 
 
@@ -42,12 +102,105 @@ def index():
     return make_response(jsonify({"message": "Welcome to E2E COST BY TIME TRACKER"}))
 
 
+def request_format():
+    """
+    format= of the request, see common.response_body
+    Raises ValueError for an unknown format, which every route answers with 400
+    """
+    return response_body.response_format(request.args.get('format'))
+
+
+def encoded(data, requested_format=None):
+    """
+    Body of data in the requested format, defaults to the one of the current request
+    """
+    return response_body.encode(data, requested_format or request_format())
+
+
+def json_response(body: bytes):
+    return Response(body, mimetype='application/json')
+
+
+def cached(cloud_type: CloudType, compute, **filters):
+    """
+    Body of compute's result for the current endpoint, cloud, filters and format, see cached_body
+    """
+    return cached_body(request.endpoint, cloud_type, compute, request.args.get('format'), **filters)
+
+
+def cached_body(endpoint, cloud_type: CloudType, compute, requested_format=None, generation=None, **filters):
+    """
+    Encoded body of compute's result in a response format, see cached_result
+    The body is what gets cached, so a hit is sent as is without serializing the result again
+    :param endpoint:
+    :param cloud_type:
+    :param compute: zero argument callable querying table_helper
+    :param requested_format: format= request parameter, None for the default
+    :param generation: see cached_result
+    :param filters: request parameters the result depends on
+    :return: body bytes
+    """
+    requested_format = response_body.response_format(requested_format)
+    return cached_result(endpoint, cloud_type, lambda: response_body.encode(compute(), requested_format),
+                         generation, format=requested_format, **filters)
+
+
+def cached_result(endpoint, cloud_type: CloudType, compute, generation=None, **filters):
+    """
+    Result of compute for an endpoint, cloud and filters
+    Served from response_cache until the cloud's generation moves (a sample was committed by any process),
+    the ttl runs out, or the hour changes and with it the hours= window
+    :param endpoint: view function name, shared with the ASGI entry point so both serve the same entries
+    :param cloud_type:
+    :param compute: zero argument callable querying table_helper
+    :param generation: generation of the cloud read before compute runs, defaults to the current one
+    :param filters: request parameters the result depends on
+    :return:
+    """
+    now = datetime.datetime.now()
+    next_hour = now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+    ttl_seconds = min(response_cache.ttl_seconds, (next_hour - now).total_seconds())
+    key = (endpoint, cloud_type, tuple(sorted(filters.items())))
+    if generation is None:
+        generation = table_helper.generation(cloud_type)
+    return response_cache.get_or_compute(key, generation, compute, ttl_seconds=ttl_seconds)
+
+
+def history_delta(endpoint, cloud_type: CloudType, since, hours, value=None):
+    """
+    Delta of an endpoint's history since a cursor, see CbyTSQLAlchemyTableHelper.history_since
+    Total endpoints return the same hourly rows, their totals are the sums of those per value
+    :param endpoint: a DELTA_DIMENSIONS key
+    :param cloud_type:
+    :param since: since= request parameter, a last seen SN or an ISO 8601 timestamp
+    :param hours:
+    :param value: service/tag filter
+    :return:
+    """
+    cursor = int(since) if since.isdigit() else datetime.datetime.fromisoformat(since)
+    return table_helper.history_since(cloud_type=cloud_type, dimension=DELTA_DIMENSIONS[endpoint], since=cursor,
+                                      n_hour_prior=hours, value=value)
+
+
+@cost_app.route("/api/v1/cache/stats", methods=["GET"])
+def cache_stats():
+    try:
+        return json_response(encoded(response_cache.stats()))
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
+
+
 @cost_app.route("/api/v1/<cloud_type>/service", methods=["GET"])
 def get_latest_for_all_services(cloud_type):
     try:
         cost_app.logger.info(f'Getting latest consumption for all services on {cloud_type}')
-        data = table_helper.latest_consumption_of_all_services(cloud_type=CloudType(cloud_type))
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        body = cached(cloud, lambda: table_helper.latest_consumption_of_all_services(cloud_type=cloud))
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -57,8 +210,12 @@ def get_latest_for_all_services(cloud_type):
 def get_latest_for_all_tags(cloud_type):
     try:
         cost_app.logger.info(f'Getting latest consumption for all tags on {cloud_type}')
-        data = table_helper.latest_consumption_of_all_tags(cloud_type=CloudType(cloud_type))
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        body = cached(cloud, lambda: table_helper.latest_consumption_of_all_tags(cloud_type=cloud))
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -68,8 +225,12 @@ def get_latest_for_all_tags(cloud_type):
 def get_latest_by_tag(cloud_type, tag):
     try:
         cost_app.logger.info(f'Getting latest consumption for tag {tag} on {cloud_type}')
-        data = table_helper.latest_consumption_by_tag(cloud_type=CloudType(cloud_type), tag=tag)
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        body = cached(cloud, lambda: table_helper.latest_consumption_by_tag(cloud_type=cloud, tag=tag), tag=tag)
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -79,8 +240,13 @@ def get_latest_by_tag(cloud_type, tag):
 def get_latest_by_service(cloud_type, service):
     try:
         cost_app.logger.info(f'Getting latest consumption for service {service} on {cloud_type}')
-        data = table_helper.latest_consumption_by_service(cloud_type=CloudType(cloud_type), service=service)
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        body = cached(cloud, lambda: table_helper.latest_consumption_by_service(cloud_type=cloud, service=service),
+                      service=service)
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -94,9 +260,17 @@ def get_service_history(cloud_type):
         cost_app.logger.info(
             f'Getting service consumption history for {service_filter if service_filter else "all"} '
             f'service(s) on {cloud_type}')
-        data = table_helper.aggregate_by_service(cloud_type=CloudType(cloud_type), n_hour_prior=hours,
-                                                 service=service_filter)
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        since = request.args.get('since')
+        if since is not None:
+            return json_response(encoded(history_delta(request.endpoint, cloud, since, hours, service_filter)))
+        body = cached(cloud, lambda: table_helper.aggregate_by_service(cloud_type=cloud, n_hour_prior=hours,
+                                                                       service=service_filter),
+                      hours=hours, service=service_filter)
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -109,8 +283,17 @@ def get_tag_history(cloud_type):
         hours = int(request.args.get('hours', 5))
         cost_app.logger.info(
             f'Getting tag consumption history for {tag_filter if tag_filter else "all"} service(s) on {cloud_type}')
-        data = table_helper.aggregate_by_tag(cloud_type=CloudType(cloud_type), n_hour_prior=hours, tag=tag_filter)
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        since = request.args.get('since')
+        if since is not None:
+            return json_response(encoded(history_delta(request.endpoint, cloud, since, hours, tag_filter)))
+        body = cached(cloud, lambda: table_helper.aggregate_by_tag(cloud_type=cloud, n_hour_prior=hours,
+                                                                   tag=tag_filter),
+                      hours=hours, tag=tag_filter)
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -121,8 +304,16 @@ def get_service_and_tag_history(cloud_type):
     try:
         hours = int(request.args.get('hours', 5))
         cost_app.logger.info(f"Aggregating metrices for service and tags on {cloud_type}")
-        data = table_helper.aggregate_by_service_and_tag(cloud_type=CloudType(cloud_type), n_hour_prior=hours)
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        since = request.args.get('since')
+        if since is not None:
+            return json_response(encoded(history_delta(request.endpoint, cloud, since, hours)))
+        body = cached(cloud, lambda: table_helper.aggregate_by_service_and_tag(cloud_type=cloud, n_hour_prior=hours),
+                      hours=hours)
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -134,9 +325,17 @@ def get_total_consumption_by_service(cloud_type):
         hours = int(request.args.get('hours', 5))
         cost_app.logger.info(f"Aggregating total consumption of service for {cloud_type}")
         service_filter = request.args.get('service')
-        data = table_helper.total_cost_by_service(cloud_type=CloudType(cloud_type), n_hour_prior=hours,
-                                                  service=service_filter)
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        since = request.args.get('since')
+        if since is not None:
+            return json_response(encoded(history_delta(request.endpoint, cloud, since, hours, service_filter)))
+        body = cached(cloud, lambda: table_helper.total_cost_by_service(cloud_type=cloud, n_hour_prior=hours,
+                                                                        service=service_filter),
+                      hours=hours, service=service_filter)
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -148,8 +347,17 @@ def get_total_consumption_by_tag(cloud_type):
         tag_filter = request.args.get('tag')
         hours = int(request.args.get('hours', 5))
         cost_app.logger.info(f'Getting total tag consumption  on {cloud_type}')
-        data = table_helper.total_cost_by_tag(cloud_type=CloudType(cloud_type), n_hour_prior=hours, tag=tag_filter)
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        since = request.args.get('since')
+        if since is not None:
+            return json_response(encoded(history_delta(request.endpoint, cloud, since, hours, tag_filter)))
+        body = cached(cloud, lambda: table_helper.total_cost_by_tag(cloud_type=cloud, n_hour_prior=hours,
+                                                                    tag=tag_filter),
+                      hours=hours, tag=tag_filter)
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -160,8 +368,185 @@ def get_total_consumption_by_service_and_tag(cloud_type):
     try:
         hours = int(request.args.get('hours', 5))
         cost_app.logger.info(f"Getting total for service and tags on {cloud_type}")
-        data = table_helper.total_cost_by_service_and_tag(cloud_type=CloudType(cloud_type), n_hour_prior=hours)
-        return make_response(jsonify(data))
+        cloud = CloudType(cloud_type)
+        since = request.args.get('since')
+        if since is not None:
+            return json_response(encoded(history_delta(request.endpoint, cloud, since, hours)))
+        body = cached(cloud, lambda: table_helper.total_cost_by_service_and_tag(cloud_type=cloud, n_hour_prior=hours),
+                      hours=hours)
+        return json_response(body)
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
+    except Exception as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 500)
+
+
+def parse_sample(cloud_type: CloudType, sample: dict):
+    """
+    One posted sample -> add_rows keyword arguments
+    :param cloud_type: cloud from the request path, samples can't override it
+    :param sample: {"cost": .., "service": .., "tag": optional, "timestamp": optional ISO 8601}
+    :return:
+    """
+    if not isinstance(sample, dict) or sample.get('cost') is None or not sample.get('service'):
+        raise ValueError(f"Invalid Input:cost and service are mandatory, got {sample}")
+    timestamp = sample.get('timestamp')
+    return {
+        'cloud_type': cloud_type,
+        'cost': int(sample['cost']),
+        'service': sample['service'],
+        'tag': sample.get('tag'),
+        'timestamp': datetime.datetime.fromisoformat(timestamp) if timestamp else None
+    }
+
+
+def posted_samples(cloud_type: CloudType):
+    """
+    Samples of a JSON array body, or of an NDJSON body read line by line so large uploads are never held in memory
+    Every sample is parsed before any is returned, so a bad one rejects the whole body and nothing gets written.
+    NDJSON lines are checked as they are read and spooled to a temporary file, in memory up to
+    Properties.samples_spool_max_bytes, then parsed again from it while add_rows writes them
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        spool = tempfile.SpooledTemporaryFile(max_size=Properties.samples_spool_max_bytes)
+        try:
+            for line in request.stream:
+                if line.strip():
+                    parse_sample(cloud_type, json.loads(line))
+                    spool.write(line if line.endswith(b'\n') else line + b'\n')
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spooled_samples(cloud_type, spool)
+    # silent: a body that is not JSON at all is None here and rejected below, not a werkzeug BadRequest
+    samples = request.get_json(force=True, silent=True)
+    if not isinstance(samples, list):
+        raise ValueError("Invalid Input:expected a JSON array of samples")
+    return [parse_sample(cloud_type, sample) for sample in samples]
+
+
+def spooled_samples(cloud_type: CloudType, spool):
+    """
+    Samples of the NDJSON lines posted_samples checked and spooled, closing the spool once read
+    """
+    with spool:
+        for line in spool:
+            yield parse_sample(cloud_type, json.loads(line))
+
+
+@cost_app.route("/api/v1/<cloud_type>/samples", methods=["POST"])
+def add_samples(cloud_type):
+    try:
+        cloud = CloudType(cloud_type)
+        requested_format = request_format()
+        inserted = table_helper.add_rows(posted_samples(cloud))
+        cost_app.logger.info(f'Added {inserted} samples on {cloud_type}')
+        return json_response(encoded({"inserted": inserted}, requested_format))
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
+    except Exception as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 500)
+
+
+def parse_query_spec(spec: dict):
+    """
+    One posted aggregation spec -> batch_aggregate spec
+    :param spec: {"cloud_type": .., "dimension": service|tag|service_tag, "kind": history|total,
+                  "hours": optional, default 5, "filter": optional service/tag value}
+    :return:
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"Invalid Input:expected an aggregation spec object, got {spec}")
+    if spec.get('dimension') not in QUERY_DIMENSIONS or spec.get('kind') not in QUERY_KINDS:
+        raise ValueError(f"Invalid Input:dimension must be one of {list(QUERY_DIMENSIONS)} and kind one of "
+                         f"{list(QUERY_KINDS)}, got {spec}")
+    if spec.get('filter') and spec['dimension'] == 'service_tag':
+        raise ValueError(f"Invalid Input:filter applies to the service or tag dimension only, got {spec}")
+    return {
+        'cloud_type': CloudType(spec.get('cloud_type')),
+        'dimension': spec['dimension'],
+        'kind': spec['kind'],
+        'hours': int(spec.get('hours', 5)),
+        'filter': spec.get('filter')
+    }
+
+
+@cost_app.route("/api/v1/query", methods=["POST"])
+def batch_query():
+    try:
+        requested_format = request_format()
+        specs = request.get_json(force=True, silent=True)
+        if not isinstance(specs, list):
+            raise ValueError("Invalid Input:expected a JSON array of aggregation specs")
+        specs = [parse_query_spec(spec) for spec in specs]
+        cost_app.logger.info(f'Running {len(specs)} aggregations')
+        results = table_helper.batch_aggregate(specs)
+        return json_response(encoded([dict(spec, cloud_type=spec['cloud_type'].value, result=result)
+                                      for spec, result in zip(specs, results)], requested_format))
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
+    except Exception as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 500)
+
+
+def export_lines(samples, export_format, batch_size=1000):
+    """
+    Encode exported samples as NDJSON or CSV text, a batch of rows per chunk so the response is written in
+    reasonably sized pieces
+    :param samples: iterable of cost_by_time.to_json shaped dicts
+    :param export_format: ndjson or csv
+    :param batch_size: rows per yielded chunk
+    :return:
+    """
+    buffer = io.StringIO()
+    writer = None
+    if export_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator='\n')
+        writer.writeheader()
+    for rows in iter(lambda: list(itertools.islice(samples, batch_size)), []):
+        for row in rows:
+            if writer:
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(row))
+                buffer.write('\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@cost_app.route("/api/v1/<cloud_type>/samples/export", methods=["GET"])
+def export_samples(cloud_type):
+    try:
+        cloud = CloudType(cloud_type)
+        export_format = request.args.get('format', 'ndjson')
+        if export_format not in EXPORT_MIMETYPES:
+            raise ValueError(f'Invalid Input:format must be one of {list(EXPORT_MIMETYPES)}')
+        start, end = request.args.get('start'), request.args.get('end')
+        filters = {
+            'start': datetime.datetime.fromisoformat(start) if start else None,
+            'end': datetime.datetime.fromisoformat(end) if end else None,
+            'service': request.args.get('service'),
+            'tag': request.args.get('tag')
+        }
+        cost_app.logger.info(f'Exporting samples on {cloud_type} as {export_format} with {filters}')
+        samples = table_helper.export_samples(cloud_type=cloud, **filters)
+        response = Response(stream_with_context(export_lines(samples, export_format)),
+                            mimetype=EXPORT_MIMETYPES[export_format])
+        response.headers['Content-Disposition'] = f'attachment; filename={cloud_type}_samples.{export_format}'
+        return response
+    except ValueError as e:
+        cost_app.logger.exception(e)
+        return make_response(jsonify({'Exception': e.__repr__()}), 400)
     except Exception as e:
         cost_app.logger.exception(e)
         return make_response(jsonify({'Exception': e.__repr__()}), 500)
@@ -0,0 +1,223 @@
+"""
+ASGI entry point of the cost by time API, serving the same routes as cost_by_time_app
+Cached reads (the latest/history/total GET endpoints) are answered natively: the database work runs on a bounded
+thread pool of Properties.asgi_db_workers threads, and identical reads arriving while one is in flight wait for
+that one instead of querying again. Every other route (ingest, query, export, swagger, metrics) runs the Flask app
+on the same pool, request bodies of those are read into memory first
+
+    uvicorn cost_by_time_asgi:asgi_app --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 cost_by_time_asgi:asgi_app
+The Flask app stays servable by any WSGI server, e.g. gunicorn -w 4 --threads 8 cost_by_time_app:cost_app
+With either, run the consumption poller as its own process (python -m runlogic.CostTracker) rather than per worker
+"""
+import asyncio
+import functools
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import json
+from werkzeug.exceptions import HTTPException
+from werkzeug.urls import url_decode
+
+from common import response_body
+from cost_by_time_app import DELTA_DIMENSIONS, cost_app, cached_body, history_delta, metrics, table_helper
+from tableaccess.properties import CloudType, Properties
+
+# endpoint -> (table helper method, path parameters, query parameters, takes hours=)
+READ_ENDPOINTS = {
+    'get_latest_for_all_services': ('latest_consumption_of_all_services', (), (), False),
+    'get_latest_for_all_tags': ('latest_consumption_of_all_tags', (), (), False),
+    'get_latest_by_tag': ('latest_consumption_by_tag', ('tag',), (), False),
+    'get_latest_by_service': ('latest_consumption_by_service', ('service',), (), False),
+    'get_service_history': ('aggregate_by_service', (), ('service',), True),
+    'get_tag_history': ('aggregate_by_tag', (), ('tag',), True),
+    'get_service_and_tag_history': ('aggregate_by_service_and_tag', (), (), True),
+    'get_total_consumption_by_service': ('total_cost_by_service', (), ('service',), True),
+    'get_total_consumption_by_tag': ('total_cost_by_tag', (), ('tag',), True),
+    'get_total_consumption_by_service_and_tag': ('total_cost_by_service_and_tag', (), (), True),
+}
+
+
+def read_body(endpoint, cloud_type: CloudType, method_name, filters, requested_format=None, generation=None):
+    """
+    JSON body of a read endpoint, the one the Flask view sends
+    :param generation: generation of the cloud read before, defaults to the current one, see cached_result
+    """
+    with table_helper.shared_connection():
+        if 'since' in filters:
+            data = history_delta(endpoint, cloud_type, filters['since'], filters['hours'],
+                                 filters.get('service') or filters.get('tag'))
+            return response_body.encode(data, response_body.response_format(requested_format))
+        arguments = dict(filters)
+        if 'hours' in arguments:
+            arguments['n_hour_prior'] = arguments.pop('hours')
+        return cached_body(endpoint, cloud_type,
+                           lambda: getattr(table_helper, method_name)(cloud_type=cloud_type, **arguments),
+                           requested_format, generation, **filters)
+
+
+def wsgi_environ(scope, body: bytes):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1').upper().replace('-', '_'), value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class Coalescer:
+    """
+    Awaitables keyed by what they compute: a caller asking for a key already in flight awaits that computation
+    instead of starting another. Entries only live while in flight, so nothing is cached here
+    """
+
+    def __init__(self, on_coalesced=None):
+        """
+        :param on_coalesced: optional callable(key) called for every caller that joined an in flight computation
+        """
+        self.in_flight = {}
+        self.on_coalesced = on_coalesced
+
+    async def run(self, key, start):
+        """
+        :param key: hashable
+        :param start: zero argument callable returning an awaitable of the result
+        :return:
+        """
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(start())
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        elif self.on_coalesced:
+            self.on_coalesced(key)
+        # A caller going away (client disconnect) must not cancel the computation the others wait on
+        return await asyncio.shield(future)
+
+
+class CostByTimeASGI:
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or Properties.asgi_db_workers,
+                                           thread_name_prefix='asgi-db')
+        self.coalescer = Coalescer(lambda key: metrics.coalesced.inc(layer='asgi', call=key[0]))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+        try:
+            adapter = cost_app.url_map.bind('localhost', script_name=scope.get('root_path') or None)
+            rule, values = adapter.match(scope['path'], method=scope['method'], return_rule=True)
+        except HTTPException:
+            # 404, 405 and slash redirects are left to Flask
+            rule = None
+        if rule is not None and scope['method'] == 'GET' and rule.endpoint in READ_ENDPOINTS:
+            return await self.read(scope, send, rule, values)
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read(self, scope, send, rule, values):
+        start = time.perf_counter()
+        method_name, path_parameters, query_parameters, windowed = READ_ENDPOINTS[rule.endpoint]
+        args = url_decode(scope['query_string'])
+        try:
+            cloud = CloudType(values['cloud_type'])
+            filters = {name: values[name] for name in path_parameters}
+            filters.update({name: args.get(name) for name in query_parameters})
+            if windowed:
+                filters['hours'] = int(args.get('hours', 5))
+            if rule.endpoint in DELTA_DIMENSIONS and args.get('since') is not None:
+                filters['since'] = args['since']
+            requested_format = args.get('format')
+            cost_app.logger.info(f'{rule.endpoint} on {cloud.value} with {filters}')
+            loop = asyncio.get_running_loop()
+            # Part of the key: a request arriving after an ingest commit must not await a computation started before
+            generation = await loop.run_in_executor(self.executor, table_helper.generation, cloud)
+            compute = functools.partial(loop.run_in_executor, self.executor, read_body, rule.endpoint, cloud,
+                                        method_name, filters, requested_format, generation)
+            key = (rule.endpoint, cloud, tuple(sorted(filters.items())), requested_format, generation)
+            status, body = 200, await self.coalescer.run(key, compute)
+        except Exception as e:
+            cost_app.logger.exception(e)
+            # As the Flask views: a bad parameter (cloud_type, hours=, since=, format=) is the client's error
+            status = 400 if isinstance(e, ValueError) else 500
+            body = (json.dumps({'Exception': e.__repr__()}, app=cost_app, separators=(',', ':')) + '\n').encode()
+        # flask_cors sends the allow origin header on every response
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                   (b'access-control-allow-origin', b'*')]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+        metrics.request_duration.observe(time.perf_counter() - start, route=rule.rule, method='GET', status=status)
+
+    async def wsgi(self, scope, receive, send):
+        """
+        Run the Flask app for one request on the executor
+        The worker thread iterates the response itself and hands every chunk to the event loop, waiting until it is
+        sent: streamed responses keep their backpressure, and Flask's thread local request context stays on the one
+        thread that pushed it
+        """
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        environ = wsgi_environ(scope, bytes(body))
+        loop = asyncio.get_running_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            send_from_thread({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                              'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                          for name, value in headers]})
+
+        def run():
+            response = cost_app(environ, start_response)
+            try:
+                for chunk in response:
+                    if chunk:
+                        send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                send_from_thread({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+
+        await loop.run_in_executor(self.executor, run)
+
+
+asgi_app = CostByTimeASGI()
@@ -1,41 +1,36 @@
-import datetime
-import random
 import time
 from multiprocessing import Process
 
 from common.custom_logging import CustomLogger
+from runlogic.collectors import Collector, default_sources
 from tableaccess.AccessFactory import AccessFactory
-from tableaccess.properties import CloudType
+from tableaccess.properties import Properties
 
 table_helper = AccessFactory.get_cost_by_time_db_conn()
 
 logger = CustomLogger.getLogger(__name__)
 
 
-def consumption_poller():
-    services = ["EC2", "CloudFormation", "EBS", "EKS"]
-    tags = ["DMX", "DFX", "DWX", "MLX"]
-    cloud_type = [CloudType.azure, CloudType.aws, CloudType.gcp]
-    while True:
-        logger.info('Starting consumption collection')
-        timestamp = datetime.datetime.now()
+def consumption_poller(sources=None):
+    """
+    Collect the sources, runlogic.collectors.default_sources() by default, and apply raw sample retention every
+    Properties.retention_interval_seconds when Properties.raw_sample_retention_days is set
+    """
+    last_retention = None
 
-        cloud = random.choice(cloud_type)
-        tag = random.choice(tags)
-        service = random.choice(services)
-        cost = random.choice(range(1000, 2500))
-        logger.info(f'Adding record  {timestamp}|{cloud.value}|{service}|{tag}|{cost}')
-        table_helper.add_row(cloud_type=cloud, cost=cost, service=service, tag=tag, timestamp=timestamp)
+    def apply_retention():
+        nonlocal last_retention
+        if Properties.raw_sample_retention_days is None:
+            return
+        if last_retention is None or time.monotonic() - last_retention >= Properties.retention_interval_seconds:
+            try:
+                table_helper.apply_retention()
+            except Exception as e:
+                logger.exception(e)
+            last_retention = time.monotonic()
 
-        cloud = random.choice(cloud_type)
-        tag = random.choice(tags)
-        service = random.choice(services)
-        cost = random.choice(range(1000, 2500))
-        logger.info(f'Adding record  {timestamp}|{cloud.value}||{service}|{tag}|{cost}')
-        table_helper.add_row(cloud_type=cloud, cost=cost, service=service, tag=tag, timestamp=timestamp)
-
-        logger.info('Sleeping for 2 minutes')
-        time.sleep(120)
+    apply_retention()
+    Collector(sources or default_sources(), table_helper).run_forever(between_cycles=apply_retention)
 
 
 class ProcessTracker:
@@ -43,3 +38,7 @@ class ProcessTracker:
     def start():
         p = Process(target=consumption_poller, args=[])
         p.start()
+
+
+if __name__ == '__main__':
+    consumption_poller()
@@ -1,11 +1,16 @@
+import multiprocessing
+import os
 import random
+import socket
 import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process
 
 from common.custom_logging import CustomLogger
 from tableaccess.AccessFactory import AccessFactory
-from tableaccess.properties import RunStates
+from tableaccess.properties import RunStates, Properties
 
 table_helper = AccessFactory.get_db_conn_service()
 
@@ -18,7 +23,7 @@ def finish_run(to_run):
     :param to_run:
     :return:
     """
-    time.sleep(random.choice(4, 7))
+    time.sleep(random.choice(range(4, 7)))
     logger.info(f'Starting run {to_run}')
     table_helper.update_run_state(to_run, RunStates.RUNNING.value)
     time.sleep(random.choice(range(5, 10)))
@@ -27,37 +32,124 @@ def finish_run(to_run):
     return RunStates.SUCCESS.value
 
 
-def execute_run(to_run):
-    result = threading.Thread(target=finish_run, args=[to_run])
-    result.start()
+class Scheduler:
+    """
+    Drains the PENDING queue into a bounded pool of workers
+    Runs are claimed only for free worker slots, so at most `concurrency` runs are in flight.
+    With slots free and nothing pending the scheduler blocks on `wakeup`, which POST /run sets,
+    falling back to polling every `idle_poll_seconds` for runs enqueued by other processes
+    Claims go through SQLAlchemyTableHelper.claim_runs under a lease renewed while the runs execute, so several
+    schedulers, in this or other processes, can share RunQueue.db and pick up the runs of one that died
+    """
+
+    def __init__(self, helper=None, execute=finish_run, concurrency=None, wakeup=None, idle_poll_seconds=None,
+                 owner=None, lease_seconds=None):
+        """
+        :param helper: SQLAlchemyTableHelper, defaults to the module table_helper
+        :param execute: callable taking a claimed run_id and running it to completion
+        :param concurrency: worker pool size, defaults to Properties.scheduler_concurrency
+        :param wakeup: threading/multiprocessing Event set when work is enqueued
+        :param idle_poll_seconds: defaults to Properties.scheduler_idle_poll_seconds
+        :param owner: id recorded on claimed runs, defaults to host:pid:random suffix
+        :param lease_seconds: defaults to Properties.run_lease_seconds
+        """
+        self.helper = helper or table_helper
+        self.execute = execute
+        self.concurrency = concurrency or Properties.scheduler_concurrency
+        self.wakeup = wakeup or threading.Event()
+        self.idle_poll_seconds = idle_poll_seconds or Properties.scheduler_idle_poll_seconds
+        self.owner = owner or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lease_seconds = lease_seconds or Properties.run_lease_seconds
+        self.slots = threading.BoundedSemaphore(self.concurrency)
+        self.stopped = threading.Event()
+        self.in_flight = set()
+        self.in_flight_lock = threading.Lock()
+
+    def run_forever(self):
+        heartbeat = threading.Thread(target=self._renew_leases, name='lease-heartbeat', daemon=True)
+        heartbeat.start()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='run-worker') as workers:
+            while not self.stopped.is_set():
+                free = self._acquire_slots()
+                if self.stopped.is_set():
+                    self._release_slots(free)
+                    break
+                # Clear before claiming: an enqueue racing with an empty claim still leaves the event set
+                self.wakeup.clear()
+                claimed = self.helper.claim_runs(self.owner, free, self.lease_seconds)
+                self._release_slots(free - len(claimed))
+                if not claimed:
+                    self.wakeup.wait(self.idle_poll_seconds)
+                    continue
+                logger.info(f'{self.owner} claimed runs {claimed}')
+                with self.in_flight_lock:
+                    self.in_flight.update(claimed)
+                for run_id in claimed:
+                    workers.submit(self._execute, run_id)
+        heartbeat.join()
+
+    def _acquire_slots(self):
+        """
+        Block for one free worker slot, then take whichever others are free too
+        :return: number of slots taken
+        """
+        self.slots.acquire()
+        taken = 1
+        while taken < self.concurrency and self.slots.acquire(blocking=False):
+            taken += 1
+        return taken
 
+    def _release_slots(self, count):
+        for _ in range(count):
+            self.slots.release()
 
-def program_loop(lock: threading.RLock):
-    while True:
-        wait_until_resources_available()
-        with lock:
-            """
-            Find next eligible run, if found transition it to INITIATED
-            """
-            next_run = table_helper.next_eligible_run()
-            if next_run:
-                table_helper.update_run_state(next_run, RunStates.INITIATED.value)
-                execute_run(next_run)
+    def _renew_leases(self):
+        while not self.stopped.wait(self.lease_seconds / 3):
+            with self.in_flight_lock:
+                run_ids = sorted(self.in_flight)
+            held = set(self.helper.renew_leases(self.owner, run_ids, self.lease_seconds))
+            with self.in_flight_lock:
+                lost = [run_id for run_id in run_ids if run_id not in held and run_id in self.in_flight]
+            if lost:
+                logger.warning(f'{self.owner} lost the lease of runs {lost}')
 
+    def _execute(self, run_id):
+        try:
+            self.execute(run_id)
+        except Exception as e:
+            logger.exception(e)
+            self.helper.update_run_state(run_id, RunStates.FAILED.value)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight.discard(run_id)
+            self.slots.release()
 
-def wait_until_resources_available():
-    logger.info('Blocking until resource availability')
-    time.sleep(random.choice(range(2, 15)))
-    logger.info('Resources available now')
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+
+def program_loop(wakeup):
+    Scheduler(wakeup=wakeup).run_forever()
 
 
 class TriggerRun:
+    wakeup = None
+
     @staticmethod
     def trigger_runs():
-        lock = threading.RLock()
-        p = Process(target=program_loop, args=[lock])
+        TriggerRun.wakeup = multiprocessing.Event()
+        p = Process(target=program_loop, args=[TriggerRun.wakeup])
         p.start()
 
+    @staticmethod
+    def notify():
+        """
+        Wake the scheduler started by trigger_runs in this process, if any, to claim newly enqueued runs
+        """
+        if TriggerRun.wakeup is not None:
+            TriggerRun.wakeup.set()
+
 
 if __name__ == '__main__':
     TriggerRun.trigger_runs()
@@ -0,0 +1,224 @@
+import datetime
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from common.custom_logging import CustomLogger
+from tableaccess.properties import CloudType, Properties
+
+logger = CustomLogger.getLogger(__name__)
+
+
+class ConsumptionSource:
+    """
+    One place cost samples are collected from, e.g. a cloud account
+    Subclasses implement collect(); the Collector decides when it runs
+    """
+
+    def __init__(self, name, interval_seconds=None):
+        """
+        :param name: unique among the sources of a collector, used in logs
+        :param interval_seconds: time between collections, defaults to Properties.collector_interval_seconds
+        """
+        self.name = name
+        self.interval_seconds = interval_seconds or Properties.collector_interval_seconds
+
+    def collect(self):
+        """
+        :return: list of add_rows sample dicts (cloud_type, cost, service, tag, timestamp)
+        """
+        raise NotImplementedError
+
+    def committed(self):
+        """
+        Called by the Collector once the samples of every collection so far are written, never while collect runs
+        Sources reading from a position advance the committed one here
+        """
+
+
+class RandomSource(ConsumptionSource):
+    """
+    Fabricated samples of one cloud, what the poller always recorded while no billing API is wired in
+    """
+
+    def __init__(self, cloud_type: CloudType, services=None, tags=None, samples_per_cycle=1, interval_seconds=None):
+        super().__init__(f'random-{cloud_type.value}', interval_seconds)
+        self.cloud_type = cloud_type
+        self.services = services or ["EC2", "CloudFormation", "EBS", "EKS"]
+        self.tags = tags or ["DMX", "DFX", "DWX", "MLX"]
+        self.samples_per_cycle = samples_per_cycle
+
+    def collect(self):
+        timestamp = datetime.datetime.now()
+        return [{'cloud_type': self.cloud_type, 'cost': random.choice(range(1000, 2500)),
+                 'service': random.choice(self.services), 'tag': random.choice(self.tags), 'timestamp': timestamp}
+                for _ in range(self.samples_per_cycle)]
+
+
+class FileSource(ConsumptionSource):
+    """
+    Samples appended to a local NDJSON file, one {"cloud_type", "cost", "service", "tag", "timestamp"} object per
+    line. Every collection picks up the complete lines written since the previous one
+    A malformed line is logged and skipped on its own
+    read_offset is where the next collection starts, offset where the written samples end: the Collector keeps the
+    samples of a failed write for its next cycle, so lines are neither lost nor read twice
+    """
+
+    def __init__(self, path, interval_seconds=None):
+        super().__init__(f'file-{path}', interval_seconds)
+        self.path = path
+        self.offset = 0
+        self.read_offset = 0
+
+    def collect(self):
+        samples = []
+        offset = self.read_offset
+        with open(self.path, 'rb') as source:
+            source.seek(offset)
+            for line in source:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    samples.append(self.parse(line))
+                except Exception as e:
+                    logger.warning(f'Source {self.name} skipped the malformed line ending at byte {offset}: {e!r}')
+        self.read_offset = offset
+        return samples
+
+    def committed(self):
+        self.offset = self.read_offset
+
+    @staticmethod
+    def parse(line):
+        sample = json.loads(line)
+        timestamp = sample.get('timestamp')
+        return {'cloud_type': CloudType(sample['cloud_type']), 'cost': int(sample['cost']),
+                'service': sample['service'], 'tag': sample.get('tag'),
+                'timestamp': datetime.datetime.fromisoformat(timestamp) if timestamp else None}
+
+
+def default_sources():
+    """
+    One source per CloudType
+    """
+    return [RandomSource(cloud_type) for cloud_type in CloudType]
+
+
+class SourceState:
+    def __init__(self, source: ConsumptionSource, next_due):
+        self.source = source
+        self.next_due = next_due
+        self.failures = 0
+        self.in_flight = None
+
+
+class Collector:
+    """
+    Runs every due source concurrently on a bounded thread pool and writes the samples of a cycle with one add_rows
+    call, so many accounts are collected within one interval rather than one after the other
+    A source is next due its interval later, give or take `jitter` of it so sources sharing an interval spread out.
+    A failing source backs off exponentially up to `max_backoff_seconds`; one that is still running when due again
+    is skipped rather than started twice
+    Samples of a cycle are written in one transaction. When the write fails they are kept and written with the next
+    cycle, up to `max_unwritten` samples, beyond which the oldest are dropped
+    """
+
+    def __init__(self, sources, helper, max_workers=None, jitter=None, max_backoff_seconds=None, max_unwritten=None,
+                 clock=time.monotonic):
+        """
+        :param sources: ConsumptionSource list
+        :param helper: CbyTSQLAlchemyTableHelper samples are written through
+        :param max_workers: defaults to Properties.collector_max_workers
+        :param jitter: fraction of the interval, defaults to Properties.collector_jitter
+        :param max_backoff_seconds: defaults to Properties.collector_max_backoff_seconds
+        :param max_unwritten: samples kept across failed writes, defaults to Properties.collector_max_unwritten_samples
+        :param clock: monotonic seconds
+        """
+        self.helper = helper
+        self.jitter = Properties.collector_jitter if jitter is None else jitter
+        self.max_backoff_seconds = max_backoff_seconds or Properties.collector_max_backoff_seconds
+        self.max_unwritten = max_unwritten or Properties.collector_max_unwritten_samples
+        self.unwritten = []
+        self.unwritten_states = set()
+        self.clock = clock
+        self.states = [SourceState(source, clock()) for source in sources]
+        self.workers = ThreadPoolExecutor(max_workers=max_workers or Properties.collector_max_workers,
+                                          thread_name_prefix='collector')
+
+    def seconds_until_due(self):
+        return max(0.0, min(state.next_due for state in self.states) - self.clock())
+
+    def run_once(self, timeout=None):
+        """
+        Collect every due source and write what they returned, with the samples of earlier cycles left unwritten
+        :param timeout: seconds to wait for the sources, defaults to the shortest interval among them. Sources still
+                        running are left to finish in the background and written with a later cycle
+        :return: number of samples written
+        """
+        now = self.clock()
+        due = [state for state in self.states if state.next_due <= now]
+        for state in due:
+            if state.in_flight is None:
+                state.in_flight = self.workers.submit(state.source.collect)
+            else:
+                logger.warning(f'Source {state.source.name} is still collecting, skipping this cycle')
+        running = [state for state in self.states if state.in_flight is not None]
+        if not running and not self.unwritten:
+            return 0
+        if running:
+            timeout = timeout or min(state.source.interval_seconds for state in running)
+            wait([state.in_flight for state in running], timeout=timeout)
+
+        samples, self.unwritten = self.unwritten, []
+        collected, self.unwritten_states = self.unwritten_states, set()
+        for state in running:
+            if not state.in_flight.done():
+                state.next_due = self.clock() + state.source.interval_seconds
+                continue
+            try:
+                samples.extend(state.in_flight.result())
+                collected.add(state)
+                state.failures = 0
+                delay = state.source.interval_seconds * (1 + random.uniform(-self.jitter, self.jitter))
+            except Exception as e:
+                state.failures += 1
+                delay = min(state.source.interval_seconds * 2 ** state.failures, self.max_backoff_seconds)
+                logger.warning(f'Source {state.source.name} failed {state.failures} time(s) in a row, '
+                               f'retrying in {delay:.0f}s: {e!r}')
+            state.in_flight = None
+            state.next_due = self.clock() + delay
+        try:
+            written = self.helper.add_rows(samples, chunk_size=len(samples)) if samples else 0
+        except Exception:
+            self.unwritten = samples[-self.max_unwritten:]
+            self.unwritten_states = collected
+            if len(samples) > self.max_unwritten:
+                logger.error(f'Dropped the {len(samples) - self.max_unwritten} oldest unwritten samples')
+            raise
+        for state in collected:
+            # One collecting again is committed with the write of what it returns
+            if state.in_flight is None:
+                state.source.committed()
+        logger.info(f'Collected {written} samples from {len(running)} source(s)')
+        return written
+
+    def run_forever(self, stopped=None, between_cycles=None):
+        """
+        :param stopped: threading.Event ending the loop
+        :param between_cycles: optional callable run after every cycle, e.g. retention
+        """
+        stopped = stopped or threading.Event()
+        while not stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(e)
+            if between_cycles:
+                between_cycles()
+            stopped.wait(self.seconds_until_due())
+        self.workers.shutdown(wait=False)
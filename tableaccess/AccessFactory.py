@@ -1,22 +1,71 @@
+import os
+import weakref
+
+import sqlalchemy
+from sqlalchemy import event, pool
+
 from tableaccess.TableHelper import TableHelper
 from tableaccess.TableHelperSQLAlchemy import SQLAlchemyTableHelper
 from tableaccess.CostByTimeSQLAlchemyHelper import CbyTSQLAlchemyTableHelper
+from tableaccess.properties import Properties, EngineProfile
 
 
 class AccessFactory:
     @staticmethod
-    def get_db_conn_service(use_alchemy=True):
+    def get_db_conn_service(use_alchemy=True, db_path=None, profile: EngineProfile = None):
         """
         TableHelper is based on sqlite which is not thread-safe
         i.e. you may get exceptions like https://stackoverflow.com/questions/48218065/programmingerror-sqlite-objects-created-in-a-thread-can-only-be-used-in-that-sa
         To avoid that use SQLAlchemy connection which works fine when shared b/w threads
         :param use_alchemy:
+        :param db_path: defaults to Properties.sqlite_db_path
+        :param profile: defaults to Properties.run_queue_engine_profile
         :return:
         """
         if use_alchemy:
-            return SQLAlchemyTableHelper()
+            return SQLAlchemyTableHelper(engine=AccessFactory.sqlite_engine(
+                db_path or Properties.sqlite_db_path, profile or Properties.run_queue_engine_profile))
         return TableHelper()
 
     @staticmethod
-    def get_cost_by_time_db_conn():
-        return CbyTSQLAlchemyTableHelper()
+    def get_cost_by_time_db_conn(db_path=None, profile: EngineProfile = None):
+        """
+        :param db_path: defaults to Properties.cost_tracker_sqlite_db
+        :param profile: defaults to Properties.cost_tracker_engine_profile
+        :return:
+        """
+        return CbyTSQLAlchemyTableHelper(engine=AccessFactory.sqlite_engine(
+            db_path or Properties.cost_tracker_sqlite_db, profile or Properties.cost_tracker_engine_profile))
+
+    @staticmethod
+    def sqlite_engine(db_path, profile: EngineProfile):
+        """
+        Engine for a sqlite database file with the pool of the profile
+        Profile pragmas are run on every new DBAPI connection through a connect event
+        check_same_thread is off because pooled connections move between the threads that check them out
+        A forked child (ProcessTracker.start, TriggerRun.trigger_runs) disposes the pool it inherits: SQLite connections
+        must not be used across fork and their locks are not inherited, the child opens connections of its own
+        :param db_path:
+        :param profile:
+        :return:
+        """
+        poolclass = getattr(pool, profile.pool_class)
+        pool_args = {}
+        if poolclass in (pool.QueuePool, pool.SingletonThreadPool):
+            pool_args['pool_size'] = profile.pool_size
+        if poolclass is pool.QueuePool:
+            pool_args['max_overflow'] = profile.max_overflow
+        engine = sqlalchemy.create_engine(f'sqlite:///{db_path}', echo=False, poolclass=poolclass,
+                                          connect_args={'check_same_thread': False}, **pool_args)
+        pragmas = profile.pragmas()
+
+        @event.listens_for(engine, 'connect')
+        def apply_profile(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+        forked_engine = weakref.ref(engine)
+        os.register_at_fork(after_in_child=lambda: forked_engine() is not None and forked_engine().dispose())
+        return engine
@@ -1,27 +1,45 @@
+import contextlib
 import datetime
+import functools
+import itertools
+import threading
 from collections import defaultdict
-from collections import namedtuple
 
 import sqlalchemy
-from sqlalchemy import orm, func
+from sqlalchemy import orm, func, and_, bindparam
+from sqlalchemy.dialects.sqlite import insert
 
+from tableaccess.dimensions import DimensionCache
+from tableaccess.migrations import add_missing_columns, populate_time_buckets, create_missing_indexes, \
+    backfill_hourly_rollup, encode_dimensions
 from tableaccess.properties import Properties, CloudType
+from tableaccess.retention import compact_raw_samples
+from tableobjects.cache_generation import cache_generation
+from tableobjects.cost_by_hour import cost_by_hour
 from tableobjects.cost_by_time import cost_by_time
 from tableobjects.meta_base import ModelBase
 
-tag_and_service_agg = namedtuple('tag_and_service_agg', ['timestamp', 'service', 'tag', 'cost_per_hour'])
-service_agg = namedtuple('service_agg', ['timestamp', 'service', 'cost_per_hour'])
-tag_agg = namedtuple('tag_agg', ['timestamp', 'tag', 'cost_per_hour'])
-tag_total = namedtuple('tag_total', ['tag', 'total_cost'])
-service_total = namedtuple('service_total', ['service', 'total_cost'])
-tag_and_service_total = namedtuple('tag_and_service_total', ['service', 'tag', 'total_cost'])
+# Decoded COST_BY_HOUR rows are plain (hour, service, tag, total_cost, sample_count, minute_mask) tuples
+ROLLUP_DIMENSIONS = {'service': 1, 'tag': 2}
 
 
 class CbyTSQLAlchemyTableHelper:
-    def __init__(self):
-        sql_conn_path = f'sqlite:///{Properties.cost_tracker_sqlite_db}'
-        engine = sqlalchemy.create_engine(sql_conn_path, echo=False)
+    def __init__(self, engine=None):
+        """
+        :param engine: see AccessFactory.sqlite_engine, defaults to a plain engine on Properties.cost_tracker_sqlite_db
+        """
+        if engine is None:
+            sql_conn_path = f'sqlite:///{Properties.cost_tracker_sqlite_db}'
+            engine = sqlalchemy.create_engine(sql_conn_path, echo=False)
         ModelBase.metadata.create_all(engine)
+        add_missing_columns(engine, cost_by_time.__table__)
+        populate_time_buckets(engine)
+        encode_dimensions(engine)
+        create_missing_indexes(engine, cost_by_time.__table__)
+        backfill_hourly_rollup(engine, only_if_empty=True)
+        self.engine = engine
+        self.dimensions = DimensionCache(engine)
+        self.local = threading.local()
         factory = orm.sessionmaker()
         factory.configure(bind=engine)
         self.factory = factory
@@ -37,19 +55,57 @@ class CbyTSQLAlchemyTableHelper:
         :return:
         """
         exact_from = datetime.datetime.now() - datetime.timedelta(hours=n_hour_prior)
-        normalized_from = exact_from - datetime.timedelta(seconds=exact_from.minute * 60)
+        normalized_from = exact_from.replace(minute=0, second=0, microsecond=0)
         return normalized_from
 
+    @contextlib.contextmanager
+    def shared_connection(self):
+        """
+        Reads of the calling thread share one connection until the block exits, e.g. all reads serving a request
+        The connection is checked out by the first read, a block that reads nothing never takes one. Nested blocks
+        join the outer one
+        """
+        if getattr(self.local, 'shared', None) is not None:
+            yield
+            return
+        self.local.shared = []
+        try:
+            yield
+        finally:
+            shared, self.local.shared = self.local.shared, None
+            for conn in shared:
+                conn.close()
+
+    @contextlib.contextmanager
+    def _reading(self):
+        """
+        Connection for a read: the shared one inside shared_connection, a connection of its own otherwise
+        """
+        shared = getattr(self.local, 'shared', None)
+        if shared is None:
+            with self.engine.connect() as conn:
+                yield conn
+            return
+        if not shared:
+            shared.append(self.engine.connect())
+        yield shared[0]
+
     def add_row(self, cloud_type: CloudType, cost, service, tag="TestDevelopment", timestamp=None):
         """
-        INSERT INTO "COST_BY_TIME" (timestamp, tag, service, cost_per_hour) VALUES (?, ?, ?, ?)
+        INSERT INTO "COST_BY_TIME" (timestamp, tag_id, service_id, cost_per_hour) VALUES (?, ?, ?, ?)
+        and fold the sample into its COST_BY_HOUR rollup row in the same transaction
+        Service and tag are stored as ids of their dimension table, new names get one first
+        The commit bumps the cache generation of the cloud
         :param cloud_type:
         :param cost:
         :param service:
-        :param tag:
+        :param tag: None falls back to the default, like a sample without a tag in add_rows
         :param timestamp:
         :return:
         """
+        tag = tag or "TestDevelopment"
+        service_id = self.dimensions.encode('service', [service])[service]
+        tag_id = self.dimensions.encode('tag', [tag])[tag]
         session = self.factory()
         if not timestamp:
             timestamp = datetime.datetime.now()
@@ -57,12 +113,272 @@ class CbyTSQLAlchemyTableHelper:
         c.timestamp = timestamp
         c.cloud_type = cloud_type
         c.cost_per_hour = cost
-        c.service = service
-        c.tag = tag
+        c.service_id = service_id
+        c.tag_id = tag_id
+        c.hour_bucket, c.minute_bucket = cost_by_time.buckets(timestamp)
         session.add(c)
+        session.execute(self._rollup_upsert(),
+                        self._rollup_increments([{'cloud_type': cloud_type, 'timestamp': timestamp,
+                                                  'service_id': service_id, 'tag_id': tag_id, 'cost_per_hour': cost}]))
+        session.execute(self._generation_bump(), [{'cloud_type': cloud_type}])
         session.commit()
         session.close()
 
+    def add_rows(self, samples, chunk_size=5000):
+        """
+        Bulk counterpart of add_row
+        Samples are written with executemany, one transaction per chunk: the raw rows go to COST_BY_TIME and the
+        chunk is folded into one COST_BY_HOUR upsert per (cloud_type, hour, service, tag)
+        Each chunk bumps the cache generation of the clouds it touched
+        :param samples: iterable of dicts with add_row keyword arguments (cloud_type, cost, service, tag, timestamp)
+        :param chunk_size: samples per transaction
+        :return: number of samples written
+        """
+        written = 0
+        samples = iter(samples)
+        while True:
+            chunk = [self._as_row(sample) for sample in itertools.islice(samples, chunk_size)]
+            if not chunk:
+                return written
+            self._encode_dimensions(chunk)
+            with self.engine.begin() as conn:
+                conn.execute(cost_by_time.__table__.insert(), chunk)
+                conn.execute(self._rollup_upsert(), self._rollup_increments(chunk))
+                conn.execute(self._generation_bump(),
+                             [{'cloud_type': cloud} for cloud in set(row['cloud_type'] for row in chunk)])
+            written += len(chunk)
+
+    @staticmethod
+    def _as_row(sample):
+        """
+        add_row keyword arguments -> COST_BY_TIME column values, with add_row defaults
+        """
+        timestamp = sample.get('timestamp') or datetime.datetime.now()
+        hour_bucket, minute_bucket = cost_by_time.buckets(timestamp)
+        return {
+            'cloud_type': CloudType(sample['cloud_type']),
+            'timestamp': timestamp,
+            'service': sample['service'],
+            'tag': sample.get('tag') or "TestDevelopment",
+            'cost_per_hour': sample['cost'],
+            'hour_bucket': hour_bucket,
+            'minute_bucket': minute_bucket
+        }
+
+    def _encode_dimensions(self, rows):
+        """
+        Replace the service/tag names of _as_row rows by their dimension ids, in place
+        """
+        service_ids = self.dimensions.encode('service', (row['service'] for row in rows))
+        tag_ids = self.dimensions.encode('tag', (row['tag'] for row in rows))
+        for row in rows:
+            row['service_id'] = service_ids[row.pop('service')]
+            row['tag_id'] = tag_ids[row.pop('tag')]
+
+    @staticmethod
+    def _rollup_increments(rows):
+        """
+        Fold COST_BY_TIME rows into one COST_BY_HOUR increment per (cloud_type, hour, service, tag)
+        """
+        increments = {}
+        for row in rows:
+            hour, minute_bit = cost_by_hour.bucket(row['timestamp'])
+            key = (row['cloud_type'], hour, row['service_id'], row['tag_id'])
+            if key not in increments:
+                increments[key] = {'cloud_type': row['cloud_type'], 'hour': hour, 'service_id': row['service_id'],
+                                   'tag_id': row['tag_id'], 'total_cost': 0, 'sample_count': 0, 'minute_mask': 0}
+            increments[key]['total_cost'] += row['cost_per_hour']
+            increments[key]['sample_count'] += 1
+            increments[key]['minute_mask'] |= minute_bit
+        return list(increments.values())
+
+    @staticmethod
+    def _rollup_upsert():
+        """
+        INSERT INTO "COST_BY_HOUR" ... ON CONFLICT DO UPDATE adding the increment to its hour
+        Executed with the rows of _rollup_increments as parameters
+        """
+        upsert = insert(cost_by_hour)
+        return upsert.on_conflict_do_update(
+            index_elements=[cost_by_hour.cloud_type, cost_by_hour.hour, cost_by_hour.service_id, cost_by_hour.tag_id],
+            set_={cost_by_hour.total_cost: cost_by_hour.total_cost + upsert.excluded.total_cost,
+                  cost_by_hour.sample_count: cost_by_hour.sample_count + upsert.excluded.sample_count,
+                  cost_by_hour.minute_mask: cost_by_hour.minute_mask.op('|')(upsert.excluded.minute_mask)})
+
+    @staticmethod
+    def _generation_bump():
+        """
+        INSERT INTO "CACHE_GENERATION" ... ON CONFLICT DO UPDATE incrementing the generation of a cloud
+        """
+        upsert = insert(cache_generation).values(generation=1)
+        return upsert.on_conflict_do_update(index_elements=[cache_generation.cloud_type],
+                                            set_={cache_generation.generation: cache_generation.generation + 1})
+
+    # Read statements are built once per shape with bound parameters, a call only binds its values and the engine's
+    # compiled cache hands back the compiled SQL
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _generation_select():
+        """
+        Generation of :cloud_type
+        """
+        return sqlalchemy.select(cache_generation.generation).where(
+            cache_generation.cloud_type == bindparam('cloud_type'))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _latest_select(dimension, filtered):
+        """
+        (timestamp, id, sum(cost)) of the latest samples per service_id/tag_id of :cloud_type, see _latest_consumption
+        :param dimension: service or tag
+        :param filtered: restricted to the id :value_id
+        """
+        raw = cost_by_time.__table__
+        column = raw.c[f'{dimension}_id']
+        latest = sqlalchemy.select(column.label('value'), func.max(raw.c.timestamp).label('latest_timestamp')).where(
+            raw.c.cloud_type == bindparam('cloud_type'))
+        if filtered:
+            latest = latest.where(column == bindparam('value_id'))
+        latest = latest.group_by(column).subquery()
+        return sqlalchemy.select(func.strftime('%Y-%m-%d %H:%M:%S', raw.c.timestamp), column,
+                                 func.sum(raw.c.cost_per_hour)).select_from(raw.join(
+            latest, and_(column == latest.c.value, raw.c.timestamp == latest.c.latest_timestamp))).where(
+            raw.c.cloud_type == bindparam('cloud_type')).group_by(column)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _rollup_select(filter_dimension=None, by_hours=False):
+        """
+        COST_BY_HOUR rows of :cloud_type from the hour :window_start on, in primary key order, or of the hours :hours
+        :param filter_dimension: service or tag, restricted to the id :value_id
+        :param by_hours: the hours of the expanding :hours list, unordered, instead of a window
+        """
+        rollup = cost_by_hour.__table__
+        query = sqlalchemy.select(rollup.c.hour, rollup.c.service_id, rollup.c.tag_id, rollup.c.total_cost,
+                                  rollup.c.sample_count, rollup.c.minute_mask).where(
+            rollup.c.cloud_type == bindparam('cloud_type'))
+        if filter_dimension:
+            query = query.where(rollup.c[f'{filter_dimension}_id'] == bindparam('value_id'))
+        if by_hours:
+            return query.where(rollup.c.hour.in_(bindparam('hours', expanding=True)))
+        # Past the hour range SQLite can't tell a filtered column is constant and would sort the rest of the key,
+        # filtered reads only need hour order
+        order_by = [rollup.c.hour] if filter_dimension else [rollup.c.hour, rollup.c.service_id, rollup.c.tag_id]
+        return query.where(rollup.c.hour >= bindparam('window_start')).order_by(*order_by)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _max_sn_select():
+        return sqlalchemy.select(func.max(cost_by_time.__table__.c.SN))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _changed_hours_select(by_timestamp):
+        """
+        Distinct (cloud_type, hour_bucket) of the samples with :since < SN <= :cursor, or with SN <= :cursor stamped
+        after :since in :cloud_type, see history_since
+        """
+        raw = cost_by_time.__table__
+        # Left to the SN range alone, SQLite would rather walk the cloud's index over the whole window
+        changed = sqlalchemy.select(raw.c.cloud_type, raw.c.hour_bucket).distinct().where(
+            raw.c.SN <= bindparam('cursor'))
+        if by_timestamp:
+            return changed.where(raw.c.cloud_type == bindparam('cloud_type')).where(
+                raw.c.timestamp > bindparam('since'))
+        return changed.where(raw.c.SN > bindparam('since'))
+
+    def generation(self, cloud_type: CloudType):
+        """
+        Number of ingest commits seen for a cloud, shared by every process using the database
+        :param cloud_type:
+        :return:
+        """
+        with self._reading() as conn:
+            generation = conn.execute(self._generation_select(), {'cloud_type': cloud_type}).scalar()
+        return generation or 0
+
+    def apply_retention(self, retention_days=None, batch_size=None):
+        """
+        Delete raw samples past the retention horizon, see retention.compact_raw_samples
+        History reads keep answering from COST_BY_HOUR; the generation of clouds that lost samples is bumped since
+        latest_* results may change
+        :param retention_days: defaults to Properties.raw_sample_retention_days, nothing is deleted when both are None
+        :param batch_size: defaults to Properties.retention_batch_size
+        :return: {CloudType: raw samples deleted}
+        """
+        deleted = compact_raw_samples(self.engine, retention_days, batch_size)
+        compacted = [{'cloud_type': cloud_type} for cloud_type, count in deleted.items() if count]
+        if compacted:
+            with self.engine.begin() as conn:
+                conn.execute(self._generation_bump(), compacted)
+        return deleted
+
+    def export_samples(self, cloud_type: CloudType, start=None, end=None, service=None, tag=None, batch_size=1000):
+        """
+        Raw COST_BY_TIME samples of a cloud in timestamp order, shaped like cost_by_time.to_json
+        With Properties.raw_sample_retention_days set, samples older than the retention horizon are no longer there
+        A generator over a streamed Core result fetched batch_size rows at a time, so memory stays flat however
+        many rows match. The connection is held until the generator is exhausted or closed
+        Served by the covering ix_cost_by_time_cloud_service_ts/_tag_ts/_ts index, whichever matches the filters
+        :param cloud_type:
+        :param start: inclusive lower timestamp bound
+        :param end: exclusive upper timestamp bound
+        :param service:
+        :param tag:
+        :param batch_size: rows per fetch
+        :return:
+        """
+        raw = cost_by_time.__table__
+        query = sqlalchemy.select(raw.c.SN, raw.c.timestamp, raw.c.tag_id, raw.c.service_id,
+                                  raw.c.cost_per_hour).where(raw.c.cloud_type == cloud_type).order_by(raw.c.timestamp)
+        if start is not None:
+            query = query.where(raw.c.timestamp >= start)
+        if end is not None:
+            query = query.where(raw.c.timestamp < end)
+        for dimension, value in (('service', service), ('tag', tag)):
+            if value is not None:
+                dimension_id = self.dimensions.id_of(dimension, value)
+                if dimension_id is None:
+                    return
+                query = query.where(raw.c[f'{dimension}_id'] == dimension_id)
+        name_of = self.dimensions.name_of
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(query)
+            for sn, timestamp, tag_id, service_id, cost in result.yield_per(batch_size):
+                yield {
+                    'SN': sn,
+                    'timestamp': datetime.datetime.strftime(timestamp, '%Y-%m-%d %H:%M:%S'),
+                    'tag': name_of('tag', tag_id),
+                    'service': name_of('service', service_id),
+                    'cost_per_hour': cost
+                }
+
+    def _latest_consumption(self, cloud_type: CloudType, dimension, value=None):
+        """
+        Latest consumption per value of a dimension (service or tag) in a single grouped query
+        Query 1-> Latest timestamp per dimension value (max-timestamp subquery)
+        Query 2-> Join back on (value, latest timestamp) -> sum(cost) across the other dimension
+        Both group the integer ids, which are decoded afterwards. Plain (timestamp, id, cost) tuples from Core
+        :param cloud_type:
+        :param dimension: service or tag
+        :param value: optional, restrict to a single service/tag
+        :return: rows of (timestamp, value, cost), latest first, then by value
+        """
+        value_id = None
+        if value is not None:
+            value_id = self.dimensions.id_of(dimension, value)
+            if value_id is None:
+                return []
+        with self._reading() as conn:
+            objs = conn.execute(self._latest_select(dimension, value_id is not None),
+                                {'cloud_type': cloud_type, 'value_id': value_id}).all()
+        # Ordered as before the ids: latest first, ties by name (sorted() is stable)
+        name_of = self.dimensions.name_of
+        objs = sorted(((timestamp, name_of(dimension, dimension_id), cost) for timestamp, dimension_id, cost in objs),
+                      key=lambda obj: obj[1] or '')
+        return sorted(objs, key=lambda obj: obj[0], reverse=True)
+
     def latest_consumption_by_service(self, cloud_type: CloudType, service):
         """
         Returns latest consumption for a service
@@ -71,21 +387,11 @@ class CbyTSQLAlchemyTableHelper:
         :param service:
         :return:
         """
-        session = self.factory()
-        obj = session.query(cost_by_time).filter(cost_by_time.cloud_type == cloud_type).filter(
-            cost_by_time.service == service).order_by(
-            cost_by_time.timestamp.desc()).first()
-        if not obj:
+        objs = self._latest_consumption(cloud_type, 'service', service)
+        if not objs:
             return []
-        latest_timestamp = obj.timestamp
-
-        agg = session.query(cost_by_time).filter(cost_by_time.cloud_type == cloud_type).filter(
-            cost_by_time.service == service).filter(
-            cost_by_time.timestamp == latest_timestamp).with_entities(
-            func.strftime('%Y-%m-%d %H:%M:%S', cost_by_time.timestamp), cost_by_time.service,
-            func.sum(cost_by_time.cost_per_hour)).first()
-        session.close()
-        return service_agg(*agg)._asdict()
+        timestamp, value, cost = objs[0]
+        return {'timestamp': timestamp, 'service': value, 'cost_per_hour': cost}
 
     def latest_consumption_of_all_services(self, cloud_type: CloudType):
         """
@@ -93,15 +399,8 @@ class CbyTSQLAlchemyTableHelper:
         :param cloud_type
         :return:
         """
-        return_list = []
-        session = self.factory()
-        objs = session.query(cost_by_time.service).distinct().all()
-        session.close()
-        for service in (item[0] for item in objs):
-            consumption = self.latest_consumption_by_service(cloud_type, service)
-            if consumption:
-                return_list.append(consumption)
-        return sorted(return_list, key=lambda x: x['timestamp'], reverse=True)
+        return [{'timestamp': timestamp, 'service': value, 'cost_per_hour': cost}
+                for timestamp, value, cost in self._latest_consumption(cloud_type, 'service')]
 
     def latest_consumption_by_tag(self, cloud_type: CloudType, tag):
         """
@@ -111,23 +410,11 @@ class CbyTSQLAlchemyTableHelper:
         :param tag:
         :return:
         """
-        session = self.factory()
-        obj = session.query(cost_by_time).filter(cost_by_time.cloud_type == cloud_type).filter(
-            cost_by_time.tag == tag).order_by(
-            cost_by_time.timestamp.desc()).first()
-        if not obj:
+        objs = self._latest_consumption(cloud_type, 'tag', tag)
+        if not objs:
             return []
-        latest_timestamp = obj.timestamp
-        session.close()
-
-        session = self.factory()
-        agg = session.query(cost_by_time).filter(cost_by_time.cloud_type == cloud_type).filter(
-            cost_by_time.tag == tag).filter(
-            cost_by_time.timestamp == latest_timestamp).with_entities(
-            func.strftime('%Y-%m-%d %H:%M:%S', cost_by_time.timestamp), cost_by_time.tag,
-            func.sum(cost_by_time.cost_per_hour)).first()
-        session.close()
-        return tag_agg(*agg)._asdict()
+        timestamp, value, cost = objs[0]
+        return {'timestamp': timestamp, 'tag': value, 'cost_per_hour': cost}
 
     def latest_consumption_of_all_tags(self, cloud_type: CloudType):
         """
@@ -135,146 +422,170 @@ class CbyTSQLAlchemyTableHelper:
         :param cloud_type
         :return:
         """
+        return [{'timestamp': timestamp, 'tag': value, 'cost_per_hour': cost}
+                for timestamp, value, cost in self._latest_consumption(cloud_type, 'tag')]
+
+    def _hourly_rollup(self, cloud_type: CloudType, n_hour_prior, service=None, tag=None):
+        """
+        COST_BY_HOUR rows in the time window, oldest hour first, then by service and tag name
+        Read in primary key order (cloud_type, hour, service_id, tag_id), a range scan that needs no sorting; ids
+        don't sort like names, so the rows of an hour are put in name order once decoded
+        :param cloud_type:
+        :param n_hour_prior:
+        :param service: optional
+        :param tag: optional, not together with service
+        :return: decoded rows, see _decode_rollup
+        """
+        filter_dimension, value_id = None, None
+        for dimension, value in (('service', service), ('tag', tag)):
+            if value:
+                filter_dimension, value_id = dimension, self.dimensions.id_of(dimension, value)
+                if value_id is None:
+                    return []
+        with self._reading() as conn:
+            objs = conn.execute(self._rollup_select(filter_dimension), {
+                'cloud_type': cloud_type, 'window_start': self._effective_time_window(n_hour_prior),
+                'value_id': value_id}).all()
+        return self._decode_rollup(objs)
+
+    def _decode_rollup(self, rows):
+        """
+        (hour, service_id, tag_id, total_cost, sample_count, minute_mask) rows -> the same tuples holding the names,
+        by hour, service, tag
+        """
+        name_of = self.dimensions.name_of
+        decoded = [(hour, name_of('service', service_id), name_of('tag', tag_id), total_cost, sample_count, minute_mask)
+                   for hour, service_id, tag_id, total_cost, sample_count, minute_mask in rows]
+        return sorted(decoded, key=lambda row: (row[0], row[1] or '', row[2] or ''))
+
+    @staticmethod
+    def _latest_hour_first(rows):
+        """
+        Rows of an hour keep their relative order (sorted() is stable, also in reverse)
+        """
+        return sorted(rows, key=lambda row: row[0], reverse=True)
+
+    @staticmethod
+    def _average_over_minutes(rollup, dimension):
+        """
+        Records with the same timestamp(minute precision) and dimension value are summed before averaging them per hour
+        The average of those per minute sums is the hour total over the number of distinct minutes,
+        i.e. total_cost over the bits set across the minute_mask of every rollup row of that dimension value
+        :param rollup: rows from _hourly_rollup
+        :param dimension: 'service' or 'tag'
+        :return: (hour, dimension value, cost_per_hour) tuples, latest hour first
+        """
+        position = ROLLUP_DIMENSIONS[dimension]
+        per_hour = {}
+        for row in rollup:
+            key = (row[0], row[position])
+            total, minute_mask = per_hour.get(key, (0, 0))
+            per_hour[key] = (total + row[3], minute_mask | row[5])
+        return CbyTSQLAlchemyTableHelper._latest_hour_first(
+            [(hour.strftime('%Y-%m-%d %H'), value, total / cost_by_hour.minutes(minute_mask))
+             for (hour, value), (total, minute_mask) in sorted(per_hour.items(), key=lambda item: item[0])])
+
+    @staticmethod
+    def _service_and_tag_history(rollup):
+        return [{'timestamp': hour.strftime('%Y-%m-%d %H'), 'service': service, 'tag': tag,
+                 'cost_per_hour': total_cost / sample_count}
+                for hour, service, tag, total_cost, sample_count, _ in CbyTSQLAlchemyTableHelper._latest_hour_first(
+                    rollup)]
+
+    @staticmethod
+    def _service_history(rollup):
+        return [{'timestamp': hour, 'service': value, 'cost_per_hour': cost}
+                for hour, value, cost in CbyTSQLAlchemyTableHelper._average_over_minutes(rollup, 'service')]
+
+    @staticmethod
+    def _tag_history(rollup):
+        return [{'timestamp': hour, 'tag': value, 'cost_per_hour': cost}
+                for hour, value, cost in CbyTSQLAlchemyTableHelper._average_over_minutes(rollup, 'tag')]
+
+    @staticmethod
+    def _service_and_tag_totals(per_hour_costs):
         return_list = []
-        session = self.factory()
-        objs = session.query(cost_by_time.tag).distinct().all()
-        session.close()
-        for tag in (item[0] for item in objs):
-            consumption = self.latest_consumption_by_tag(cloud_type, tag)
-            if consumption:
-                return_list.append(consumption)
-        return sorted(return_list, key=lambda x: x['timestamp'], reverse=True)
+        agg = defaultdict(lambda: defaultdict(lambda: 0))
+        for item in per_hour_costs:
+            agg[item['tag']][item['service']] += item['cost_per_hour']
+        for tag in agg:
+            for service in agg[tag]:
+                return_list.append({'service': service, 'tag': tag, 'total_cost': agg[tag][service]})
+        return return_list
+
+    @staticmethod
+    def _service_totals(per_hour_costs):
+        agg = defaultdict(lambda: 0)
+        for item in per_hour_costs:
+            agg[item['service']] += item['cost_per_hour']
+        return [{'service': service, 'total_cost': total_cost} for service, total_cost in agg.items()]
+
+    @staticmethod
+    def _tag_totals(per_hour_costs):
+        agg = defaultdict(lambda: 0)
+        for item in per_hour_costs:
+            agg[item['tag']] += item['cost_per_hour']
+        return [{'tag': tag, 'total_cost': total_cost} for tag, total_cost in agg.items()]
 
     def aggregate_by_service_and_tag(self, cloud_type: CloudType, n_hour_prior=5):
         """
         Aggregate by service and tag per hour
         Group record by service, tag and hour -> output average cost
+        Served from the COST_BY_HOUR rollup: average = total_cost / sample_count
         :param n_hour_prior:
         :return:
         """
-        session = self.factory()
-        objs = session.query(cost_by_time).filter(cost_by_time.cloud_type == cloud_type).filter(
-            cost_by_time.timestamp > self._effective_time_window(n_hour_prior)).with_entities(
-            func.strftime('%Y-%m-%d %H', cost_by_time.timestamp),
-            cost_by_time.service, cost_by_time.tag,
-            func.avg(cost_by_time.cost_per_hour)).group_by(
-            cost_by_time.service, cost_by_time.tag,
-            func.strftime('%Y-%m-%d %H', cost_by_time.timestamp)).order_by(
-            cost_by_time.timestamp.desc()).all()
-        session.close()
-        return [tag_and_service_agg(*obj)._asdict() for obj in objs]
+        return self._service_and_tag_history(self._hourly_rollup(cloud_type, n_hour_prior))
 
     def aggregate_by_service(self, cloud_type: CloudType, n_hour_prior=5, service=None):
         """
         Aggregate by service per hour
-        Do subqueries because records with the same timestamp(minute precision) and service need to be summed before averaging them
-        Query 1-> Group record by service, timestamp (minute precision)
-                    (assume we have a minute precision betweeen successive polls) -> sum(cost)
-        Query 2-> Group query 1 by timestamp (hour precision) -> avg(cost)
+        Records with the same timestamp(minute precision) and service need to be summed before averaging them
+        Step 1-> COST_BY_HOUR rows of the window (one per service, tag and hour)
+        Step 2-> Fold tags of the same service and hour -> sum(cost) / distinct minutes
+                    (assume we have a minute precision betweeen successive polls)
         :param cloud_type
         :param n_hour_prior:
         :param service: optional
         :return:
         """
-        session = self.factory()
-        in_time_window = session.query(cost_by_time).filter(cost_by_time.cloud_type == cloud_type).filter(
-            cost_by_time.timestamp > self._effective_time_window(n_hour_prior))
-        if service:
-            in_time_window = in_time_window.filter(
-                cost_by_time.service == service)
-
-        # Query1
-        summation_over_same_timestamp = in_time_window.with_entities(
-            func.strftime('%Y-%m-%d %H:%M', cost_by_time.timestamp).label('time_minute'),
-            cost_by_time.service.label('service'),
-            func.sum(cost_by_time.cost_per_hour).label('cost_across_tags')).group_by(
-            cost_by_time.service, 'time_minute').subquery()
-
-        session.close()
-
-        session = self.factory()
-        # Query2
-        objs = session.query(func.strftime('%Y-%m-%d %H', summation_over_same_timestamp.c.time_minute),
-                             summation_over_same_timestamp.c.service,
-                             func.avg(summation_over_same_timestamp.c.cost_across_tags)).group_by(
-            func.strftime('%Y-%m-%d %H', summation_over_same_timestamp.c.time_minute),
-            summation_over_same_timestamp.c.service).order_by(
-            summation_over_same_timestamp.c.time_minute.desc()).all()
-        session.close()
-
-        return [(service_agg(*obj)._asdict()) for obj in objs]
+        return self._service_history(self._hourly_rollup(cloud_type, n_hour_prior, service=service))
 
     def aggregate_by_tag(self, cloud_type: CloudType, n_hour_prior=5, tag=None):
         """
         Aggregate by tag per hour
-        Do subqueries because records with the same timestamp(minute precision) and tag need to be summed before averaging them
-        Query 1-> Group record by tag, timestamp (minute precision)
-                    (assume we have a minute precision betweeen successive polls) -> sum(cost)
-        Query 2-> Group query 1 by timestamp (hour precision) -> avg(cost)
+        Records with the same timestamp(minute precision) and tag need to be summed before averaging them
+        Step 1-> COST_BY_HOUR rows of the window (one per service, tag and hour)
+        Step 2-> Fold services of the same tag and hour -> sum(cost) / distinct minutes
+                    (assume we have a minute precision betweeen successive polls)
         :param cloud_type
         :param n_hour_prior:
         :param tag: optional
         :return:
         """
-        session = self.factory()
-        in_time_window = session.query(cost_by_time).filter(cost_by_time.cloud_type == cloud_type).filter(
-            cost_by_time.timestamp > self._effective_time_window(n_hour_prior))
-        if tag:
-            in_time_window = in_time_window.filter(
-                cost_by_time.tag == tag)
-
-        # Query1
-        summation_over_same_timestamp = in_time_window.with_entities(
-            func.strftime('%Y-%m-%d %H:%M', cost_by_time.timestamp).label('time_minute'),
-            cost_by_time.tag.label('tag'),
-            func.sum(cost_by_time.cost_per_hour).label('cost_across_services')).group_by(
-            cost_by_time.tag, 'time_minute').subquery()
-
-        session.close()
-
-        session = self.factory()
-        # Query2
-        objs = session.query(func.strftime('%Y-%m-%d %H', summation_over_same_timestamp.c.time_minute),
-                             summation_over_same_timestamp.c.tag,
-                             func.avg(summation_over_same_timestamp.c.cost_across_services)).group_by(
-            func.strftime('%Y-%m-%d %H', summation_over_same_timestamp.c.time_minute),
-            summation_over_same_timestamp.c.tag).order_by(
-            summation_over_same_timestamp.c.time_minute.desc()).all()
-        session.close()
-        return [(tag_agg(*obj)._asdict()) for obj in objs]
+        return self._tag_history(self._hourly_rollup(cloud_type, n_hour_prior, tag=tag))
 
     def total_cost_by_tag(self, cloud_type: CloudType, n_hour_prior=5, tag=None):
         """
         Estimated total cost by tag
+        Sum of the hourly averages of aggregate_by_tag, accumulated per tag in one pass
         :param cloud_type:
         :param n_hour_prior:
         :param tag:
         :return:
         """
-        return_list = []
-        per_hour_costs = self.aggregate_by_tag(cloud_type, n_hour_prior, tag)
-        tags = set([item['tag'] for item in per_hour_costs])
-        for tag in tags:
-            total_cost_by_tag = sum(item['cost_per_hour'] for item in filter(lambda x: x['tag'] == tag, per_hour_costs))
-            return_list.append(tag_total(tag, total_cost_by_tag)._asdict())
-        return return_list
+        return self._tag_totals(self.aggregate_by_tag(cloud_type, n_hour_prior, tag))
 
     def total_cost_by_service(self, cloud_type: CloudType, n_hour_prior=5, service=None):
         """
         Estimated total cost by service
+        Sum of the hourly averages of aggregate_by_service, accumulated per service in one pass
         :param cloud_type:
         :param n_hour_prior:
         :param service:
         :return:
         """
-        return_list = []
-        per_hour_costs = self.aggregate_by_service(cloud_type, n_hour_prior, service)
-        services = set([item['service'] for item in per_hour_costs])
-        for service in services:
-            total_cost_by_service = sum(
-                item['cost_per_hour'] for item in filter(lambda x: x['service'] == service, per_hour_costs))
-            return_list.append(service_total(service, total_cost_by_service)._asdict())
-        return return_list
+        return self._service_totals(self.aggregate_by_service(cloud_type, n_hour_prior, service))
 
     def total_cost_by_service_and_tag(self, cloud_type: CloudType, n_hour_prior=5):
         """
@@ -283,16 +594,95 @@ class CbyTSQLAlchemyTableHelper:
         :param n_hour_prior:
         :return:
         """
-        return_list = []
-        per_hour_costs = self.aggregate_by_service_and_tag(cloud_type, n_hour_prior)
-        agg = defaultdict(lambda: defaultdict(lambda: 0))
-        for item in per_hour_costs:
-            agg[item['tag']][item['service']] += item['cost_per_hour']
-        for tag in agg:
-            for service in agg[tag]:
-                return_list.append(
-                    tag_and_service_total(service=service, tag=tag, total_cost=agg[tag][service])._asdict())
-        return return_list
+        return self._service_and_tag_totals(self.aggregate_by_service_and_tag(cloud_type, n_hour_prior))
+
+    def batch_aggregate(self, specs):
+        """
+        Several history/total aggregations in one call, e.g. everything a dashboard shows
+        COST_BY_HOUR is read once per (cloud_type, hours) and every spec of that window is folded from the same rows,
+        a service/tag filter picks its rows out of them. Each result equals the one of the matching single call
+        :param specs: dicts with
+                      cloud_type -> CloudType
+                      dimension  -> service, tag or service_tag
+                      kind       -> history (aggregate_by_*) or total (total_cost_by_*)
+                      hours      -> n_hour_prior
+                      filter     -> optional service/tag value, not for service_tag
+        :return: results in the order of specs
+        """
+        rollups, histories = {}, {}
+        results = []
+        for spec in specs:
+            window = (spec['cloud_type'], spec['hours'])
+            dimension, value = spec['dimension'], spec.get('filter') or None
+            history, totals = BATCH_AGGREGATIONS[dimension]
+            # A history and the total derived from it share the fold
+            if (window, dimension, value) not in histories:
+                if window not in rollups:
+                    rollups[window] = self._hourly_rollup(*window)
+                rollup = rollups[window]
+                if value and dimension in ('service', 'tag'):
+                    rollup = [row for row in rollup if row[ROLLUP_DIMENSIONS[dimension]] == value]
+                histories[(window, dimension, value)] = history(rollup)
+            per_hour_costs = histories[(window, dimension, value)]
+            results.append(per_hour_costs if spec['kind'] == 'history' else totals(per_hour_costs))
+        return results
+
+    def history_since(self, cloud_type: CloudType, dimension, since=0, n_hour_prior=5, value=None):
+        """
+        Delta of a history: only the hours of the window that samples added after a cursor fell into
+        Affected hours come from the samples past the cursor, an SN range scan of the primary key (or the
+        ix_cost_by_time_cloud_ts range for a timestamp), and only their COST_BY_HOUR rows are folded, so the work and
+        the payload follow the new data rather than the window. All reads share one snapshot, the returned cursor
+        covers exactly what the rollup rows include: pysqlite sends no BEGIN before a SELECT, so the read transaction
+        is opened with an explicit one
+        Hours are complete, a client replaces what it holds for them and drops hours before window_start. Totals are
+        the sums of cost_per_hour per value over the hours held. since=0 returns every hour with data
+        :param cloud_type:
+        :param dimension: service, tag or service_tag
+        :param since: last seen SN, or a datetime: samples stamped after it
+        :param n_hour_prior:
+        :param value: optional service/tag filter of the service or tag dimension
+        :return: {'cursor': SN to pass next, 'window_start': hour, 'hours': affected hours, latest first,
+                  'result': history rows of those hours}
+        """
+        window_start = self._effective_time_window(n_hour_prior)
+        with self._reading() as conn, conn.begin():
+            conn.exec_driver_sql('BEGIN')
+            cursor = conn.execute(self._max_sn_select()).scalar() or 0
+            first_bucket = cost_by_time.buckets(window_start)[0]
+            changed = conn.execute(self._changed_hours_select(isinstance(since, datetime.datetime)),
+                                   {'cursor': cursor, 'since': since, 'cloud_type': cloud_type})
+            hours = sorted((cost_by_time.hour_of(bucket) for cloud, bucket in changed
+                            if cloud == cloud_type and bucket >= first_bucket), reverse=True)
+            rows = []
+            if hours:
+                filter_dimension = dimension if value and dimension in ('service', 'tag') else None
+                rows = self._decode_rollup(conn.execute(self._rollup_select(filter_dimension, by_hours=True), {
+                    'cloud_type': cloud_type, 'hours': hours,
+                    'value_id': self.dimensions.id_of(dimension, value) if filter_dimension else None}).all())
+        return {
+            'cursor': cursor,
+            'window_start': window_start.strftime('%Y-%m-%d %H'),
+            'hours': [hour.strftime('%Y-%m-%d %H') for hour in hours],
+            'result': BATCH_AGGREGATIONS[dimension][0](rows)
+        }
+
+
+BATCH_AGGREGATIONS = {
+    'service_tag': (CbyTSQLAlchemyTableHelper._service_and_tag_history,
+                    CbyTSQLAlchemyTableHelper._service_and_tag_totals),
+    'service': (CbyTSQLAlchemyTableHelper._service_history, CbyTSQLAlchemyTableHelper._service_totals),
+    'tag': (CbyTSQLAlchemyTableHelper._tag_history, CbyTSQLAlchemyTableHelper._tag_totals),
+}
+
+# Side effect free reads whose identical concurrent calls may share one result, see common.single_flight
+READ_METHODS = (
+    'latest_consumption_by_service', 'latest_consumption_of_all_services', 'latest_consumption_by_tag',
+    'latest_consumption_of_all_tags', 'aggregate_by_service_and_tag', 'aggregate_by_service', 'aggregate_by_tag',
+    'total_cost_by_tag', 'total_cost_by_service', 'total_cost_by_service_and_tag', 'history_since',
+)
+# Methods timed by common.metrics.instrument_helper, the reads plus the writes and the batch/cache queries
+TIMED_METHODS = READ_METHODS + ('batch_aggregate', 'generation', 'add_row', 'add_rows', 'apply_retention')
 
 
 if __name__ == '__main__':
@@ -1,82 +1,159 @@
+import datetime
+import threading
+
 import sqlalchemy
 from sqlalchemy import orm
 from sqlalchemy.pool import SingletonThreadPool
 
+from tableaccess.migrations import add_missing_columns, create_missing_indexes
 from tableaccess.properties import Properties, RunStates
 from tableobjects.TESTRUN import TESTRUNS
 from tableobjects.meta_base import ModelBase
+from tableobjects.run_event import run_event
+
+RUN_FIELDS = ('run_id', 'run_name', 'run_state')
+# Methods timed by common.metrics.instrument_helper, pending_runs and the other listings go through list_runs
+TIMED_METHODS = ('list_runs', 'next_eligible_run', 'claim_runs', 'renew_leases', 'update_run_state',
+                 'delete_run_from_queue', 'add_run_to_queue', 'run_events', 'run_event_range')
 
 
 class SQLAlchemyTableHelper:
-    def __init__(self):
-        sql_conn_path = f'sqlite:///{Properties.sqlite_db_path}'
-        engine = sqlalchemy.create_engine(sql_conn_path, echo=False, poolclass=SingletonThreadPool)
+    def __init__(self, engine=None):
+        """
+        :param engine: see AccessFactory.sqlite_engine, defaults to a plain engine on Properties.sqlite_db_path
+        """
+        if engine is None:
+            sql_conn_path = f'sqlite:///{Properties.sqlite_db_path}'
+            engine = sqlalchemy.create_engine(sql_conn_path, echo=False, poolclass=SingletonThreadPool)
         ModelBase.metadata.create_all(engine)
+        add_missing_columns(engine, TESTRUNS.__table__)
+        create_missing_indexes(engine, TESTRUNS.__table__)
+        self.engine = engine
         factory = orm.sessionmaker()
         factory.configure(bind=engine)
         self.factory = factory
+        # Bumped and notified after every commit writing RUN_EVENTS from this process, see wait_for_run_events
+        self.run_events_written = threading.Condition()
+        self.run_event_writes = 0
 
     def all_runs(self):
-        session = self.factory()
-        runs = session.query(TESTRUNS).order_by(TESTRUNS.run_id).all()
-        session.close()
-        return [run.to_json() for run in list(runs)]
+        return self.list_runs()
 
     def create_table(self):
         pass
 
     def next_eligible_run(self):
-        pending_runs = self.pending_runs()
-        if not pending_runs:
-            return None
-        return pending_runs[0]['run_id']
-
-    def pending_runs(self):
         session = self.factory()
-        runs = session.query(TESTRUNS).filter(TESTRUNS.run_state == RunStates.PENDING.value).order_by(
-            TESTRUNS.run_id).all()
+        run = session.query(TESTRUNS.run_id).filter(TESTRUNS.run_state == RunStates.PENDING.value).order_by(
+            TESTRUNS.run_id).limit(1).first()
         session.close()
-        return [run.to_json() for run in list(runs)]
+        return run.run_id if run else None
+
+    def claim_runs(self, owner, limit=1, lease_seconds=None):
+        """
+        Atomically move up to `limit` runs to INITIATED under `owner`, oldest first
+        Claimable runs are PENDING ones plus INITIATED/RUNNING ones whose lease expired, i.e. whose scheduler died
+        without finishing them. Selection and update are one UPDATE ... WHERE run_id IN (SELECT ... LIMIT n)
+        statement, which SQLite runs under the database write lock, so concurrent schedulers in any process never
+        claim the same run twice
+        The claimed runs are read back inside the same transaction by (owner, lease_expires_at) of this call
+        :param owner: scheduler id, e.g. host:pid
+        :param limit: most runs to claim
+        :param lease_seconds: defaults to Properties.run_lease_seconds, extend with renew_leases while running
+        :return: claimed run_ids, empty when nothing is claimable
+        """
+        now = datetime.datetime.now()
+        lease_expires_at = now + datetime.timedelta(seconds=lease_seconds or Properties.run_lease_seconds)
+        claimable = sqlalchemy.select(TESTRUNS.run_id).where(sqlalchemy.or_(
+            TESTRUNS.run_state == RunStates.PENDING.value,
+            sqlalchemy.and_(TESTRUNS.run_state.in_([RunStates.INITIATED.value, RunStates.RUNNING.value]),
+                            TESTRUNS.lease_expires_at < now))).order_by(TESTRUNS.run_id).limit(limit)
+        with self.engine.begin() as conn:
+            conn.execute(sqlalchemy.update(TESTRUNS).where(TESTRUNS.run_id.in_(claimable)).values(
+                run_state=RunStates.INITIATED.value, claimed_by=owner, lease_expires_at=lease_expires_at))
+            claimed = conn.execute(sqlalchemy.select(TESTRUNS.run_id).where(
+                TESTRUNS.claimed_by == owner, TESTRUNS.lease_expires_at == lease_expires_at).order_by(
+                TESTRUNS.run_id)).scalars().all()
+            if claimed:
+                conn.execute(self._record_events(TESTRUNS.run_id.in_(claimed)))
+        if claimed:
+            self._notify_run_events()
+        return claimed
+
+    def renew_leases(self, owner, run_ids, lease_seconds=None):
+        """
+        Push back the lease of runs still held by `owner` and not finished yet
+        :param owner:
+        :param run_ids:
+        :param lease_seconds: defaults to Properties.run_lease_seconds
+        :return: run_ids still held, a run missing here was reclaimed by another scheduler after its lease expired
+        """
+        if not run_ids:
+            return []
+        lease_expires_at = datetime.datetime.now() + datetime.timedelta(
+            seconds=lease_seconds or Properties.run_lease_seconds)
+        held = sqlalchemy.and_(TESTRUNS.run_id.in_(run_ids), TESTRUNS.claimed_by == owner,
+                               TESTRUNS.run_state.in_([RunStates.INITIATED.value, RunStates.RUNNING.value]))
+        with self.engine.begin() as conn:
+            conn.execute(sqlalchemy.update(TESTRUNS).where(held).values(lease_expires_at=lease_expires_at))
+            return conn.execute(sqlalchemy.select(TESTRUNS.run_id).where(held).order_by(
+                TESTRUNS.run_id)).scalars().all()
+
+    def list_runs(self, run_state=None, after_run_id=None, limit=None, fields=None):
+        """
+        Keyset page of TESTRUNS ordered by run_id, read with a Core select straight into dicts (no ORM objects)
+        Filtered by state it is a range scan of ix_testruns_state_run_id, unfiltered of the primary key
+        :param run_state: RunStates value, None for every run
+        :param after_run_id: only runs after this run_id, i.e. the last run_id of the previous page
+        :param limit: page size, None for every remaining run
+        :param fields: subset of RUN_FIELDS to return, defaults to all of them
+        :return: list of run dicts shaped like TESTRUNS.to_json
+        """
+        fields = fields or RUN_FIELDS
+        unknown = [field for field in fields if field not in RUN_FIELDS]
+        if unknown:
+            raise ValueError(f'Unknown run fields {unknown}, expected a subset of {list(RUN_FIELDS)}')
+        columns = TESTRUNS.__table__.c
+        query = sqlalchemy.select(*[columns[field] for field in fields]).order_by(columns.run_id)
+        if run_state is not None:
+            query = query.where(columns.run_state == run_state)
+        if after_run_id is not None:
+            query = query.where(columns.run_id > after_run_id)
+        if limit is not None:
+            query = query.limit(limit)
+        with self.engine.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(query)]
+
+    def pending_runs(self):
+        return self.list_runs(RunStates.PENDING.value)
 
     def running_runs(self):
-        session = self.factory()
-        runs = session.query(TESTRUNS).filter(TESTRUNS.run_state == RunStates.RUNNING.value).order_by(
-            TESTRUNS.run_id).all()
-        session.close()
-        return [run.to_json() for run in list(runs)]
+        return self.list_runs(RunStates.RUNNING.value)
 
     def failed_runs(self):
-        session = self.factory()
-        runs = session.query(TESTRUNS).filter(TESTRUNS.run_state == RunStates.FAILED.value).order_by(
-            TESTRUNS.run_id).all()
-        session.close()
-        return [run.to_json() for run in list(runs)]
+        return self.list_runs(RunStates.FAILED.value)
 
     def successful_runs(self):
-        session = self.factory()
-        runs = session.query(TESTRUNS).filter(TESTRUNS.run_state == RunStates.SUCCESS.value).order_by(
-            TESTRUNS.run_id).all()
-        session.close()
-        return [run.to_json() for run in list(runs)]
+        return self.list_runs(RunStates.SUCCESS.value)
 
     def initiated_runs(self):
-        session = self.factory()
-        runs = session.query(TESTRUNS).filter(TESTRUNS.run_state == RunStates.INITIATED.value).order_by(
-            TESTRUNS.run_id).all()
-        session.close()
-        return [run.to_json() for run in list(runs)]
+        return self.list_runs(RunStates.INITIATED.value)
 
     def update_run_state(self, run_id, run_state):
         session = self.factory()
         session.query(TESTRUNS).filter(TESTRUNS.run_id == run_id).update({TESTRUNS.run_state: run_state})
+        session.execute(self._record_events(TESTRUNS.run_id == run_id))
         session.commit()
         session.close()
+        self._notify_run_events()
 
     def delete_run_from_queue(self, run_id):
         session = self.factory()
+        session.execute(self._record_events(TESTRUNS.run_id == run_id, deleted=True))
         session.query(TESTRUNS).filter(TESTRUNS.run_id == run_id).delete()
         session.commit()
         session.close()
+        self._notify_run_events()
 
     @property
     def queue(self):
@@ -88,11 +165,79 @@ class SQLAlchemyTableHelper:
         test_run.run_name = run_name
         test_run.run_state = RunStates.PENDING.value
         session.add(test_run)
-        session.commit()
+        session.flush()
         run_id = test_run.run_id
+        session.execute(self._record_events(TESTRUNS.run_id == run_id))
+        session.execute(sqlalchemy.delete(run_event).where(run_event.event_id <= sqlalchemy.select(
+            sqlalchemy.func.max(run_event.event_id)).scalar_subquery() - Properties.run_events_kept).execution_options(
+            synchronize_session=False))
+        session.commit()
         session.close()
+        self._notify_run_events()
         return run_id
 
+    @staticmethod
+    def _record_events(where, deleted=False):
+        """
+        INSERT ... SELECT of one RUN_EVENTS row per run matching `where`, carrying its current state
+        Executed in the transaction of the change, after it for inserts and updates and before it for deletes
+        :param where: TESTRUNS criterion
+        :param deleted: record the runs as deleted, i.e. with no run_state
+        :return:
+        """
+        columns = TESTRUNS.__table__.c
+        run_state = sqlalchemy.null() if deleted else columns.run_state
+        return sqlalchemy.insert(run_event).from_select(
+            ['run_id', 'run_name', 'run_state', 'created_at'],
+            sqlalchemy.select(columns.run_id, columns.run_name, run_state,
+                              sqlalchemy.literal(datetime.datetime.now(), sqlalchemy.DateTime)).where(where).order_by(
+                columns.run_id))
+
+    def _notify_run_events(self):
+        with self.run_events_written:
+            self.run_event_writes += 1
+            self.run_events_written.notify_all()
+
+    def wait_for_run_events(self, seen, timeout):
+        """
+        Block until this process writes run events past the run_event_writes value `seen`, or for `timeout` seconds
+        Changes made by other processes, e.g. the TriggerRun scheduler, are not signalled, callers poll run_events
+        at least every `timeout` for those
+        :param seen: run_event_writes read before the last run_events call
+        :param timeout: seconds
+        :return: True when woken by a write
+        """
+        with self.run_events_written:
+            return self.run_events_written.wait_for(lambda: self.run_event_writes != seen, timeout)
+
+    def run_events(self, after_event_id=None, limit=None):
+        """
+        RUN_EVENTS in event_id order, a range scan of the primary key
+        :param after_event_id: only events after this event_id, i.e. the id of the last event already seen
+        :param limit: most events to return, None for all of them
+        :return: list of {'event_id', 'run_id', 'run_name', 'run_state', 'created_at'} dicts, created_at in ISO format
+        """
+        columns = run_event.__table__.c
+        query = sqlalchemy.select(columns.event_id, columns.run_id, columns.run_name, columns.run_state,
+                                  columns.created_at).order_by(columns.event_id)
+        if after_event_id is not None:
+            query = query.where(columns.event_id > after_event_id)
+        if limit is not None:
+            query = query.limit(limit)
+        with self.engine.connect() as conn:
+            return [{'event_id': event_id, 'run_id': run_id, 'run_name': run_name, 'run_state': run_state,
+                     'created_at': created_at.isoformat()}
+                    for event_id, run_id, run_name, run_state, created_at in conn.execute(query)]
+
+    def run_event_range(self):
+        """
+        :return: (oldest, latest) event_id still in RUN_EVENTS, (None, None) when it is empty
+        """
+        columns = run_event.__table__.c
+        with self.engine.connect() as conn:
+            return tuple(conn.execute(sqlalchemy.select(sqlalchemy.func.min(columns.event_id),
+                                                        sqlalchemy.func.max(columns.event_id))).one())
+
 
 if __name__ == '__main__':
     t = SQLAlchemyTableHelper()
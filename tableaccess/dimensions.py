@@ -0,0 +1,76 @@
+import threading
+
+import sqlalchemy
+from sqlalchemy.dialects.sqlite import insert
+
+from tableobjects.service_dimension import service_dimension
+from tableobjects.tag_dimension import tag_dimension
+
+DIMENSION_TABLES = {'service': service_dimension.__table__, 'tag': tag_dimension.__table__}
+
+
+class DimensionCache:
+    """
+    In-process name <-> id maps of SERVICE_DIMENSION and TAG_DIMENSION
+    Ids never change once assigned, so cached entries stay valid; a name or id this process hasn't seen reloads the
+    dictionary, which also picks up what other processes added. Lookups read plain dicts replaced whole on reload,
+    the lock only keeps reloads and inserts from running twice
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.ids = {dimension: {} for dimension in DIMENSION_TABLES}
+        self.names = {dimension: {} for dimension in DIMENSION_TABLES}
+        self.lock = threading.Lock()
+
+    def reload(self, dimension):
+        table = DIMENSION_TABLES[dimension]
+        with self.engine.connect() as conn:
+            rows = conn.execute(sqlalchemy.select(table.c.id, table.c.name)).all()
+        self.ids[dimension] = {name: dimension_id for dimension_id, name in rows}
+        self.names[dimension] = {dimension_id: name for dimension_id, name in rows}
+
+    def encode(self, dimension, names):
+        """
+        Ids of names, adding the names the dictionary doesn't have yet
+        New names are committed in a transaction of their own before the caller writes rows pointing at them, so a
+        rolled back write never leaves this cache holding an id that doesn't exist
+        :param dimension: service or tag
+        :param names: iterable of names, None maps to None
+        :return: {name: id}
+        """
+        names = set(names)
+        ids = self.ids[dimension]
+        if any(name not in ids for name in names if name is not None):
+            with self.lock:
+                missing = [name for name in names if name is not None and name not in self.ids[dimension]]
+                if missing:
+                    table = DIMENSION_TABLES[dimension]
+                    with self.engine.begin() as conn:
+                        conn.execute(insert(table).on_conflict_do_nothing(index_elements=[table.c.name]),
+                                     [{'name': name} for name in sorted(missing)])
+                    self.reload(dimension)
+            ids = self.ids[dimension]
+        return {name: ids[name] if name is not None else None for name in names}
+
+    def id_of(self, dimension, name):
+        """
+        Id of an existing name, for filters
+        :return: None when no row was ever written with that name
+        """
+        if name not in self.ids[dimension]:
+            with self.lock:
+                if name not in self.ids[dimension]:
+                    self.reload(dimension)
+        return self.ids[dimension].get(name)
+
+    def name_of(self, dimension, dimension_id):
+        if dimension_id is None:
+            return None
+        name = self.names[dimension].get(dimension_id)
+        if name is None:
+            with self.lock:
+                if dimension_id not in self.names[dimension]:
+                    self.reload(dimension)
+            name = self.names[dimension][dimension_id]
+        return name
@@ -0,0 +1,196 @@
+import argparse
+import itertools
+
+import sqlalchemy
+from sqlalchemy.schema import CreateTable
+
+from common.custom_logging import CustomLogger
+from tableaccess.dimensions import DIMENSION_TABLES
+from tableaccess.properties import Properties, CloudType
+from tableaccess.retention import compacted_before
+from tableobjects.cost_by_hour import cost_by_hour
+from tableobjects.cost_by_time import cost_by_time
+from tableobjects.meta_base import ModelBase
+
+logger = CustomLogger.getLogger(__name__)
+
+
+def add_missing_columns(engine, table):
+    """
+    metadata.create_all never alters an existing table. ALTER TABLE ADD COLUMN the nullable columns declared on the
+    model since the table was created
+    :param engine:
+    :param table: sqlalchemy Table
+    :return: names of the columns added
+    """
+    existing = {column['name'] for column in sqlalchemy.inspect(engine).get_columns(table.name)}
+    added = []
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            logger.info(f'Adding column {column.name} to {table.name}')
+            column_type = column.type.compile(dialect=engine.dialect)
+            conn.execute(sqlalchemy.text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            added.append(column.name)
+    return added
+
+
+def populate_time_buckets(engine):
+    """
+    Fill hour_bucket/minute_bucket of COST_BY_TIME rows written before the columns existed
+    strftime('%s') reads the naive timestamp the same way cost_by_time.buckets does
+    :param engine:
+    :return: number of rows updated
+    """
+    raw = cost_by_time.__table__
+    epoch_seconds = sqlalchemy.cast(sqlalchemy.func.strftime('%s', raw.c.timestamp), sqlalchemy.Integer)
+    with engine.begin() as conn:
+        updated = conn.execute(raw.update().where(raw.c.hour_bucket.is_(None)).values(
+            minute_bucket=epoch_seconds / 60, hour_bucket=epoch_seconds / 3600)).rowcount
+    if updated:
+        logger.info(f'Populated time buckets of {updated} rows in {raw.name}')
+    return updated
+
+
+def create_missing_indexes(engine, table):
+    """
+    metadata.create_all skips tables that already exist, and with them any index declared later on the model.
+    Create such indexes in place so an existing database picks them up at startup without rebuilding its data
+    :param engine:
+    :param table: sqlalchemy Table whose declared indexes should exist
+    :return: names of the indexes created
+    """
+    existing = {index['name'] for index in sqlalchemy.inspect(engine).get_indexes(table.name)}
+    created = []
+    for index in sorted(table.indexes, key=lambda i: i.name):
+        if index.name in existing:
+            continue
+        logger.info(f'Creating index {index.name} on {table.name}')
+        index.create(bind=engine)
+        created.append(index.name)
+    if created:
+        with engine.begin() as conn:
+            conn.execute(sqlalchemy.text(f'ANALYZE "{table.name}"'))
+    return created
+
+
+def encode_dimensions(engine):
+    """
+    Rewrite COST_BY_TIME and COST_BY_HOUR tables still holding service/tag names to hold SERVICE_DIMENSION and
+    TAG_DIMENSION ids instead
+    Step 1-> Every distinct name goes into its dimension table
+    Step 2-> Per table: rename it aside, create the table of the model without its indexes, copy the rows across
+             joined to the dimension tables by name, drop the old one and build the indexes on the copied data
+    All in one transaction, a failure leaves the database as it was. VACUUM afterwards returns the space of the
+    name columns and indexes to the filesystem
+    :param engine:
+    :return: names of the tables rewritten
+    """
+    legacy = [table for table in (cost_by_time.__table__, cost_by_hour.__table__)
+              if 'service' in {column['name'] for column in sqlalchemy.inspect(engine).get_columns(table.name)}]
+    if not legacy:
+        return []
+    with engine.begin() as conn:
+        for dimension, dimension_table in DIMENSION_TABLES.items():
+            names = sqlalchemy.union(*[sqlalchemy.select(sqlalchemy.column(dimension)).select_from(
+                sqlalchemy.table(table.name)).where(sqlalchemy.column(dimension).isnot(None)) for table in legacy])
+            conn.execute(dimension_table.insert().prefix_with('OR IGNORE').from_select(['name'], names))
+        for table in legacy:
+            logger.info(f'Encoding service/tag of {table.name} as dimension ids')
+            old_name = f'{table.name}_LEGACY'
+            for index in sqlalchemy.inspect(conn).get_indexes(table.name):
+                conn.execute(sqlalchemy.text(f'DROP INDEX "{index["name"]}"'))
+            conn.execute(sqlalchemy.text(f'ALTER TABLE "{table.name}" RENAME TO "{old_name}"'))
+            conn.execute(CreateTable(table))
+            kept = [column.name for column in table.columns if column.name not in ('service_id', 'tag_id')]
+            old = sqlalchemy.table(old_name, *[sqlalchemy.column(name) for name in kept + ['service', 'tag']])
+            service, tag = (DIMENSION_TABLES[dimension].alias(dimension) for dimension in ('service', 'tag'))
+            copied = sqlalchemy.select(*[old.c[name] for name in kept], service.c.id, tag.c.id).select_from(
+                old.outerjoin(service, old.c.service == service.c.name).outerjoin(tag, old.c.tag == tag.c.name))
+            conn.execute(table.insert().from_select(kept + ['service_id', 'tag_id'], copied))
+            conn.execute(sqlalchemy.text(f'DROP TABLE "{old_name}"'))
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                index.create(bind=conn)
+            conn.execute(sqlalchemy.text(f'ANALYZE "{table.name}"'))
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(sqlalchemy.text('VACUUM'))
+    return [table.name for table in legacy]
+
+
+def backfill_hourly_rollup(engine, only_if_empty=False, chunk_size=10000):
+    """
+    Rebuild COST_BY_HOUR from the raw COST_BY_TIME samples
+    Query 1-> Group raw samples by cloud, hour_bucket, service_id, tag_id and minute_bucket -> sum(cost), count
+              (ix_cost_by_time_cloud_hour_bucket order, no sorting)
+    Fold  1-> Consecutive minute groups of the same (cloud, hour, service, tag) make one rollup row, each minute
+              sets its bit in minute_mask
+    Runs in one transaction so readers never see a partially built rollup
+    Hours before a cloud's retention watermark are kept as they are, their raw samples were compacted away
+    :param engine:
+    :param only_if_empty: skip unless the rollup is empty while raw samples exist, i.e. first start after upgrade
+    :param chunk_size: rollup rows per executemany
+    :return: number of rollup rows written
+    """
+    raw = cost_by_time.__table__
+    rollup = cost_by_hour.__table__
+    with engine.begin() as conn:
+        if only_if_empty and (conn.execute(sqlalchemy.select(rollup.c.hour).limit(1)).first() or
+                              not conn.execute(sqlalchemy.select(raw.c.SN).limit(1)).first()):
+            return 0
+        logger.info(f'Backfilling {rollup.name} from {raw.name}')
+        watermarks = compacted_before(conn)
+
+        def minute_groups_of(cloud_type):
+            rebuilt = rollup.c.cloud_type == cloud_type
+            query = sqlalchemy.select(
+                raw.c.cloud_type, raw.c.hour_bucket, raw.c.service_id, raw.c.tag_id, raw.c.minute_bucket,
+                sqlalchemy.func.sum(raw.c.cost_per_hour), sqlalchemy.func.count()).where(raw.c.cloud_type == cloud_type)
+            if cloud_type in watermarks:
+                rebuilt = sqlalchemy.and_(rebuilt, rollup.c.hour >= watermarks[cloud_type])
+                query = query.where(raw.c.hour_bucket >= cost_by_time.buckets(watermarks[cloud_type])[0])
+            conn.execute(rollup.delete().where(rebuilt))
+            return conn.execute(query.group_by(
+                raw.c.cloud_type, raw.c.hour_bucket, raw.c.service_id, raw.c.tag_id, raw.c.minute_bucket).order_by(
+                raw.c.cloud_type, raw.c.hour_bucket, raw.c.service_id, raw.c.tag_id, raw.c.minute_bucket))
+
+        minute_groups = itertools.chain.from_iterable(minute_groups_of(cloud_type) for cloud_type in CloudType)
+
+        written = 0
+        pending = []
+        current_key = None
+        for cloud_type, hour_bucket, service_id, tag_id, minute_bucket, cost, count in minute_groups:
+            if (cloud_type, hour_bucket, service_id, tag_id) != current_key:
+                if len(pending) == chunk_size:
+                    conn.execute(rollup.insert(), pending)
+                    written += len(pending)
+                    pending = []
+                current_key = (cloud_type, hour_bucket, service_id, tag_id)
+                pending.append({'cloud_type': cloud_type, 'hour': cost_by_time.hour_of(hour_bucket),
+                                'service_id': service_id, 'tag_id': tag_id,
+                                'total_cost': 0, 'sample_count': 0, 'minute_mask': 0})
+            pending[-1]['total_cost'] += cost
+            pending[-1]['sample_count'] += count
+            pending[-1]['minute_mask'] |= 1 << (minute_bucket - hour_bucket * 60)
+        if pending:
+            conn.execute(rollup.insert(), pending)
+            written += len(pending)
+    logger.info(f'Backfilled {written} rows into {rollup.name}')
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cost tracker database maintenance')
+    parser.add_argument('--db', default=Properties.cost_tracker_sqlite_db, help='CostTracker sqlite database')
+    parser.add_argument('--backfill-rollup', action='store_true', help=f'Rebuild {cost_by_hour.__tablename__}')
+    parser.add_argument('--encode-dimensions', action='store_true',
+                        help='Replace service/tag names by dimension ids, also done at startup')
+    args = parser.parse_args()
+    if args.backfill_rollup or args.encode_dimensions:
+        cost_engine = sqlalchemy.create_engine(f'sqlite:///{args.db}')
+        ModelBase.metadata.create_all(cost_engine)
+        add_missing_columns(cost_engine, cost_by_time.__table__)
+        populate_time_buckets(cost_engine)
+        encode_dimensions(cost_engine)
+        if args.backfill_rollup:
+            backfill_hourly_rollup(cost_engine)
@@ -2,9 +2,79 @@ import enum
 import os
 
 
+class EngineProfile:
+    """
+    SQLite connection settings, applied by AccessFactory to every new pooled connection
+    A pragma set to None keeps the SQLite default
+    WAL lets the poller/scheduler processes write while the Flask processes keep reading
+    """
+
+    def __init__(self, journal_mode='WAL', synchronous='NORMAL', cache_size=-16000, mmap_size=268435456,
+                 busy_timeout=5000, pool_class='QueuePool', pool_size=5, max_overflow=10):
+        """
+        :param journal_mode: DELETE, WAL, ...
+        :param synchronous: FULL, NORMAL, OFF. NORMAL is durable across application crashes in WAL mode
+        :param cache_size: pages, or KiB when negative
+        :param mmap_size: bytes of the database file to memory map
+        :param busy_timeout: milliseconds to wait on a locked database before raising
+        :param pool_class: name of a sqlalchemy.pool class (QueuePool, SingletonThreadPool, NullPool, ...)
+        :param pool_size: connections kept open (QueuePool, SingletonThreadPool)
+        :param max_overflow: connections opened beyond pool_size under load (QueuePool)
+        """
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.pool_class = pool_class
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+
+    def pragmas(self):
+        settings = [('journal_mode', self.journal_mode), ('synchronous', self.synchronous),
+                    ('cache_size', self.cache_size), ('mmap_size', self.mmap_size),
+                    ('busy_timeout', self.busy_timeout)]
+        return [f'PRAGMA {name} = {value}' for name, value in settings if value is not None]
+
+
 class Properties:
     sqlite_db_path = os.path.join(os.path.dirname(__file__), 'RunQueue.db')
     cost_tracker_sqlite_db = os.path.join(os.path.dirname(__file__), 'CostTracker.db')
+    run_queue_engine_profile = EngineProfile()
+    cost_tracker_engine_profile = EngineProfile()
+    response_cache_ttl_seconds = 120
+    response_cache_max_entries = 1024
+    scheduler_concurrency = 4
+    scheduler_idle_poll_seconds = 5
+    run_lease_seconds = 300
+    # Raw samples older than this many days are deleted, their history lives on in the hourly rollup. Off by default:
+    # sample export and latest_* read the raw samples, so turning it on limits both to the retained days
+    raw_sample_retention_days = None
+    retention_batch_size = 5000
+    retention_interval_seconds = 3600
+    # Log through a per process queue and listener thread into logs/runs.<pid>.log, as JSON lines when json_logs
+    async_logging = True
+    json_logs = True
+    # Consumption collectors: sources run on a thread pool, each every interval +/- jitter (a fraction of it),
+    # failing ones back off exponentially up to the maximum
+    collector_interval_seconds = 120
+    collector_max_workers = 8
+    collector_jitter = 0.1
+    collector_max_backoff_seconds = 1800
+    # Samples kept for the next cycle while writing them fails
+    collector_max_unwritten_samples = 100000
+    # Threads the ASGI entry point runs database reads and the wrapped Flask app on
+    asgi_db_workers = 8
+    # Identical table helper reads running at the same time share one query
+    single_flight_reads = True
+    # NDJSON sample uploads are checked in full before any is written, spooled in memory up to this size, then on disk
+    samples_spool_max_bytes = 8 * 1024 * 1024
+    # GET /runs/events: newest RUN_EVENTS kept for clients resuming by Last-Event-ID, seconds between checks for
+    # changes made by other processes, between keep-alive comments, and the reconnect delay sent to clients
+    run_events_kept = 10000
+    run_events_poll_seconds = 1
+    run_events_keepalive_seconds = 15
+    run_events_retry_milliseconds = 3000
 
 
 class RunStates(enum.Enum):
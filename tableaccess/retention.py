@@ -0,0 +1,84 @@
+import argparse
+import datetime
+
+import sqlalchemy
+from sqlalchemy.dialects.sqlite import insert
+
+from common.custom_logging import CustomLogger
+from tableaccess.properties import Properties, CloudType
+from tableobjects.cost_by_time import cost_by_time
+from tableobjects.retention_watermark import retention_watermark
+
+logger = CustomLogger.getLogger(__name__)
+
+
+def compacted_before(conn):
+    """
+    :param conn: connection, so callers can read the watermarks inside their own transaction
+    :return: {CloudType: hour before which raw samples were compacted away}, clouds never compacted are missing
+    """
+    marks = conn.execute(sqlalchemy.select(retention_watermark.cloud_type, retention_watermark.compacted_before))
+    return dict(marks.fetchall())
+
+
+def compact_raw_samples(engine, retention_days=None, batch_size=None, now=None):
+    """
+    Age raw COST_BY_TIME samples older than the retention horizon out of the table
+    Their history is already in COST_BY_HOUR, which ingest maintains in the same transaction as the raw insert,
+    so aggregate_by_*/total_cost_* answer exactly as before. latest_* and the sample export still read raw samples,
+    which is why retention only runs once Properties.raw_sample_retention_days is set
+    Step 1-> Move the cloud's watermark up to the horizon (whole hours), from then on backfill_hourly_rollup keeps the
+             rollup of earlier hours instead of rebuilding it from raw samples that are about to go
+    Step 2-> DELETE ... WHERE SN IN (SELECT SN ... LIMIT batch_size), one transaction per batch so ingest and
+             readers interleave with a long compaction, until a batch comes back short
+    :param engine:
+    :param retention_days: defaults to Properties.raw_sample_retention_days, nothing is deleted when both are None
+    :param batch_size: rows deleted per transaction, defaults to Properties.retention_batch_size
+    :param now: defaults to datetime.datetime.now()
+    :return: {CloudType: raw samples deleted}
+    """
+    retention_days = retention_days or Properties.raw_sample_retention_days
+    if retention_days is None:
+        return {}
+    batch_size = batch_size or Properties.retention_batch_size
+    horizon = ((now or datetime.datetime.now()) - datetime.timedelta(days=retention_days)).replace(
+        minute=0, second=0, microsecond=0)
+    raw = cost_by_time.__table__
+    deleted = {}
+    for cloud_type in CloudType:
+        upsert = insert(retention_watermark).values(cloud_type=cloud_type, compacted_before=horizon)
+        upsert = upsert.on_conflict_do_update(index_elements=[retention_watermark.cloud_type], set_={
+            retention_watermark.compacted_before: sqlalchemy.func.max(retention_watermark.compacted_before,
+                                                                      upsert.excluded.compacted_before)})
+        with engine.begin() as conn:
+            conn.execute(upsert)
+            watermark = compacted_before(conn)[cloud_type]
+
+        # Samples posted late for an already compacted hour are in the rollup too, they go as well
+        hour_bucket, _ = cost_by_time.buckets(watermark)
+        expired = sqlalchemy.select(raw.c.SN).where(raw.c.cloud_type == cloud_type).where(
+            raw.c.hour_bucket < hour_bucket).limit(batch_size)
+        deleted[cloud_type] = 0
+        while True:
+            with engine.begin() as conn:
+                count = conn.execute(raw.delete().where(raw.c.SN.in_(expired))).rowcount
+            deleted[cloud_type] += count
+            if count < batch_size:
+                break
+        if deleted[cloud_type]:
+            logger.info(f'Compacted {deleted[cloud_type]} {cloud_type.value} samples before {watermark} out of '
+                        f'{raw.name}')
+    return deleted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete raw cost samples already summarised in the hourly rollup')
+    parser.add_argument('--db', default=Properties.cost_tracker_sqlite_db, help='CostTracker sqlite database')
+    parser.add_argument('--retention-days', type=int, default=Properties.raw_sample_retention_days,
+                        required=Properties.raw_sample_retention_days is None)
+    parser.add_argument('--batch-size', type=int, default=Properties.retention_batch_size)
+    args = parser.parse_args()
+    # The helper brings the database up to date first (time buckets, rollup backfill), compaction relies on both.
+    # Imported here, the helper module imports this one through tableaccess.migrations
+    from tableaccess.AccessFactory import AccessFactory
+    AccessFactory.get_cost_by_time_db_conn(db_path=args.db).apply_retention(args.retention_days, args.batch_size)
@@ -9,6 +9,13 @@ class TESTRUNS(ModelBase):
     run_id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     run_name = sqlalchemy.Column(sqlalchemy.String)
     run_state = sqlalchemy.Column(sqlalchemy.String)
+    # Scheduler holding the run while INITIATED/RUNNING, until lease_expires_at when another scheduler may reclaim it
+    claimed_by = sqlalchemy.Column(sqlalchemy.String)
+    lease_expires_at = sqlalchemy.Column(sqlalchemy.DateTime)
+
+    __table_args__ = (
+        sqlalchemy.Index('ix_testruns_state_run_id', 'run_state', 'run_id'),
+    )
 
     def to_json(self):
         return {
@@ -0,0 +1,14 @@
+import sqlalchemy
+
+from tableaccess.properties import CloudType
+from tableobjects.meta_base import ModelBase
+
+
+class cache_generation(ModelBase):
+    """
+    Per cloud counter bumped by every ingest commit
+    Result caches in any process compare it to the generation their entries were computed at
+    """
+    __tablename__ = 'CACHE_GENERATION'
+    cloud_type = sqlalchemy.Column(sqlalchemy.Enum(CloudType), primary_key=True)
+    generation = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0)
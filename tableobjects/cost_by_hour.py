@@ -0,0 +1,38 @@
+import datetime
+
+import sqlalchemy
+
+from tableaccess.properties import CloudType
+from tableobjects.meta_base import ModelBase
+
+
+class cost_by_hour(ModelBase):
+    """
+    Hourly rollup of COST_BY_TIME, maintained on ingest
+    total_cost and sample_count give the per (service, tag) hourly average, minute_mask has bit n set when any
+    sample landed on minute n of the hour so per service/per tag averages can count distinct minutes across tags
+    """
+    __tablename__ = 'COST_BY_HOUR'
+    cloud_type = sqlalchemy.Column(sqlalchemy.Enum(CloudType), primary_key=True)
+    hour = sqlalchemy.Column(sqlalchemy.DateTime, primary_key=True)
+    # Ids of SERVICE_DIMENSION/TAG_DIMENSION, see tableaccess.dimensions
+    service_id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    tag_id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    total_cost = sqlalchemy.Column(sqlalchemy.INT, nullable=False, default=0)
+    sample_count = sqlalchemy.Column(sqlalchemy.INT, nullable=False, default=0)
+    minute_mask = sqlalchemy.Column(sqlalchemy.INT, nullable=False, default=0)
+
+    @staticmethod
+    def bucket(timestamp: datetime.datetime):
+        """
+        :param timestamp: sample timestamp
+        :return: (hour the sample rolls up into, minute_mask bit of the sample)
+        """
+        return timestamp.replace(minute=0, second=0, microsecond=0), 1 << timestamp.minute
+
+    @staticmethod
+    def minutes(minute_mask):
+        """
+        Number of distinct minutes set in a minute_mask
+        """
+        return bin(minute_mask).count('1')
@@ -11,15 +11,54 @@ class cost_by_time(ModelBase):
     SN = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     timestamp = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
     cloud_type = sqlalchemy.Column(sqlalchemy.Enum(CloudType))
-    tag = sqlalchemy.Column(sqlalchemy.String)
-    service = sqlalchemy.Column(sqlalchemy.String)
+    # Ids of SERVICE_DIMENSION/TAG_DIMENSION, see tableaccess.dimensions
+    tag_id = sqlalchemy.Column(sqlalchemy.Integer)
+    service_id = sqlalchemy.Column(sqlalchemy.Integer)
     cost_per_hour = sqlalchemy.Column(sqlalchemy.INT)
+    # Whole hours/minutes since the epoch, set at insert from timestamp (see buckets)
+    # Integer buckets let grouping by hour/minute follow an index instead of sorting strftime() results
+    hour_bucket = sqlalchemy.Column(sqlalchemy.Integer)
+    minute_bucket = sqlalchemy.Column(sqlalchemy.Integer)
 
-    def to_json(self):
+    # Every read filters on cloud_type and a timestamp range, optionally narrowed by service or tag.
+    # Trailing columns make the indexes covering so aggregations never have to visit the table itself
+    __table_args__ = (
+        sqlalchemy.Index('ix_cost_by_time_cloud_ts', 'cloud_type', 'timestamp', 'service_id', 'tag_id',
+                         'cost_per_hour'),
+        sqlalchemy.Index('ix_cost_by_time_cloud_service_ts', 'cloud_type', 'service_id', 'timestamp', 'tag_id',
+                         'cost_per_hour'),
+        sqlalchemy.Index('ix_cost_by_time_cloud_tag_ts', 'cloud_type', 'tag_id', 'timestamp', 'service_id',
+                         'cost_per_hour'),
+        sqlalchemy.Index('ix_cost_by_time_cloud_hour_bucket', 'cloud_type', 'hour_bucket', 'service_id', 'tag_id',
+                         'minute_bucket', 'cost_per_hour'),
+    )
+
+    epoch = datetime.datetime(1970, 1, 1)
+
+    @staticmethod
+    def buckets(timestamp: datetime.datetime):
+        """
+        :param timestamp: naive sample timestamp, treated like SQLite's strftime('%s') does
+        :return: (hour_bucket, minute_bucket)
+        """
+        minute_bucket = (timestamp - cost_by_time.epoch) // datetime.timedelta(minutes=1)
+        return minute_bucket // 60, minute_bucket
+
+    @staticmethod
+    def hour_of(hour_bucket):
+        """
+        Start of the hour of an hour_bucket
+        """
+        return cost_by_time.epoch + datetime.timedelta(hours=hour_bucket)
+
+    def to_json(self, dimensions):
+        """
+        :param dimensions: tableaccess.dimensions.DimensionCache decoding the service/tag ids
+        """
         return {
             'SN': self.SN,
             'timestamp': datetime.datetime.strftime(self.timestamp, '%Y-%m-%d %H:%M:%S'),
-            'tag': self.tag,
-            'service': self.service,
+            'tag': dimensions.name_of('tag', self.tag_id),
+            'service': dimensions.name_of('service', self.service_id),
             'cost_per_hour': self.cost_per_hour
         }
@@ -6,10 +6,10 @@ create_table = """CREATE TABLE IF NOT EXISTS TESTRUNS (
 
 insert_row = """INSERT INTO TESTRUNS (run_name, run_state)  values(?,?);"""
 
-runs_in_state = """SELECT * FROM TESTRUNS WHERE RUN_STATE == ?;"""
+runs_in_state = """SELECT RUN_ID, RUN_NAME, RUN_STATE FROM TESTRUNS WHERE RUN_STATE == ?;"""
 
 update_run_status = """UPDATE TESTRUNS SET RUN_STATE == ? WHERE RUN_ID == ?;"""
 
-all_runs = """SELECT * FROM TESTRUNS"""
+all_runs = """SELECT RUN_ID, RUN_NAME, RUN_STATE FROM TESTRUNS"""
 
 last_insert_rowid = """SELECT last_insert_rowid();"""
\ No newline at end of file
@@ -0,0 +1,15 @@
+import sqlalchemy
+
+from tableaccess.properties import CloudType
+from tableobjects.meta_base import ModelBase
+
+
+class retention_watermark(ModelBase):
+    """
+    Per cloud hour before which raw COST_BY_TIME samples have been compacted away
+    COST_BY_HOUR alone holds the history of hours earlier than compacted_before, so rebuilding the rollup from raw
+    samples must leave those hours alone
+    """
+    __tablename__ = 'RETENTION_WATERMARK'
+    cloud_type = sqlalchemy.Column(sqlalchemy.Enum(CloudType), primary_key=True)
+    compacted_before = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False)
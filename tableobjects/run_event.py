@@ -0,0 +1,19 @@
+import sqlalchemy
+
+from tableobjects.meta_base import ModelBase
+
+
+class run_event(ModelBase):
+    """
+    Append only log of TESTRUNS changes, written in the transaction of the change itself
+    event_id orders the log across every process sharing RunQueue.db and is the id GET /runs/events resumes from.
+    AUTOINCREMENT keeps ids of pruned events from being handed out again, so a client cursor stays meaningful
+    run_state is None for a run deleted from the queue
+    """
+    __tablename__ = 'RUN_EVENTS'
+    __table_args__ = {'sqlite_autoincrement': True}
+    event_id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    run_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    run_name = sqlalchemy.Column(sqlalchemy.String)
+    run_state = sqlalchemy.Column(sqlalchemy.String)
+    created_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False)
@@ -0,0 +1,13 @@
+import sqlalchemy
+
+from tableobjects.meta_base import ModelBase
+
+
+class tag_dimension(ModelBase):
+    """
+    Dictionary of tag names, COST_BY_TIME and COST_BY_HOUR store the id
+    Ids are never reassigned or deleted, so every process may keep them cached
+    """
+    __tablename__ = 'TAG_DIMENSION'
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    name = sqlalchemy.Column(sqlalchemy.String, nullable=False, unique=True)